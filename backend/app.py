@@ -1,22 +1,55 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import requests
 import json
 import os
-import networkx as nx
 from shapely.geometry import Point, LineString
 from pathlib import Path
-import math
 import numpy as np
-from typing import Optional
+from typing import List, Optional
+from pydantic import BaseModel
 import qrcode
 import io
-from fastapi.responses import StreamingResponse
-from mtag_api import calculate_tram_route  # Import the function from mtag_api.py
+from fastapi.responses import JSONResponse, StreamingResponse
+from mtag_api import calculate_tram_route, mtag_client, schedule_cache, MTAGError  # Import the function from mtag_api.py
+from routing_graph import graph_registry, graph_stats, ALLOWED_TYPES, ROADS_FILE, TRANSPORT_FILE
+from graph_updates import apply_updates, update_report
+from geocoding import geocoder, GeocodingError
+from serialized_file import SerializedFile
+from tiles import tile_layers, MAX_ZOOM
+from route_index import route_index
+from matrix import compute_matrix, stream_matrix, MATRIX_MAX_PAIRS
+from isochrone import isochrone, ISOCHRONE_MODES
+from route_cache import route_cache
+from road_route import road_route, local_transit_plan, transit_cache_key
+from routing_pool import routing_pool, PoolSaturated, RoutingTimeout, ClientDisconnected
+import polyline
+import metrics
+from metrics import log, log_error, span
 import random
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import asyncio
+import time
 
-app = FastAPI(title="Grenoble Transport API")
+@asynccontextmanager
+async def lifespan(app):
+    monitor = asyncio.create_task(metrics.monitor_event_loop()) if metrics.EVENT_LOOP_MONITOR_INTERVAL > 0 else None
+    # Processus de calcul des itinéraires, qui chargent leurs graphes pendant le démarrage
+    routing_pool.start()
+    # Répertoire local des adresses construit en arrière-plan, hors de la boucle d'événements
+    gazetteer = asyncio.create_task(geocoder.load_gazetteer())
+    yield
+    if monitor is not None:
+        monitor.cancel()
+    if not gazetteer.done():
+        gazetteer.cancel()
+    # Fermer les connexions gardées ouvertes vers MTAG et Nominatim (et enregistrer le cache des adresses)
+    await mtag_client.close()
+    await geocoder.close()
+    # Arrêter les processus de calcul des itinéraires
+    routing_pool.shutdown()
+
+app = FastAPI(title="Grenoble Transport API", lifespan=lifespan)
 
 # CORS middleware for frontend access
 app.add_middleware(
@@ -27,6 +60,27 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Duration of each request and of its stages (metrics.span), also sent in a Server-Timing header"""
+    trace, token = metrics.start_trace()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_trace(token)
+    elapsed = time.perf_counter() - start
+    # Le modèle de l'URL (/api/tiles/{layer}/{z}/{x}/{y}) et non l'URL elle-même, pour borner les séries
+    route = request.scope.get("route")
+    metrics.request_duration.observe(elapsed, method=request.method,
+                                     route=route.path if route is not None else "unmatched",
+                                     status=response.status_code)
+    response.headers["Server-Timing"] = metrics.server_timing(trace, elapsed)
+    if trace:
+        log(f"{request.method} {request.url.path} {response.status_code} {elapsed * 1000:.1f} ms "
+            + json.dumps({stage: round(duration * 1000, 2) for stage, duration in trace}))
+    return response
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 # Coordinates boundaries for Grenoble area
@@ -52,109 +106,133 @@ def read_root():
 
 @app.get("/api/mtag/{route_name}")
 async def get_mtag_data(route_name: str):
-    """Get schedule data from MTAG API for a specific route"""
+    """Get schedule data from MTAG API for a specific route (cached, see MTAG_SCHEDULE_TTL)"""
     try:
-        url = f"https://data.mobilites-m.fr/api/ficheHoraires/json?route=SEM%3A{route_name}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(status_code=response.status_code, detail="MTAG API request failed")
+        return await schedule_cache.get(route_name)
+    except MTAGError as e:
+        raise HTTPException(status_code=e.status_code or 502, detail=f"MTAG API request failed: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/geojson/routes")
-async def get_routes_data():
-    """Get route data from grenoble.geojson file"""
+# Fichiers GeoJSON gardés en mémoire déjà encodés et compressés
+routes_file = SerializedFile(ROADS_FILE)
+transport_file = SerializedFile(TRANSPORT_FILE)
+
+def payload_response(payload, request: Request):
+    """Send pre-encoded bytes, or a 304 if the client copy is still current"""
+    encoding = payload.select_encoding(request.headers.get("accept-encoding"))
+    headers = {
+        "ETag": payload.etags[encoding],
+        "Last-Modified": payload.last_modified,
+        "Cache-Control": "no-cache",  # toujours revalider, la réponse 304 est quasi gratuite
+        "Vary": "Accept-Encoding"
+    }
+    if payload.not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since")):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.bodies[encoding], media_type="application/json", headers=headers)
+
+async def serve_serialized(serialized: SerializedFile, request: Request):
     try:
-        file_path = os.path.join(BASE_DIR, "grenoble.geojson")
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        return data
+        payload = await serialized.get_async()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return payload_response(payload, request)
+
+@app.get("/api/geojson/routes")
+async def get_routes_data(request: Request):
+    """Get route data from grenoble.geojson file"""
+    return await serve_serialized(routes_file, request)
 
 @app.get("/api/geojson/transport")
-async def get_transport_data():
+async def get_transport_data(request: Request):
     """Get transport data from data_transport_commun_grenoble_formate.geojson file"""
+    return await serve_serialized(transport_file, request)
+
+@app.get("/api/tiles/{layer}/{z}/{x}/{y}")
+async def get_tile(layer: str, z: int, x: int, y: int, request: Request):
+    """GeoJSON tile (XYZ scheme, as Leaflet tile URLs) of the routes or transport layer
+
+    Only the features in view are sent, clipped to the tile and simplified for the zoom level.
+    """
+    tile_layer = tile_layers.get(layer)
+    if tile_layer is None:
+        raise HTTPException(status_code=404, detail=f"Unknown layer: {layer}")
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=400, detail=f"Invalid tile {z}/{x}/{y}")
     try:
-        file_path = os.path.join(BASE_DIR, "data_transport_commun_grenoble_formate.geojson")
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        return data
+        payload = await tile_layer.tile_async(z, x, y)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return payload_response(payload, request)
+
+@app.get("/api/tiles/stats")
+async def get_tiles_stats():
+    """Indexed features and tile cache use of each layer"""
+    return {layer: tile_layer.stats() for layer, tile_layer in tile_layers.items()}
 
 @app.get("/api/routes/filter")
-async def filter_routes(route_type: str = None, max_speed: int = None):
-    """Filter routes by type and/or max speed"""
+async def filter_routes(
+    request: Request,
+    route_type: str = None,
+    max_speed: int = None,
+    name: str = None,
+    oneway: Optional[bool] = None,
+    bbox: str = None
+):
+    """Filter routes by type (comma-separated list), max speed, name, one-way and/or bbox
+
+    bbox is "min_lng,min_lat,max_lng,max_lat". The answer is streamed in chunks.
+    """
+    bounds = None
+    if bbox:
+        try:
+            bounds = [float(value) for value in bbox.split(",")]
+        except ValueError:
+            bounds = []
+        if len(bounds) != 4:
+            raise HTTPException(status_code=400, detail="bbox must be min_lng,min_lat,max_lng,max_lat")
+
+    route_types = [t for t in route_type.split(",") if t] if route_type else None
+    if not (route_types or max_speed or name or oneway is not None or bounds):
+        # Sans filtre, c'est le fichier complet déjà encodé
+        return await serve_serialized(routes_file, request)
+
+    def query():
+        # La même version de l'index sert à la requête et à l'envoi des routes
+        index = route_index.current()
+        return index, index.query(route_types, max_speed, name, oneway, bounds)
+
     try:
-        file_path = os.path.join(BASE_DIR, "grenoble.geojson")
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-        
-        if route_type or max_speed:
-            filtered_features = []
-            for feature in data.get('features', []):
-                properties = feature.get('properties', {})
-                
-                # Apply filters
-                if route_type and properties.get('highway') != route_type:
-                    continue
-                if max_speed and properties.get('maxspeed') and int(properties.get('maxspeed')) > max_speed:
-                    continue
-                
-                filtered_features.append(feature)
-            
-            data['features'] = filtered_features
-        
-        return data
+        index, ids = await asyncio.to_thread(query)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(index.stream(ids), media_type="application/json",
+                             headers={"X-Feature-Count": str(len(ids))})
 
 @app.get("/api/geocode")
 async def geocode_address(address: str):
-    """Convert address to coordinates using Nominatim"""
+    """Convert address to coordinates (local gazetteer and cache first, then Nominatim)"""
     try:
-        # Use Nominatim for geocoding (OpenStreetMap's geocoding service)
-        headers = {
-            'User-Agent': 'GrenobleTransportApp/1.0'  # Required by Nominatim's terms
-        }
-        params = {
-            'q': address,
-            'format': 'json',
-            'limit': 1,
-            'addressdetails': 1,
-            'viewbox': '5.6,45.1,5.8,45.3',  # Viewbox around Grenoble
-            'bounded': 1
-        }
-        
-        response = requests.get('https://nominatim.openstreetmap.org/search', params=params, headers=headers)
-        if response.status_code == 200:
-            results = response.json()
-            if results and len(results) > 0:
-                return {
-                    "lat": float(results[0]["lat"]),
-                    "lng": float(results[0]["lon"]),
-                    "display_name": results[0]["display_name"]
-                }
-            else:
-                raise HTTPException(status_code=404, detail="Address not found")
-        else:
-            raise HTTPException(status_code=response.status_code, detail="Geocoding service error")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        result = await geocoder.geocode(address)
+    except GeocodingError as e:
+        raise HTTPException(status_code=e.status_code or 502, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Address not found")
+    return result
+
+@app.get("/api/geocode/stats")
+async def get_geocode_stats():
+    """Hits of the local gazetteer and of the geocoding cache"""
+    return geocoder.stats()
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    dLat = (lat2 - lat1) * math.pi / 180
-    dLon = (lon2 - lon1) * math.pi / 180
-    a = math.sin(dLat / 2) * math.sin(dLat / 2) + math.cos(lat1 * math.pi / 180) * math.cos(lat2 * math.pi / 180) * math.sin(dLon / 2) * math.sin(dLon / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+def extract_tram_route(tram_route, geometry="points", tolerance=None):
+    """Extract route points and other details from the tram route
 
-def extract_tram_route(tram_route):
-    """Extract route points and other details from the tram route"""
+    geometry selects the format of the points (see polyline.format_points). With a
+    tolerance (km), the shapes of the transit legs are simplified; walking legs keep
+    all their points, which are the turns of their instructions."""
     route_points = []
     segments = []
     total_distance = tram_route.get("walkDistance", 0) / 1000
@@ -192,18 +270,18 @@ def extract_tram_route(tram_route):
                         detailed_instructions.append(instruction)
             
             if mode == 'WALK':
-                # Walking segment
-                segment_points = []
+                # Walking segment : point de départ, noeuds parcourus, point d'arrivée
+                parts = []
                 if 'from' in elem:
-                    segment_points.append({"lat": elem['from']['lat'], "lng": elem['from']['lon']})
+                    parts.append([(elem['from']['lat'], elem['from']['lon'])])
                 
-                for step in elem.get('steps', []):
-                    if 'lat' in step and 'lon' in step:
-                        segment_points.append({"lat": step['lat'], "lng": step['lon']})
+                parts.append([(step['lat'], step['lon']) for step in elem.get('steps', [])
+                              if 'lat' in step and 'lon' in step])
                 
                 if 'to' in elem:
-                    segment_points.append({"lat": elem['to']['lat'], "lng": elem['to']['lon']})
+                    parts.append([(elem['to']['lat'], elem['to']['lon'])])
                 
+                segment_points = polyline.join(parts)
                 if len(segment_points) >= 2:
                     segments.append({
                         "type": "walking",
@@ -214,49 +292,27 @@ def extract_tram_route(tram_route):
                         "distance": elem.get('distance', 0) / 1000 
                     })
                     
-                    route_points.extend(segment_points)
+                    route_points.append(segment_points)
                     
             elif mode in ['TRAM', 'BUS', 'RAIL', 'SUBWAY']:
-                segment_points = []
+                # Tableaux (N, 2) de [lat, lng] : arrêt de départ, tracé de la ligne, arrêt d'arrivée
+                parts = []
                 
                 if 'from' in elem:
-                    segment_points.append({"lat": elem['from']['lat'], "lng": elem['from']['lon']})
+                    parts.append(np.array([[elem['from']['lat'], elem['from']['lon']]]))
                 
                 try:
-                    polyline = elem['legGeometry']['points']
-                    lat, lng = 0, 0
-                    index = 0
-                    
-                    while index < len(polyline): # Une focniton ici serait plus propre
-                        result = 1
-                        shift = 0
-                        while True:
-                            b = ord(polyline[index]) - 63 - 1
-                            index += 1
-                            result += b << shift
-                            shift += 5
-                            if b < 0x1f:
-                                break
-                        lat += (~(result >> 1) if (result & 1) else (result >> 1))
-                        
-                        result = 1
-                        shift = 0
-                        while True:
-                            b = ord(polyline[index]) - 63 - 1
-                            index += 1
-                            result += b << shift
-                            shift += 5
-                            if b < 0x1f:
-                                break
-                        lng += (~(result >> 1) if (result & 1) else (result >> 1))
-                        
-                        segment_points.append({"lat": lat * 1e-5, "lng": lng * 1e-5})
+                    parts.append(polyline.decode(elem['legGeometry']['points']))
                 except Exception as e:
-                    print(f"Error decoding polyline: {e}")
+                    log(f"Error decoding polyline: {e}")
                 
                 if 'to' in elem:
-                    segment_points.append({"lat": elem['to']['lat'], "lng": elem['to']['lon']})
+                    parts.append(np.array([[elem['to']['lat'], elem['to']['lon']]]))
                 
+                segment_points = polyline.join(parts)
+                if tolerance:
+                    # Les arrêts de départ et d'arrivée (extrémités) sont toujours gardés
+                    segment_points = segment_points[polyline.simplify_indices(segment_points, tolerance)]
                 if len(segment_points) >= 2: 
                     transit_type = mode.lower()
                     segments.append({
@@ -271,13 +327,19 @@ def extract_tram_route(tram_route):
                         "headsign": elem.get('headsign', '')
                     })
                     
-                    route_points.extend(segment_points)
+                    route_points.append(segment_points)
+    
+    # Les points ne sont convertis qu'une fois, au format demandé ; l'arrêt qui termine une
+    # étape et commence la suivante n'apparaît qu'une fois dans le tracé complet
+    route_points = polyline.join(route_points)
+    for segment in segments:
+        segment["points"] = polyline.format_points(segment["points"], geometry)
     
     while len(street_names) < len(route_points):
         street_names.append("Rue non identifiée")
     
     return {
-        "route": route_points,
+        "route": polyline.format_points(route_points, geometry),
         "segments": segments,
         "distance": round(total_distance, 2),
         "duration": round(duration),
@@ -287,351 +349,392 @@ def extract_tram_route(tram_route):
         "detailed_instructions": detailed_instructions # le chemin
     }
 
+def json_response(result):
+    """Encode an answer in the handler, so that the encoding is timed as a stage of the request"""
+    with span("encode"):
+        return JSONResponse(result)
+
+async def run_routing(request, function, *args):
+    """
+    Graph work of a request in the routing pool, so that the event loop keeps serving other requests
+
+    The server process loads no graph: everything that needs one goes through here.
+    """
+    try:
+        return await routing_pool.run(function, *args, request=request)
+    except (PoolSaturated, RoutingTimeout, ClientDisconnected) as e:
+        raise routing_error(e)
+
+def routing_error(e):
+    """HTTP error answered when the routing pool could not run a computation"""
+    if isinstance(e, PoolSaturated):
+        return HTTPException(status_code=503, detail=f"Server busy: {e}", headers={"Retry-After": "1"})
+    if isinstance(e, RoutingTimeout):
+        return HTTPException(status_code=504, detail=str(e))
+    # Personne ne lira la réponse ; le code 499 permet de compter ces requêtes dans /metrics
+    return HTTPException(status_code=499, detail="Client closed the request")
+
 @app.get("/api/optimize")
 async def optimize_route(
+    request: Request,
     start_lat: Optional[float] = None, 
     start_lng: Optional[float] = None, 
     end_lat: Optional[float] = None, 
     end_lng: Optional[float] = None,
     start_address: Optional[str] = None,
     end_address: Optional[str] = None,
-    transport_mode: str = "walking"
+    transport_mode: str = "walking",
+    snap: str = "node",
+    engine: str = "dijkstra",
+    transit_source: str = "auto",
+    geometry: str = "points",
+    simplify: Optional[float] = None,
+    zoom: Optional[int] = None
 ):
-    """Optimize route between two points using the actual roads/paths from GeoJSON data"""
+    """Optimize route between two points using the actual roads/paths from GeoJSON data
+
+    snap="edge" attaches the start and end points to the closest position along a road
+    instead of the closest road vertex. engine="alt" answers with A* and precomputed
+    landmarks, engine="csr" with A* on the compact array graph (same routes).
+    transit_source="mtag" or "local" picks the transit router; "auto" asks MTAG and
+    uses the local router (see transit_router.py) when MTAG has no answer.
+    geometry="polyline" or "flat" returns the points as an encoded polyline or a flat
+    [lat, lng, ...] list instead of {"lat", "lng"} objects (smaller answers).
+    simplify (meters) or zoom (map zoom level, half a pixel) drops the points closer
+    than that to the simplified line (Douglas-Peucker); street changes and turns stay,
+    and distance and duration are still measured on the full route.
+
+    The routes are computed in a bounded pool of worker processes (see routing_pool.py):
+    503 when too many computations are pending, 504 past ROUTING_TIMEOUT.
+    """
     try:
         if start_address:
-            start_coords = await geocode_address(start_address)
+            with span("geocode"):
+                start_coords = await geocode_address(start_address)
             start_lat, start_lng = start_coords["lat"], start_coords["lng"]
         
         if end_address:
-            end_coords = await geocode_address(end_address)
+            with span("geocode"):
+                end_coords = await geocode_address(end_address)
             end_lat, end_lng = end_coords["lat"], end_coords["lng"]
         
         if not all([start_lat, start_lng, end_lat, end_lng]):
             raise HTTPException(status_code=400, detail="Missing coordinates or addresses")
 
+        if engine not in ("dijkstra", "alt", "csr"):
+            raise HTTPException(status_code=400, detail=f"Unknown routing engine: {engine}")
+        if transit_source not in ("auto", "mtag", "local"):
+            raise HTTPException(status_code=400, detail=f"Unknown transit source: {transit_source}")
+        if geometry not in polyline.GEOMETRY_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unknown geometry format: {geometry}")
+        if simplify is not None and simplify < 0:
+            raise HTTPException(status_code=400, detail="simplify must be a positive number of meters")
+        if zoom is not None and not 0 <= zoom <= MAX_ZOOM:
+            raise HTTPException(status_code=400, detail=f"zoom must be between 0 and {MAX_ZOOM}")
+
+        # Tolérance de simplification du tracé (km)
+        tolerance = None
+        if simplify is not None:
+            tolerance = simplify / 1000
+        elif zoom is not None:
+            tolerance = polyline.zoom_tolerance(zoom, start_lat)
+
         if transport_mode == "tram" or transport_mode == "transit":
             try:
-                print(f"Calculating transit route from ({start_lat}, {start_lng}) to ({end_lat}, {end_lng})")
-                
-                tram_route = calculate_tram_route((start_lat, start_lng), (end_lat, end_lng))
-                
-                print(f"MTAG API response: {json.dumps(tram_route)[:200]}...")  # Print first 200 chars
-                
-                if not tram_route:
-                    print("No transit route returned by MTAG API")
-                    print("Falling back to walking route")
-                    transport_mode = "walking" 
-                elif 'error' in tram_route:
-                    print(f"MTAG API error: {tram_route['error']}")
-                    print("Falling back to walking route")
-                    transport_mode = "walking"
-                elif 'duration' not in tram_route or not tram_route.get('legs'):
-                    print(f"Invalid MTAG API response: {tram_route}")
-                    print("Falling back to walking route")
+                # Itinéraire déjà demandé récemment entre les mêmes noeuds du réseau
+                transit_key = await run_routing(request, transit_cache_key, start_lat, start_lng, end_lat, end_lng)
+                if transit_key:
+                    transit_key += (transit_source, geometry, tolerance)
+                cached_route = route_cache.get_transit(transit_key) if transit_key else None
+                if cached_route is not None:
+                    return json_response(cached_route)
+
+                tram_route = None
+                source = "mtag"
+                if transit_source != "local":
+                    log(f"Calculating transit route from ({start_lat}, {start_lng}) to ({end_lat}, {end_lng})")
+                    
+                    with span("mtag"):
+                        tram_route = await calculate_tram_route((start_lat, start_lng), (end_lat, end_lng))
+                    
+                    if metrics.VERBOSE_LOGS:
+                        log(f"MTAG API response: {json.dumps(tram_route)[:200]}...")  # Print first 200 chars
+                    
+                    if not tram_route:
+                        log("No transit route returned by MTAG API")
+                        tram_route = None
+                    elif 'error' in tram_route:
+                        log(f"MTAG API error: {tram_route['error']}")
+                        tram_route = None
+                    elif 'duration' not in tram_route or not tram_route.get('legs'):
+                        log(f"Invalid MTAG API response: {tram_route}")
+                        tram_route = None
+
+                if tram_route is None and transit_source != "mtag":
+                    # Calcul local sur les arrêts et les lignes du fichier de transport
+                    log("Calculating transit route with the local router")
+                    if transit_source == "auto":
+                        metrics.fallbacks.inc(source="mtag", fallback="local")
+                    source = "local"
+                    with span("transit_local"):
+                        tram_route = await run_routing(request, local_transit_plan, (start_lat, start_lng),
+                                                       (end_lat, end_lng))
+                    if tram_route is None:
+                        log("No local transit route faster than walking")
+
+                if tram_route is None:
+                    log("Falling back to walking route")
+                    metrics.fallbacks.inc(source=source, fallback="walking")
                     transport_mode = "walking"
                 else:
-                    result = extract_tram_route(tram_route)
-                    print(f"Successfully extracted transit route with {len(result['route'])} points and {len(result.get('segments', []))} segments")
-                    return result
+                    with span("extract"):
+                        result = extract_tram_route(tram_route, geometry, tolerance)
+                    result["source"] = source
+                    log(f"Successfully extracted transit route with {len(result['route'])} points and {len(result.get('segments', []))} segments")
+                    if transit_key:
+                        route_cache.set_transit(transit_key, result)
+                    return json_response(result)
+            except HTTPException:
+                raise
             except Exception as e:
-                print(f"Transit routing error with MTAG API: {e}")
-                print("Falling back to walking route")
+                log_error(f"Transit routing error, falling back to walking: {e}")
+                metrics.fallbacks.inc(source="transit", fallback="walking")
                 transport_mode = "walking"
 
         # If we reached here for transit mode, it means we're falling back to walking
-        # Continue with standard routing for walking/cycling/driving
-        # Load GeoJSON data for routing
-        file_path = os.path.join(BASE_DIR, "grenoble.geojson")
-        with open(file_path, 'r') as file:
-            geo_data = json.load(file)
-
-        # Filter data by transport mode
-        allowed_types = {
-            "walking": ["footway", "path", "pedestrian", "steps", "residential", "service"],
-            "cycling": ["cycleway", "residential", "path", "footway", "secondary", "tertiary"],
-            "driving": ["motorway", "trunk", "primary", "secondary", "tertiary", "residential", "service"],
-            "transit": [] 
-        }
-        
-        if transport_mode == "transit":
-            transport_file_path = os.path.join(BASE_DIR, "data_transport_commun_grenoble_formate.geojson")
-            with open(transport_file_path, 'r') as file:
-                transport_data = json.load(file)
-
-                geo_data["features"].extend([f for f in transport_data["features"] 
-                                        if f.get("geometry", {}).get("type") == "LineString"])
-        
-        # Create a graph for routing - always use DiGraph for driving to respect one-way streets
-        G = nx.DiGraph() if transport_mode == "driving" else nx.Graph()
-        
-        # Add nodes and edges from filtered features
-        valid_features = []
-        for feature in geo_data["features"]:
-            if feature.get("geometry", {}).get("type") == "LineString":
-                highway_type = feature.get("properties", {}).get("highway")
-                
-                # Skip features that don't match our transport mode
-                if transport_mode != "transit" and highway_type not in allowed_types[transport_mode]:
-                    continue
-                
-                valid_features.append(feature)
-                coords = feature["geometry"]["coordinates"]
-                
-                # Check if it's a one-way street
-                props = feature.get("properties", {})
-                one_way = props.get("oneway") == "yes"
-                
-                # For one-way streets, we need to check the direction
-                if one_way and transport_mode == "driving":
-                    # Some OSM data may have explicit direction tags
-                    oneway_direction = 1  # Default is forward direction (along the coordinates order)
-                    
-                    # Check if there's an explicit -1 direction tag
-                    if props.get("oneway") == "-1" or props.get("oneway") == "reverse":
-                        oneway_direction = -1
-                    
-                    # Add nodes and edge to the graph in the correct direction
-                    for i in range(len(coords) - 1):
-                        node1 = tuple(coords[i])
-                        node2 = tuple(coords[i + 1])
-                        
-                        # Calculate distance between nodes
-                        dist = calculate_distance(node1[1], node1[0], node2[1], node2[0])
-                        
-                        G.add_node(node1, pos=node1)
-                        G.add_node(node2, pos=node2)
-                        
-                        # Add edge in correct direction
-                        if oneway_direction == 1:
-                            G.add_edge(node1, node2, weight=dist, oneway=True)
-                        else:
-                            G.add_edge(node2, node1, weight=dist, oneway=True)
-                else:
-                    # For two-way streets or non-driving modes
-                    for i in range(len(coords) - 1):
-                        node1 = tuple(coords[i])
-                        node2 = tuple(coords[i + 1])
-                        
-                        # Calculate distance between nodes
-                        dist = calculate_distance(node1[1], node1[0], node2[1], node2[0])
-                        
-                        # Add nodes and both directions to the graph
-                        G.add_node(node1, pos=node1)
-                        G.add_node(node2, pos=node2)
-                        G.add_edge(node1, node2, weight=dist)
-                        
-                        # For non-driving modes or two-way streets, add both directions
-                        if transport_mode != "driving" or not one_way:
-                            G.add_edge(node2, node1, weight=dist)
-
-        print(f"Created graph with {len(G.nodes())} nodes and {len(G.edges())} edges")
-        
-        # APPROCHE SIMPLIFIÉE: chercher directement les noeuds les plus proches dans le graphe
-        # sans passer par la recherche des routes les plus proches
-        
-        # Récupérer tous les noeuds du graphe
-        all_nodes = list(G.nodes())
-        
-        if not all_nodes:
-            raise HTTPException(status_code=404, detail="Road network graph is empty")
-        
-        # Trouver les noeuds les plus proches pour le départ et l'arrivée
-        # Au lieu de prendre simplement le plus proche, on prend les 10 plus proches
-        # et on essaie de trouver une paire qui soit connectée dans le graphe
-        start_candidates = sorted(all_nodes, key=lambda node: 
-            calculate_distance(node[1], node[0], start_lat, start_lng))[:20]
-        
-        end_candidates = sorted(all_nodes, key=lambda node: 
-            calculate_distance(node[1], node[0], end_lat, end_lng))[:20]
-        
-        print(f"Found {len(start_candidates)} start candidates and {len(end_candidates)} end candidates")
-        
-        # On essaie de trouver un chemin valide entre les noeuds candidats
-        path_found = False
-        closest_start_node = start_candidates[0]  # Par défaut, on prend le plus proche
-        closest_end_node = end_candidates[0]  # Par défaut, on prend le plus proche
-        
-        for start_node in start_candidates:
-            for end_node in end_candidates:
-                try:
-                    # Vérifier si le chemin existe
-                    path = nx.shortest_path(G, source=start_node, target=end_node, weight='weight')
-                    print(f"Found valid path from {start_node} to {end_node} with {len(path)} nodes")
-                    closest_start_node = start_node
-                    closest_end_node = end_node
-                    path_found = True
-                    break
-                except (nx.NetworkXNoPath, nx.NodeNotFound):
-                    continue
-            
-            if path_found:
-                break
-        
-        # Calculer les distances
-        start_distance = calculate_distance(
-            closest_start_node[1], closest_start_node[0], start_lat, start_lng)
-        end_distance = calculate_distance(
-            closest_end_node[1], closest_end_node[0], end_lat, end_lng)
-        
-        print(f"Selected start node: {closest_start_node}, distance: {start_distance:.4f}km")
-        print(f"Selected end node: {closest_end_node}, distance: {end_distance:.4f}km")
-        
-        # Log information about the start and end nodes for debugging
-        if transport_mode == "driving":
-            print(f"Checking start node {closest_start_node} connections:")
-            print(f"- Outgoing edges: {len(list(G.out_edges(closest_start_node)))}")
-            print(f"- Incoming edges: {len(list(G.in_edges(closest_start_node)))}")
-            
-            print(f"Checking end node {closest_end_node} connections:")
-            print(f"- Outgoing edges: {len(list(G.out_edges(closest_end_node)))}")
-            print(f"- Incoming edges: {len(list(G.in_edges(closest_end_node)))}")
-        
-        # Calculer l'itinéraire le plus court ou créer un itinéraire direct si nécessaire
-        try:
-            path = nx.shortest_path(G, source=closest_start_node, target=closest_end_node, weight='weight')
-            print(f"Calculating path with {len(path)} nodes")
-            
-            # Vérifier que tous les segments du chemin existent bien dans le graphe
-            valid_path = True
-            for i in range(len(path) - 1):
-                if not G.has_edge(path[i], path[i + 1]):
-                    print(f"Edge {path[i]} -> {path[i + 1]} doesn't exist in graph")
-                    valid_path = False
-                    break
-            
-            if not valid_path:
-                print("Path contains edges that don't exist in the graph, creating direct route")
-                path = [closest_start_node, closest_end_node]
-                
-        except (nx.NetworkXNoPath, nx.NodeNotFound) as e:
-            print(f"No path found: {e}, creating direct route")
-            path = [closest_start_node, closest_end_node]
-        
-        # Convertir le chemin en coordonnées pour l'affichage
-        route_points = [{"lat": start_lat, "lng": start_lng}]  # Point de départ réel
-        
-        # Collecter les noms des rues pour chaque segment
-        street_names = []
-        
-        # Ajouter le point le plus proche sur le réseau routier
-        route_points.append({"lat": closest_start_node[1], "lng": closest_start_node[0]})
-        # Premier nom de rue (pour le point de départ)
-        start_street = "rue non identifiée"
-        for feature in valid_features:
-            coords = feature["geometry"]["coordinates"]
-            for i in range(len(coords) - 1):
-                if tuple(coords[i]) == closest_start_node or tuple(coords[i+1]) == closest_start_node:
-                    if "name" in feature.get("properties", {}):
-                        start_street = feature["properties"]["name"]
-                        break
-        street_names.append(start_street)
-        
-        # Ajouter tous les points intermédiaires du chemin avec noms de rues et destinations
-        street_info = []
-        for i in range(len(path)):
-            point = path[i]
-            if i > 0 and i < len(path) - 1:  # Skip first and last point which we handle separately
-                route_points.append({"lat": point[1], "lng": point[0]})
-            
-            # Trouver le nom de la rue et la destination pour ce point
-            street_name = "rue non identifiée"
-            destination = None  # Nouvelle variable pour stocker la destination
-            
-            for feature in valid_features:
-                coords = feature["geometry"]["coordinates"]
-                props = feature.get("properties", {})
-                
-                for j in range(len(coords) - 1):
-                    if tuple(coords[j]) == point or tuple(coords[j+1]) == point:
-                        if "name" in props:
-                            street_name = props["name"]
-                        
-                        # Extraire l'information de destination si elle existe
-                        if transport_mode == "driving" and "destination" in props:
-                            destination = props["destination"]
-                        
-                        break
-                
-                if street_name != "rue non identifiée" or destination:
-                    break
-            
-            # Stocker les informations de rue pour chaque segment
-            street_info.append({
-                "name": street_name,
-                "destination": destination
-            })
-        
-        # Ajouter le point le plus proche du point d'arrivée
-        route_points.append({"lat": closest_end_node[1], "lng": closest_end_node[0]})
-        
-        # Nom de la rue finale
-        end_street = "rue non identifiée"
-        for feature in valid_features:
-            coords = feature["geometry"]["coordinates"]
-            for i in range(len(coords) - 1):
-                if tuple(coords[i]) == closest_end_node or tuple(coords[i+1]) == closest_end_node:
-                    if "name" in feature.get("properties", {}):
-                        end_street = feature["properties"]["name"]
-                        break
-        street_names.append(end_street)
-        
-        # Ajouter le point d'arrivée réel
-        route_points.append({"lat": end_lat, "lng": end_lng})
-        street_names.append(end_street)  # Même nom de rue pour le point d'arrivée
-        
-        # Calculer la distance totale
-        distance = 0
-        # Distance du point de départ réel au noeud le plus proche
-        distance += start_distance
-        
-        # Distance le long du chemin calculé en vérifiant que les segments existent
-        if len(path) > 1:
-            if len(path) == 2:
-                # S'il s'agit d'un chemin direct, calculer la distance à vol d'oiseau
-                segment_distance = calculate_distance(
-                    path[0][1], path[0][0], path[1][1], path[1][0])
-                distance += segment_distance
-            else:
-                # Pour un chemin plus complexe, vérifier chaque segment
-                for i in range(len(path) - 1):
-                    if G.has_edge(path[i], path[i + 1]):
-                        segment_distance = G.edges[path[i], path[i + 1]]['weight']
-                    else:
-                        # Si l'arête n'existe pas, calculer la distance à vol d'oiseau
-                        segment_distance = calculate_distance(
-                            path[i][1], path[i][0], path[i + 1][1], path[i + 1][0])
-                    
-                    distance += segment_distance
-        
-        # Distance du dernier noeud au point d'arrivée réel
-        distance += end_distance
-        
-        # Calculer la durée en fonction du mode de transport
-        speeds = {
-            "walking": 5,
-            "cycling": 15,
-            "driving": 40,
-            "transit": 20
-        }
-        speed = speeds.get(transport_mode, 5)
-        duration = (distance / speed) * 60 * 60  # Durée en secondes
-        
-        return {
-            "route": route_points,
-            "distance": round(distance, 2),
-            "duration": round(duration),
-            "transport_mode": transport_mode,
-            "streetNames": [info["name"] for info in street_info],
-            "streetDestinations": [info["destination"] for info in street_info if info["destination"]]
-        }
+        # Continue with standard routing for walking/cycling/driving, in a routing worker
+        body = await run_routing(request, road_route, transport_mode, start_lat, start_lng, end_lat, end_lng,
+                                 snap, engine, geometry, tolerance)
+        return Response(content=body, media_type="application/json")
     
+    except HTTPException:
+        raise
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
-        print(f"Error in optimize_route: {e}\n{error_details}")
+        log_error(f"Error in optimize_route: {e}\n{error_details}")
         raise HTTPException(status_code=500, detail=f"Failed to optimize route: {str(e)}")
 
+class MatrixRequest(BaseModel):
+    origins: List[List[float]]  # [[lat, lng], ...]
+    destinations: Optional[List[List[float]]] = None  # les origines par défaut
+    transport_mode: str = "walking"
+    stream: bool = False
+
+@app.post("/api/matrix")
+async def get_matrix(body: MatrixRequest, request: Request):
+    """Network distance (km) and duration (s) matrices between origins and destinations
+
+    With stream=true the rows are sent as NDJSON lines ({"origin", "distances", "durations"})
+    as soon as they are computed, in no particular order. Unreachable pairs are null.
+    The rows are computed in the routing pool, which answers 503 when it is saturated and
+    504 when a batch of rows times out; once a stream has started, such an error ends it
+    with an {"error"} line.
+    """
+    origins = body.origins
+    destinations = body.destinations if body.destinations is not None else origins
+    if body.transport_mode not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown transport mode: {body.transport_mode}")
+    if not origins or not destinations:
+        raise HTTPException(status_code=400, detail="origins and destinations must not be empty")
+    if any(len(point) != 2 for point in origins + destinations):
+        raise HTTPException(status_code=400, detail="Points must be [lat, lng] pairs")
+    if len(origins) * len(destinations) > MATRIX_MAX_PAIRS:
+        raise HTTPException(status_code=400, detail=f"Too many pairs (maximum {MATRIX_MAX_PAIRS})")
+
+    try:
+        if body.stream:
+            # Attendre les premières lignes : les erreurs du début gardent leur code HTTP
+            chunks = stream_matrix(body.transport_mode, origins, destinations)
+            first = await chunks.__anext__()
+            return StreamingResponse(matrix_lines(first, chunks), media_type="application/x-ndjson")
+        return await compute_matrix(body.transport_mode, origins, destinations, request)
+    except (PoolSaturated, RoutingTimeout, ClientDisconnected) as e:
+        raise routing_error(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute matrix: {str(e)}")
+
+async def matrix_lines(first, chunks):
+    yield first
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        # Le code HTTP est déjà parti : signaler l'erreur dans une dernière ligne
+        yield (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+
+@app.get("/api/isochrone")
+async def get_isochrone(
+    request: Request,
+    lat: float,
+    lng: float,
+    transport_mode: str = "walking",
+    minutes: str = "10,20,30",
+    method: str = "buffer"
+):
+    """Areas reachable from a point within each time budget (comma-separated minutes)
+
+    method="buffer" follows the reached streets, method="hull" draws a concave hull around them.
+    """
+    if transport_mode not in ISOCHRONE_MODES:
+        raise HTTPException(status_code=400, detail=f"Isochrones are available for: {', '.join(ISOCHRONE_MODES)}")
+    if method not in ("buffer", "hull"):
+        raise HTTPException(status_code=400, detail=f"Unknown isochrone method: {method}")
+    try:
+        budgets = [float(value) for value in minutes.split(",") if value.strip()]
+    except ValueError:
+        budgets = []
+    if not budgets or len(budgets) > 5 or not all(0 < budget <= 120 for budget in budgets):
+        raise HTTPException(status_code=400, detail="minutes must be 1 to 5 values between 0 and 120")
+
+    try:
+        return await run_routing(request, isochrone, transport_mode, lat, lng, budgets, method)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute isochrone: {str(e)}")
+
+@app.post("/api/graphs/reload")
+async def reload_graphs(transport_mode: Optional[str] = None, only_stale: bool = False):
+    """Rebuild the routing graphs from the GeoJSON files
+
+    only_stale=true only reloads the modes whose files changed since the workers built
+    their graphs. The routing workers are restarted, with empty caches, and load their
+    graphs again in the background. The edge updates (/api/graphs/updates) are applied
+    again to the rebuilt graphs.
+    """
+    if transport_mode and transport_mode not in ALLOWED_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown transport mode: {transport_mode}")
+    reloaded = [transport_mode] if transport_mode else list(ALLOWED_TYPES)
+    if only_stale:
+        reloaded = routing_pool.stale_modes(reloaded)
+    if reloaded:
+        await asyncio.to_thread(routing_pool.reload, reloaded)
+        if "walking" in reloaded or "transit" in reloaded:
+            # Itinéraires locaux gardés par le serveur : calculés sur l'ancien graphe piéton
+            route_cache.invalidate_transit("local")
+    return {"reloaded": reloaded, "preloading": routing_pool.preload if reloaded else []}
+
+class EdgeUpdate(BaseModel):
+    feature: str  # id OSM de la route ("way/123") ou route_id d'une ligne de transport
+    action: str = "close"  # "close", "factor" ou "restore"
+    factor: Optional[float] = None  # multiplicateur des poids d'origine (>= 1) pour action="factor"
+    transport_modes: Optional[List[str]] = None  # tous les modes par défaut
+
+class GraphUpdates(BaseModel):
+    updates: List[EdgeUpdate]
+
+def graph_updates_state():
+    version, updates = graph_registry.updates()
+    return {
+        "version": version,
+        "updates": [{"feature": feature, "transport_mode": transport_mode, "action": action, "factor": factor}
+                    for (transport_mode, feature), (action, factor) in sorted(updates.items())]
+    }
+
+@app.post("/api/graphs/updates")
+async def update_graphs(body: GraphUpdates, request: Request):
+    """Close, reopen or slow down roads by OSM feature id, without rebuilding the graphs
+
+    action="close" removes the edges of the feature, action="factor" multiplies their
+    original weights by factor (congestion, lower speed limit; at least 1),
+    action="restore" puts them back as in the GeoJSON file. The changes are kept across
+    graph reloads until restored. Only the cached paths and results depending on the
+    changed edges are dropped.
+
+    changed_edges (edges of the updated features in each graph) and unknown_features
+    (ids found in no feature) come from a routing worker, once it applied the changes.
+    """
+    changes = []
+    for update in body.updates:
+        for transport_mode in update.transport_modes or list(ALLOWED_TYPES):
+            changes.append((transport_mode, update.feature, update.action, update.factor))
+    try:
+        await asyncio.to_thread(apply_updates, changes)
+        # Le serveur ne charge aucun graphe : demander à un processus de calcul, qui reçoit les changements avant
+        edges, unknown = await run_routing(request, update_report, changes)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update graphs: {str(e)}")
+    return dict(graph_updates_state(), unknown_features=unknown, changed_edges=edges)
+
+@app.get("/api/graphs/updates")
+async def get_graph_updates():
+    """Closures and weight factors currently applied to the graphs"""
+    return graph_updates_state()
+
+@app.delete("/api/graphs/updates")
+async def clear_graph_updates():
+    """Restore every closed or slowed down road"""
+    _, updates = graph_registry.updates()
+    changes = [(transport_mode, feature, "restore", None) for transport_mode, feature in updates]
+    await asyncio.to_thread(apply_updates, changes)
+    return graph_updates_state()
+
+@app.get("/api/routing/stats")
+async def get_routing_stats():
+    """Workers, pending computations and outcomes (completed, rejected, timeouts) of the routing pool"""
+    return routing_pool.stats()
+
+@app.get("/api/graphs/stats")
+async def get_graphs_stats(request: Request):
+    """Size and memory use of the routing graphs loaded by one of the routing workers"""
+    return await run_routing(request, graph_stats)
+
+def cache_stats():
+    # Les chemins sont mis en cache dans les processus de calcul, les itinéraires en transports ici
+    workers = routing_pool.cache_stats()
+    return {
+        "routes": {"paths": workers["route_paths"], "transit": route_cache.transit.stats()},
+        "isochrones": workers["isochrones"],
+        "schedules": schedule_cache.stats(),
+        "geocoding": geocoder.stats()["cache"],
+        "tiles": {layer: tile_layer.cache.stats() for layer, tile_layer in tile_layers.items()}
+    }
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Size and hit ratio of every cache, to size them"""
+    return cache_stats()
+
+def cache_metrics():
+    """Hits, misses and size of the caches of /api/cache/stats, for /metrics"""
+    stats = cache_stats()
+    caches = {
+        "route_paths": stats["routes"]["paths"],
+        "route_transit": stats["routes"]["transit"],
+        "isochrones": stats["isochrones"],
+        "schedules": stats["schedules"],
+        "geocoding": stats["geocoding"]
+    }
+    caches.update({f"tiles_{layer}": layer_stats for layer, layer_stats in stats["tiles"].items()})
+    prefix = metrics.METRICS_PREFIX + "cache_"
+    families = [
+        (prefix + "hits_total", "counter", "Lookups answered by the cache", "hits"),
+        (prefix + "misses_total", "counter", "Lookups not found in the cache", "misses"),
+        (prefix + "evictions_total", "counter", "Entries dropped to make room", "evictions"),
+        (prefix + "entries", "gauge", "Entries in the cache", "size"),
+        (prefix + "bytes", "gauge", "Approximate memory used by the cache entries", "bytes")
+    ]
+    geocoding = geocoder.stats()
+    return [(name, metric_type, help, [({"cache": cache}, values.get(key)) for cache, values in caches.items()])
+            for name, metric_type, help, key in families] + [
+        (metrics.METRICS_PREFIX + "geocode_gazetteer_hits_total", "counter",
+         "Addresses found in the local gazetteer", [({}, geocoding["gazetteer_hits"])])
+    ]
+
+metrics.registry.add_collector(cache_metrics)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request and stage durations, fallbacks, MTAG/Nominatim calls and caches in the Prometheus text format"""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/api/random-point")
 async def get_random_point():
     """Get or generate a random point within Grenoble"""
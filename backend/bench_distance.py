@@ -0,0 +1,50 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from distance import calculate_distance, distances_from, haversine
+
+
+def best_of(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the scalar and vectorized haversine implementations")
+    parser.add_argument("--points", type=int, default=100000, help="number of coordinate pairs")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measure (best is kept)")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # Points tirés dans la zone de Grenoble
+    lats1 = [rng.uniform(45.15, 45.22) for _ in range(args.points)]
+    lons1 = [rng.uniform(5.68, 5.78) for _ in range(args.points)]
+    lats2 = [rng.uniform(45.15, 45.22) for _ in range(args.points)]
+    lons2 = [rng.uniform(5.68, 5.78) for _ in range(args.points)]
+    arrays = [np.array(values) for values in (lats1, lons1, lats2, lons2)]
+    coords = np.stack([arrays[1], arrays[0]], axis=1)
+
+    scalar_time, scalar = best_of(
+        lambda: [calculate_distance(a, b, c, d) for a, b, c, d in zip(lats1, lons1, lats2, lons2)], args.repeat)
+    vector_time, vector = best_of(lambda: haversine(*arrays), args.repeat)
+    print(f"pairwise   scalar {scalar_time * 1000:8.2f} ms   vectorized {vector_time * 1000:8.2f} ms"
+          f"   x{scalar_time / vector_time:.1f}   max error {np.abs(np.array(scalar) - vector).max():.2e} km")
+
+    scalar_time, _ = best_of(
+        lambda: sorted(range(args.points), key=lambda i: calculate_distance(lats1[i], lons1[i], 45.1885, 5.7245))[:20],
+        args.repeat)
+    vector_time, _ = best_of(
+        lambda: np.argpartition(distances_from(coords, 45.1885, 5.7245), 20)[:20], args.repeat)
+    print(f"20 nearest scalar {scalar_time * 1000:8.2f} ms   vectorized {vector_time * 1000:8.2f} ms"
+          f"   x{scalar_time / vector_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
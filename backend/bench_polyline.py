@@ -0,0 +1,88 @@
+import argparse
+import json
+import time
+
+import numpy as np
+
+import polyline
+
+
+def best_of(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def scalar_decode(encoded):
+    """Character by character decoder (the one extract_tram_route used before polyline.py)"""
+    points = []
+    lat, lng = 0, 0
+    index = 0
+    while index < len(encoded):
+        values = []
+        for _ in range(2):
+            result, shift = 0, 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1f) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            values.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += values[0]
+        lng += values[1]
+        points.append({"lat": lat * 1e-5, "lng": lng * 1e-5})
+    return points
+
+
+def scalar_encode(points):
+    result = []
+    previous = (0, 0)
+    for lat, lng in points:
+        current = (int(round(lat * 1e5)), int(round(lng * 1e5)))
+        for value, last in zip(current, previous):
+            value = value - last
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous = current
+    return "".join(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the scalar and vectorized polyline codecs")
+    parser.add_argument("--points", type=int, default=20000, help="number of points of the polyline")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measure (best is kept)")
+    args = parser.parse_args()
+
+    # Marche aléatoire autour de Grenoble, pas d'une dizaine de mètres
+    rng = np.random.default_rng(0)
+    coords = np.cumsum(rng.normal(0, 1e-4, (args.points, 2)), axis=0) + [45.1885, 5.7245]
+    coords = np.round(coords, 5)
+
+    scalar_time, encoded = best_of(lambda: scalar_encode(coords.tolist()), args.repeat)
+    vector_time, vector = best_of(lambda: polyline.encode(coords), args.repeat)
+    assert vector == encoded, "encoded polylines differ"
+    print(f"encode scalar {scalar_time * 1000:8.2f} ms   vectorized {vector_time * 1000:8.2f} ms"
+          f"   x{scalar_time / vector_time:.1f}   {len(encoded)} characters")
+
+    scalar_time, scalar = best_of(lambda: scalar_decode(encoded), args.repeat)
+    vector_time, vector = best_of(lambda: polyline.decode(encoded), args.repeat)
+    error = np.abs(np.array([[p["lat"], p["lng"]] for p in scalar]) - vector).max()
+    print(f"decode scalar {scalar_time * 1000:8.2f} ms   vectorized {vector_time * 1000:8.2f} ms"
+          f"   x{scalar_time / vector_time:.1f}   max error {error:.2e} deg")
+
+    # Conversion au format de réponse puis sérialisation JSON
+    for geometry in polyline.GEOMETRY_FORMATS:
+        format_time, body = best_of(lambda: json.dumps(polyline.format_points(vector, geometry)), args.repeat)
+        print(f"{geometry:8s} + json {format_time * 1000:8.2f} ms   {len(body)} bytes")
+
+
+if __name__ == "__main__":
+    main()
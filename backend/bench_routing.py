@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import app
+import metrics
+from distance import distances_from
+from mtag_api import calculate_tram_route, mtag_client
+from polyline import format_points
+from route_cache import route_cache
+from routing_graph import graph_registry
+from routing_pool import routing_pool
+from stub_servers import mtag_stub
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ("walking", "cycling", "driving", "transit")
+PERCENTILES = (50, 95, 99)
+
+
+class Timings:
+    """Durations (ms) recorded per stage"""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+            raise
+        self.samples.setdefault(stage, []).append((time.perf_counter() - start) * 1000)
+
+    def summary(self):
+        result = {}
+        for stage in sorted(set(self.samples) | set(self.errors)):
+            values = np.array(self.samples.get(stage, []))
+            stats = {"count": len(values), "errors": self.errors.get(stage, 0)}
+            if len(values):
+                stats.update({f"p{p}": round(float(np.percentile(values, p)), 3) for p in PERCENTILES})
+                stats.update({"mean": round(float(values.mean()), 3), "max": round(float(values.max()), 3)})
+            result[stage] = stats
+        return result
+
+
+def random_pairs(bounds, count, seed):
+    """Seeded origin/destination pairs ((lat, lng), (lat, lng)) inside the bounds"""
+    rng = random.Random(seed)
+
+    def point():
+        return (rng.uniform(bounds["min_lat"], bounds["max_lat"]),
+                rng.uniform(bounds["min_lng"], bounds["max_lng"]))
+
+    return [(point(), point()) for _ in range(count)]
+
+
+def peak_rss_mb():
+    # ru_maxrss est en kilo-octets sous Linux et en octets sous macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def workers_peak_rss_mb():
+    """Peak RSS of each running routing worker (VmHWM of /proc), None where it cannot be read"""
+    peaks = []
+    for pid in routing_pool.worker_pids():
+        peak = None
+        try:
+            with open(f"/proc/{pid}/status", "r", encoding="utf-8") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        peak = round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            pass
+        peaks.append(peak)
+    return peaks
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_graph(client, transport_mode, pairs, engine, timings):
+    """Stages of /api/optimize on the graph of a mode, then the whole request"""
+    graph_registry.reload([transport_mode])
+    with timings.measure("build"):
+        routing_graph = graph_registry.get(transport_mode)
+    if engine == "csr":
+        with timings.measure("build_csr"):
+            routing_graph.csr_graph()
+
+    for (start_lat, start_lng), (end_lat, end_lng) in pairs:
+        with timings.measure("snap"):
+            start_candidates, _ = routing_graph.snap_candidates(start_lat, start_lng, k=20)
+            end_candidates, _ = routing_graph.snap_candidates(end_lat, end_lng, k=20)
+            start_offsets = dict(zip(start_candidates, distances_from(start_candidates, start_lat, start_lng).tolist()))
+            end_offsets = dict(zip(end_candidates, distances_from(end_candidates, end_lat, end_lng).tolist()))
+        with timings.measure("path"):
+            path, _ = routing_graph.find_path(start_offsets, end_offsets, engine=engine)
+        path = path or [start_candidates[0], end_candidates[0]]
+        with timings.measure("names"):
+            names = [routing_graph.street_at(node)["name"] or "rue non identifiée" for node in path]
+        with timings.measure("serialize"):
+            points = np.array(path, dtype=np.float64)[:, ::-1]
+            json.dumps({"route": format_points(points), "streetNames": names})
+
+    bench_requests(client, transport_mode, pairs, {"engine": engine}, timings)
+
+
+def bench_transit(client, pairs, timings):
+    """MTAG call (answered by the stub), itinerary extraction, then the whole request"""
+    # Construction mesurée dans ce processus ; les requêtes utilisent celui des processus de calcul
+    graph_registry.reload(["transit"])
+    with timings.measure("build"):
+        graph_registry.get("transit")
+
+    async def plans():
+        for start, end in pairs:
+            try:
+                with timings.measure("mtag"):
+                    tram_route = await calculate_tram_route(start, end)
+                with timings.measure("extract"):
+                    result = app.extract_tram_route(tram_route)
+                with timings.measure("serialize"):
+                    json.dumps(result)
+            except Exception as e:
+                print(f"transit: {e}", file=sys.stderr)
+
+    asyncio.run(plans())
+    bench_requests(client, "transit", pairs, {"transit_source": "mtag"}, timings)
+
+
+def bench_requests(client, transport_mode, pairs, params, timings):
+    for (start_lat, start_lng), (end_lat, end_lng) in pairs:
+        # Chaque requête refait tout le calcul : vider les chemins des processus de calcul et
+        # les itinéraires en transports gardés par le serveur
+        routing_pool.clear_caches()
+        route_cache.invalidate()
+        try:
+            with timings.measure("request"):
+                client.get("/api/optimize", params=dict(
+                    params, start_lat=start_lat, start_lng=start_lng, end_lat=end_lat, end_lng=end_lng,
+                    transport_mode=transport_mode)).raise_for_status()
+        except Exception as e:
+            print(f"/api/optimize ({transport_mode}): {e}", file=sys.stderr)
+
+
+def bench_endpoints(client, runs, seed, timings):
+    """GeoJSON files, tiles and route filters (the first request, which encodes or indexes the files, apart)"""
+    rng = random.Random(seed)
+    bounds = app.GRENOBLE_BOUNDS
+
+    def tile(zoom):
+        lat = math.radians(rng.uniform(bounds["min_lat"], bounds["max_lat"]))
+        lng = rng.uniform(bounds["min_lng"], bounds["max_lng"])
+        n = 2 ** zoom
+        return zoom, int((lng + 180) / 360 * n), int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n)
+
+    requests = {
+        "geojson_routes": lambda: ("/api/geojson/routes", {}),
+        "geojson_transport": lambda: ("/api/geojson/transport", {}),
+        "tile_routes": lambda: ("/api/tiles/routes/%d/%d/%d" % tile(rng.choice([12, 14, 16])), {}),
+        "tile_transport": lambda: ("/api/tiles/transport/%d/%d/%d" % tile(rng.choice([12, 14, 16])), {}),
+        "filter_routes": lambda: ("/api/routes/filter", {"route_type": rng.choice(["primary", "residential,footway"])}),
+    }
+    for stage, make_request in requests.items():
+        for run in range(runs + 1):
+            url, params = make_request()
+            try:
+                with timings.measure(stage if run else stage + "_first"):
+                    client.get(url, params=params).raise_for_status()
+            except Exception as e:
+                # Fichier absent par exemple : inutile d'insister
+                print(f"{stage}: {e}", file=sys.stderr)
+                break
+
+
+def compare(result, baseline):
+    """Print the p50/p95 of each stage next to the ones of a previous run"""
+    print(f"{'stage':28s} {'p50 ms':>10s} {'before':>10s} {'p95 ms':>10s} {'before':>10s}", file=sys.stderr)
+    for group, stages in result["stages"].items():
+        for stage, stats in stages.items():
+            before = baseline.get("stages", {}).get(group, {}).get(stage, {})
+            if "p50" not in stats or "p50" not in before:
+                continue
+            print(f"{group + '.' + stage:28s} {stats['p50']:10.2f} {before['p50']:10.2f}"
+                  f" {stats['p95']:10.2f} {before['p95']:10.2f}   x{stats['p50'] / max(before['p50'], 1e-9):.2f}",
+                  file=sys.stderr)
+    print(f"peak RSS {result['peak_rss_mb']} MB (before {baseline.get('peak_rss_mb')} MB), "
+          f"workers {result.get('workers_peak_rss_mb')} MB (before {baseline.get('workers_peak_rss_mb')} MB)",
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark route computation and the GeoJSON endpoints")
+    parser.add_argument("--pairs", type=int, default=50, help="origin/destination pairs per transport mode")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random pairs")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma-separated transport modes")
+    parser.add_argument("--engine", default="dijkstra", choices=["dijkstra", "alt", "csr"])
+    parser.add_argument("--endpoint-runs", type=int, default=20,
+                        help="requests per GeoJSON/tile/filter endpoint (0 to skip them)")
+    parser.add_argument("--mtag-response", action="append",
+                        help="recorded MTAG answer replayed for transit (default: tram_route.json, repeatable)")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--verbose", action="store_true", help="keep the logs of the backend")
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode]
+    mtag_responses = args.mtag_response or [os.path.join(BASE_DIR, "tram_route.json")]
+    stages = {}
+    workers_rss = []
+
+    pairs = random_pairs(app.GRENOBLE_BOUNDS, args.pairs, args.seed)
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    # Les processus de calcul des itinéraires écrivent directement sur la sortie : les faire taire aussi
+    metrics.VERBOSE_LOGS = args.verbose
+    with mtag_stub(mtag_responses) as stub, TestClient(app.app) as client, logs:
+        mtag_client.base_url = stub.url
+        for transport_mode in modes:
+            timings = Timings()
+            if transport_mode == "transit":
+                bench_transit(client, pairs, timings)
+            else:
+                bench_graph(client, transport_mode, pairs, args.engine, timings)
+            stages[transport_mode] = timings.summary()
+        if args.endpoint_runs > 0:
+            timings = Timings()
+            bench_endpoints(client, args.endpoint_runs, args.seed, timings)
+            stages["endpoints"] = timings.summary()
+        # Avant l'arrêt des processus de calcul, qui ont leurs propres graphes et caches
+        workers_rss = workers_peak_rss_mb()
+
+    result = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {"pairs": args.pairs, "seed": args.seed, "modes": modes, "engine": args.engine,
+                   "endpoint_runs": args.endpoint_runs,
+                   "mtag_responses": [os.path.basename(path) for path in mtag_responses]},
+        "stages": stages,
+        "peak_rss_mb": peak_rss_mb(),
+        "workers_peak_rss_mb": workers_rss
+    }
+
+    body = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(body + "\n")
+    else:
+        print(body)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
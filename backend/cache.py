@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with an optional time-to-live
+
+    Entries older than ttl seconds are considered expired but are kept until evicted,
+    so that callers can still fall back on them (see get_entry). Thread-safe.
+    Pass clock=time.time to get timestamps that stay meaningful across restarts
+    (e.g. when the entries are saved to disk, see items()). With a weigher (function
+    value -> approximate size in bytes), the cache is also bounded by max_weight.
+    """
+
+    def __init__(self, max_size=128, ttl=None, clock=time.monotonic, max_weight=None, weigher=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.max_weight = max_weight
+        self.weigher = weigher
+        self.weight = 0
+        self._weights = {}
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get_entry(self, key):
+        """Return (value, age in seconds) even if expired, or None if the key is absent"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            value, stored_at = entry
+            return value, self.clock() - stored_at
+
+    def get(self, key, default=None, count=True):
+        """Return the value of a key if present and not expired"""
+        entry = self.get_entry(key)
+        if entry is None or (self.ttl is not None and entry[1] > self.ttl):
+            if count:
+                self.misses += 1
+            return default
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, stored_at=None):
+        with self._lock:
+            self._data[key] = (value, self.clock() if stored_at is None else stored_at)
+            self._data.move_to_end(key)
+            if self.weigher is not None:
+                weight = self.weigher(value)
+                self.weight += weight - self._weights.get(key, 0)
+                self._weights[key] = weight
+            while len(self._data) > self.max_size or (
+                    self.max_weight is not None and self.weight > self.max_weight and len(self._data) > 1):
+                evicted, _ = self._data.popitem(last=False)
+                self.weight -= self._weights.pop(evicted, 0)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            self.weight -= self._weights.pop(key, 0)
+        return default if entry is None else entry[0]
+
+    def items(self):
+        """List of (key, value, stored_at) from the least to the most recently used"""
+        with self._lock:
+            return [(key, value, stored_at) for key, (value, stored_at) in self._data.items()]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weights.clear()
+            self.weight = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+        if self.weigher is not None:
+            stats.update({"bytes": self.weight, "max_bytes": self.max_weight})
+        return stats
+
+
+def merge_stats(stats_list):
+    """Statistics of several copies of a cache (one per worker process) added together"""
+    merged = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if key != "hit_ratio" and value is not None:
+                merged[key] = merged.get(key, 0) + value
+    lookups = merged.get("hits", 0) + merged.get("misses", 0)
+    merged["hit_ratio"] = merged["hits"] / lookups if lookups else 0.0
+    return merged
+
+
+class AsyncLoadingCache:
+    """
+    TTL cache in front of an async loader (e.g. an upstream API)
+
+    - concurrent misses for the same key share a single call to the loader
+    - once an entry is older than ttl, it is still served for up to stale_ttl seconds
+      while a background call refreshes it (stale-while-revalidate)
+    - if the loader fails, the last good value is served when there is one
+    """
+
+    def __init__(self, loader, ttl=60, max_size=128, stale_ttl=3600):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._cache = TTLCache(max_size=max_size)
+        self._pending = {}
+        self.stale_hits = 0
+        self.errors = 0
+
+    async def _load(self, key):
+        try:
+            value = await self.loader(key)
+        except Exception:
+            self.errors += 1
+            raise
+        self._cache.set(key, value)
+        return value
+
+    def _start_load(self, key):
+        """Return the pending load of a key, starting it if needed"""
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    async def get(self, key):
+        entry = self._cache.get_entry(key)
+        if entry is not None:
+            value, age = entry
+            if age <= self.ttl:
+                self._cache.hits += 1
+                return value
+            if age <= self.ttl + self.stale_ttl:
+                # Servir la valeur périmée et la rafraîchir en arrière-plan
+                self.stale_hits += 1
+                task = self._start_load(key)
+                task.add_done_callback(lambda t: t.cancelled() or t.exception())
+                return value
+
+        self._cache.misses += 1
+        try:
+            # shield : une requête annulée ne doit pas annuler l'appel partagé
+            return await asyncio.shield(self._start_load(key))
+        except Exception:
+            if entry is not None:
+                self.stale_hits += 1
+                return entry[0]
+            raise
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update({"stale_hits": self.stale_hits, "errors": self.errors,
+                      "ttl": self.ttl, "stale_ttl": self.stale_ttl})
+        return stats
@@ -0,0 +1,278 @@
+import copy
+import heapq
+import sys
+from itertools import count
+
+import numpy as np
+
+from distance import calculate_distance, distances_from, haversine
+
+
+class CSRGraph:
+    """
+    Compact array-backed routing graph
+
+    Nodes are integer ids (their position in `nodes`), coordinates are kept in a NumPy
+    array and the adjacency is stored in CSR form: the neighbors of node i are
+    indices[indptr[i]:indptr[i + 1]], with float32 weights (km) and a one-way flag per
+    directed edge. An undirected graph stores each edge in both directions.
+    `lengths` holds the ground length (km) of each edge, which stays the same when
+    reweighted() slows an edge down.
+    """
+
+    def __init__(self, nodes, coords, indptr, indices, weights, oneway, directed):
+        self.nodes = nodes
+        self.coords = coords
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.oneway = oneway
+        self.directed = directed
+        self.position = {node: i for i, node in enumerate(nodes)}
+        sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+        self.lengths = haversine(coords[sources, 1], coords[sources, 0],
+                                 coords[indices, 1], coords[indices, 0]).astype(np.float32)
+
+    @classmethod
+    def from_networkx(cls, graph, nodes=None):
+        """Convert a networkx routing graph, keeping the given node order"""
+        nodes = list(graph.nodes()) if nodes is None else nodes
+        position = {node: i for i, node in enumerate(nodes)}
+        coords = np.array(nodes, dtype=np.float64).reshape(-1, 2)
+
+        degrees = np.zeros(len(nodes) + 1, dtype=np.int64)
+        sources, targets, weights, oneway = [], [], [], []
+        for u, neighbors in graph.adj.items():
+            i = position[u]
+            for v, attributes in neighbors.items():
+                sources.append(i)
+                targets.append(position[v])
+                weights.append(attributes.get("weight", 1))
+                oneway.append(attributes.get("oneway", False))
+
+        sources = np.array(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        np.add.at(degrees, sources + 1, 1)
+
+        return cls(
+            nodes,
+            coords,
+            np.cumsum(degrees).astype(np.int64),
+            np.array(targets, dtype=np.int32)[order],
+            np.array(weights, dtype=np.float32)[order],
+            np.array(oneway, dtype=bool)[order],
+            graph.is_directed()
+        )
+
+    def reweighted(self, weights):
+        """
+        Copy sharing the structure of the graph, with new weights for some edges
+
+        Args:
+            weights: dict (node, node) -> weight (km), inf for an edge that must not be used
+
+        Returns:
+            CSRGraph, or None if an edge is not stored in the arrays (it must be rebuilt)
+        """
+        new_weights = self.weights.copy()
+        for (u, v), weight in weights.items():
+            i, j = self.position.get(u), self.position.get(v)
+            if i is None or j is None:
+                return None
+            start = self.indptr[i]
+            found = np.flatnonzero(self.indices[start:self.indptr[i + 1]] == j)
+            if not len(found):
+                return None
+            new_weights[start + found] = weight
+        graph = copy.copy(self)
+        graph.weights = new_weights
+        return graph
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices) if self.directed else len(self.indices) // 2
+
+    def memory_usage(self):
+        """Bytes used by the arrays of the graph (node tuples and id lookup excluded)"""
+        return int(self.coords.nbytes + self.indptr.nbytes + self.indices.nbytes
+                   + self.weights.nbytes + self.lengths.nbytes + self.oneway.nbytes)
+
+    def neighbors(self, node_id):
+        start, end = self.indptr[node_id], self.indptr[node_id + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    def _heuristic(self, targets):
+        """
+        A* estimate of the cost left from a node to the targets
+
+        The great-circle distance to the circle around the targets plus their smallest
+        final cost, never more than the cost of a path through the edges.
+        """
+        target_coords = self.coords[list(targets)]
+        center_lon, center_lat = target_coords.mean(axis=0)
+        radius = float(distances_from(target_coords, center_lat, center_lon).max())
+        min_cost = min(targets.values())
+        coords = self.coords
+
+        def estimate(node_id):
+            lon, lat = coords[node_id]
+            # Marge pour les poids arrondis en float32
+            bound = calculate_distance(lat, lon, center_lat, center_lon) - radius
+            return max(bound * 0.999, 0.0) + min_cost
+        return estimate
+
+    def shortest_path(self, sources, targets, heuristic=True):
+        """
+        Dijkstra (or A* with a haversine lower bound) on the CSR arrays
+
+        Args:
+            sources: dict node id -> initial cost
+            targets: dict node id -> final cost
+            heuristic: use A*; since every edge weighs at least the great-circle distance
+                between its endpoints, the distance to the targets never overestimates
+
+        Returns:
+            tuple (list of node ids, cost) or (None, inf) if no target can be reached
+        """
+        if not targets:
+            return None, float("inf")
+
+        if heuristic:
+            estimate = self._heuristic(targets)
+        else:
+            def estimate(node_id):
+                return 0.0
+
+        indptr = self.indptr
+        indices = self.indices
+        weights = self.weights
+        dist = {}
+        pred = {}
+        seen = {}
+        heap = []
+        tie = count()
+
+        for node_id, cost in sources.items():
+            if cost < seen.get(node_id, float("inf")):
+                seen[node_id] = cost
+                pred[node_id] = None
+                heapq.heappush(heap, (cost + estimate(node_id), next(tie), cost, node_id))
+
+        best_cost = float("inf")
+        best_target = None
+
+        while heap:
+            f, _, d, node_id = heapq.heappop(heap)
+            if node_id in dist:
+                continue
+            if f >= best_cost:
+                break
+            dist[node_id] = d
+
+            if node_id in targets and d + targets[node_id] < best_cost:
+                best_cost = d + targets[node_id]
+                best_target = node_id
+
+            start, end = indptr[node_id], indptr[node_id + 1]
+            for neighbor, weight in zip(indices[start:end].tolist(), weights[start:end].tolist()):
+                new_cost = d + weight
+                if neighbor not in dist and new_cost < seen.get(neighbor, float("inf")):
+                    seen[neighbor] = new_cost
+                    pred[neighbor] = node_id
+                    heapq.heappush(heap, (new_cost + estimate(neighbor), next(tie), new_cost, neighbor))
+
+        if best_target is None:
+            return None, float("inf")
+
+        path = [best_target]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path, best_cost
+
+    def distances(self, sources, targets=None, cutoff=None, lengths=False):
+        """
+        One-to-many Dijkstra on the CSR arrays
+
+        Args:
+            sources: dict node id -> initial cost
+            targets: stop once all these node ids are settled (default: explore everything)
+            cutoff: do not settle nodes farther than this cost
+            lengths: also measure the ground length of the cheapest path to each node
+                (the initial costs of the sources count as lengths)
+
+        Returns:
+            dict node id -> cost of every settled node, and with lengths=True a second
+            dict node id -> length (km) of the path of that cost
+        """
+        indptr = self.indptr
+        indices = self.indices
+        weights = self.weights
+        remaining = set(targets) if targets is not None else None
+        dist = {}
+        seen = dict(sources)
+        # Longueur du meilleur chemin connu vers chaque noeud, tenue à jour avec seen
+        seen_lengths = dict(sources) if lengths else None
+        path_lengths = {}
+        heap = [(cost, node_id) for node_id, cost in sources.items()]
+        heapq.heapify(heap)
+
+        while heap:
+            d, node_id = heapq.heappop(heap)
+            if node_id in dist:
+                continue
+            if cutoff is not None and d > cutoff:
+                break
+            dist[node_id] = d
+            if lengths:
+                path_lengths[node_id] = seen_lengths[node_id]
+            if remaining is not None:
+                remaining.discard(node_id)
+                if not remaining:
+                    break
+
+            start, end = indptr[node_id], indptr[node_id + 1]
+            edge_lengths = self.lengths[start:end].tolist() if lengths else None
+            for k, (neighbor, weight) in enumerate(zip(indices[start:end].tolist(), weights[start:end].tolist())):
+                new_cost = d + weight
+                if neighbor not in dist and new_cost < seen.get(neighbor, float("inf")):
+                    seen[neighbor] = new_cost
+                    if lengths:
+                        seen_lengths[neighbor] = path_lengths[node_id] + edge_lengths[k]
+                    heapq.heappush(heap, (new_cost, neighbor))
+
+        return (dist, path_lengths) if lengths else dist
+
+    def find_path(self, sources, targets):
+        """Same contract as path_search.multi_source_dijkstra, with node tuples"""
+        source_ids = {self.position[node]: cost for node, cost in sources.items() if node in self.position}
+        target_ids = {self.position[node]: cost for node, cost in targets.items() if node in self.position}
+        path, cost = self.shortest_path(source_ids, target_ids)
+        if path is None:
+            return None, cost
+        return [self.nodes[node_id] for node_id in path], cost
+
+
+def networkx_memory_usage(graph):
+    """Approximate number of bytes held by a networkx graph (containers, keys and attributes)"""
+    size = sys.getsizeof(graph._node) + sys.getsizeof(graph._adj)
+    seen_dicts = set()
+    for node, attributes in graph._node.items():
+        size += sys.getsizeof(node) + sum(sys.getsizeof(c) for c in node) + sys.getsizeof(attributes)
+    adjacencies = [graph._adj]
+    if graph.is_directed():
+        adjacencies.append(graph._pred)
+        size += sys.getsizeof(graph._pred)
+    for adjacency in adjacencies:
+        for neighbors in adjacency.values():
+            size += sys.getsizeof(neighbors)
+            for attributes in neighbors.values():
+                # Un graphe non orienté partage le même dict d'attributs pour (u, v) et (v, u)
+                if id(attributes) in seen_dicts:
+                    continue
+                seen_dicts.add(id(attributes))
+                size += sys.getsizeof(attributes)
+                size += sum(sys.getsizeof(value) for value in attributes.values())
+    return size
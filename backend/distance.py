@@ -0,0 +1,48 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    R = EARTH_RADIUS_KM
+    dLat = (lat2 - lat1) * math.pi / 180
+    dLon = (lon2 - lon1) * math.pi / 180
+    a = math.sin(dLat / 2) * math.sin(dLat / 2) + math.cos(lat1 * math.pi / 180) * math.cos(lat2 * math.pi / 180) * math.sin(dLon / 2) * math.sin(dLon / 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Vectorized version of calculate_distance
+
+    Arguments are scalars or NumPy arrays (broadcast together) of degrees,
+    the result is in km.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def segment_lengths(coords):
+    """Length in km of each segment of a (N, 2) array of [lon, lat] points (N - 1 values)"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return haversine(coords[:-1, 1], coords[:-1, 0], coords[1:, 1], coords[1:, 0])
+
+
+def path_length(coords):
+    """Total length in km of a polyline given as [lon, lat] points"""
+    if len(coords) < 2:
+        return 0.0
+    return float(segment_lengths(coords).sum())
+
+
+def distances_from(coords, lat, lng):
+    """Distance in km from a point to each of a (N, 2) array of [lon, lat] points"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return haversine(lat, lng, coords[:, 1], coords[:, 0])
@@ -0,0 +1,317 @@
+import asyncio
+import bisect
+import difflib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+import httpx
+import numpy as np
+
+from cache import TTLCache
+from distance import distances_from
+from landmarks import CACHE_DIR
+from metrics import fallbacks, nominatim_requests
+from routing_graph import ROADS_FILE, TRANSPORT_FILE
+
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org/search")
+
+# Cache des adresses géocodées par Nominatim, conservé sur disque entre deux démarrages
+GEOCODE_CACHE_FILE = os.environ.get("GEOCODE_CACHE_FILE", os.path.join(CACHE_DIR, "geocode_cache.json"))
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", 10000))
+GEOCODE_CACHE_TTL = float(os.environ.get("GEOCODE_CACHE_TTL", 30 * 24 * 3600))
+# Nouvelles réponses de Nominatim au-delà desquelles le cache est réécrit sur disque
+GEOCODE_CACHE_SAVE_EVERY = int(os.environ.get("GEOCODE_CACHE_SAVE_EVERY", 20))
+
+# Ville ajoutée par les utilisateurs, ignorée pour la recherche dans le répertoire local
+# (les plus longues d'abord : "38000 grenoble" avant "grenoble")
+_CITY_SUFFIXES = ("grenoble france", "38000 grenoble", "38100 grenoble", "grenoble", "france")
+
+
+class GeocodingError(Exception):
+    """Raised when the geocoding service cannot answer a request"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def normalize_address(address):
+    """Lowercase, strip accents and punctuation and collapse spaces: "Rue  Félix-Poulat" -> "rue felix poulat" """
+    text = unicodedata.normalize("NFKD", address)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    text = re.sub(r"[^\w]+", " ", text)
+    return " ".join(text.split())
+
+
+def _strip_city(key):
+    for suffix in _CITY_SUFFIXES:
+        if key.endswith(" " + suffix):
+            return key[:-len(suffix) - 1]
+    return key
+
+
+class Gazetteer:
+    """
+    Offline lookup of street and stop names
+
+    Built from the `name` properties of the road network and the stop names of the
+    public transport file. Each name resolves to one point: for a street, the vertex
+    closest to the centre of all its segments (so the point lies on the street), for a
+    stop, the average position of its quays. Lookups try an exact match, then a prefix
+    match (shortest name wins) and finally a fuzzy match with difflib.
+    """
+
+    def __init__(self, entries, fuzzy_cutoff=0.88, min_prefix=4):
+        # entries : clé normalisée -> {"lat", "lng", "display_name"}
+        self.entries = entries
+        self.keys = sorted(entries)
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.min_prefix = min_prefix
+
+    @classmethod
+    def from_files(cls, roads_file=None, transport_file=None):
+        roads_file = roads_file or ROADS_FILE
+        transport_file = transport_file or TRANSPORT_FILE
+        streets = {}
+        stops = {}
+
+        if os.path.exists(roads_file):
+            with open(roads_file, "r", encoding="utf-8") as file:
+                for feature in json.load(file).get("features", []):
+                    name = feature.get("properties", {}).get("name")
+                    geometry = feature.get("geometry") or {}
+                    if name and geometry.get("type") == "LineString":
+                        streets.setdefault(name, []).extend(geometry["coordinates"])
+
+        if os.path.exists(transport_file):
+            with open(transport_file, "r", encoding="utf-8") as file:
+                for feature in json.load(file).get("features", []):
+                    name = feature.get("properties", {}).get("name")
+                    geometry = feature.get("geometry") or {}
+                    if name and geometry.get("type") == "Point":
+                        stops.setdefault(name, []).append(geometry["coordinates"])
+
+        entries = {}
+        for name, coordinates in streets.items():
+            coords = np.array(coordinates, dtype=np.float64)
+            center_lng, center_lat = coords.mean(axis=0)
+            lng, lat = coords[int(np.argmin(distances_from(coords, center_lat, center_lng)))]
+            entries.setdefault(normalize_address(name), {
+                "lat": float(lat), "lng": float(lng), "display_name": f"{name}, Grenoble"})
+
+        for name, coordinates in stops.items():
+            lng, lat = np.array(coordinates, dtype=np.float64).mean(axis=0)
+            entry = {"lat": float(lat), "lng": float(lng), "display_name": name}
+            # "Échirolles, Denis Papin" est aussi trouvé par "Denis Papin"
+            entries[normalize_address(name)] = entry
+            if ", " in name:
+                entries.setdefault(normalize_address(name.split(", ", 1)[1]), entry)
+
+        entries.pop("", None)
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, address, fuzzy=True):
+        """
+        Return {"lat", "lng", "display_name"} or None if the name is not known locally
+
+        With fuzzy=False only the exact and prefix matches are tried (a few microseconds);
+        the fuzzy match compares the address with every known name.
+        """
+        key = _strip_city(normalize_address(address))
+        if not key:
+            return None
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            return entry
+
+        if len(key) >= self.min_prefix:
+            i = bisect.bisect_left(self.keys, key)
+            matches = []
+            while i < len(self.keys) and self.keys[i].startswith(key):
+                matches.append(self.keys[i])
+                i += 1
+            if matches:
+                return self.entries[min(matches, key=len)]
+
+        # Les numéros de rue ne sont pas connus localement : laisser Nominatim s'en charger
+        if not fuzzy or any(c.isdigit() for c in key):
+            return None
+        matches = difflib.get_close_matches(key, self.keys, n=1, cutoff=self.fuzzy_cutoff)
+        return self.entries[matches[0]] if matches else None
+
+
+class Geocoder:
+    """
+    Address -> coordinates, resolved locally whenever possible
+
+    Order: offline gazetteer, then the cache of previous Nominatim answers (keyed by the
+    normalized address, LRU with a TTL and saved to disk), then Nominatim itself.
+
+    The gazetteer is built and its fuzzy matches are computed in a thread (after the
+    cache lookup, which only holds addresses the gazetteer did not know), so that
+    geocode() never blocks the event loop. The cache is written to disk in a thread
+    every GEOCODE_CACHE_SAVE_EVERY new answers and when the geocoder is closed.
+    """
+
+    def __init__(self, cache_file=None, max_size=None, ttl=None, roads_file=None, transport_file=None):
+        self.cache_file = cache_file or GEOCODE_CACHE_FILE
+        self.roads_file = roads_file
+        self.transport_file = transport_file
+        self.cache = TTLCache(max_size=max_size or GEOCODE_CACHE_SIZE, ttl=ttl or GEOCODE_CACHE_TTL,
+                              clock=time.time)
+        self._gazetteer = None
+        self._lock = threading.Lock()
+        self._client = None
+        self.gazetteer_hits = 0
+        self.nominatim_calls = 0
+        self._unsaved = 0
+        self._save_task = None
+        self._load_cache()
+
+    @property
+    def gazetteer(self):
+        if self._gazetteer is None:
+            with self._lock:
+                if self._gazetteer is None:
+                    self._gazetteer = Gazetteer.from_files(self.roads_file, self.transport_file)
+                    print(f"Gazetteer loaded with {len(self._gazetteer)} names")
+        return self._gazetteer
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring geocoding cache {self.cache_file}: {e}")
+            return
+        now = time.time()
+        for key, value, stored_at in entries:
+            if now - stored_at <= self.cache.ttl:
+                self.cache.set(key, value, stored_at=stored_at)
+
+    async def load_gazetteer(self):
+        """Build the gazetteer in a thread (at startup, or on the first lookup)"""
+        if self._gazetteer is not None:
+            return self._gazetteer
+        return await asyncio.to_thread(lambda: self.gazetteer)
+
+    def save_cache(self):
+        self._unsaved = 0
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.cache.items(), file, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_file)
+
+    def _save_quietly(self):
+        try:
+            self.save_cache()
+        except OSError as e:
+            print(f"Could not save the geocoding cache: {e}")
+
+    def _save_later(self):
+        # Une seule écriture à la fois ; les réponses arrivées entre-temps partent avec la suivante
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.ensure_future(asyncio.to_thread(self._save_quietly))
+
+    def _session(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=10.0, headers={
+                'User-Agent': 'GrenobleTransportApp/1.0'  # Required by Nominatim's terms
+            })
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        if self._save_task is not None:
+            await self._save_task
+            self._save_task = None
+        if self._unsaved:
+            await asyncio.to_thread(self._save_quietly)
+
+    async def _nominatim(self, address):
+        params = {
+            'q': address,
+            'format': 'json',
+            'limit': 1,
+            'addressdetails': 1,
+            'viewbox': '5.6,45.1,5.8,45.3',  # Viewbox around Grenoble
+            'bounded': 1
+        }
+        self.nominatim_calls += 1
+        try:
+            response = await self._session().get(NOMINATIM_URL, params=params)
+        except httpx.HTTPError as e:
+            nominatim_requests.inc(outcome="connection_error")
+            raise GeocodingError(f"Geocoding service error: {e}") from e
+        if response.status_code != 200:
+            nominatim_requests.inc(outcome="error")
+            raise GeocodingError("Geocoding service error", response.status_code)
+        results = response.json()
+        if not results:
+            nominatim_requests.inc(outcome="not_found")
+            return None
+        nominatim_requests.inc(outcome="ok")
+        return {
+            "lat": float(results[0]["lat"]),
+            "lng": float(results[0]["lon"]),
+            "display_name": results[0]["display_name"]
+        }
+
+    async def geocode(self, address):
+        """
+        Return {"lat", "lng", "display_name", "source"} or None if the address is unknown
+
+        Raises:
+            GeocodingError if Nominatim has to be called and fails
+        """
+        gazetteer = await self.load_gazetteer()
+        entry = gazetteer.lookup(address, fuzzy=False)
+        if entry is not None:
+            self.gazetteer_hits += 1
+            return dict(entry, source="gazetteer")
+
+        # Une adresse du cache a déjà échoué dans le répertoire local, approximations comprises
+        key = normalize_address(address)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return dict(entry, source="cache")
+
+        entry = await asyncio.to_thread(gazetteer.lookup, address)
+        if entry is not None:
+            self.gazetteer_hits += 1
+            return dict(entry, source="gazetteer")
+
+        fallbacks.inc(source="gazetteer", fallback="nominatim")
+        entry = await self._nominatim(address)
+        if entry is not None:
+            # Les adresses introuvables ne sont pas mémorisées
+            self.cache.set(key, entry)
+            self._unsaved += 1
+            if self._unsaved >= GEOCODE_CACHE_SAVE_EVERY:
+                self._save_later()
+            return dict(entry, source="nominatim")
+        return None
+
+    def stats(self):
+        return {
+            "gazetteer_names": len(self._gazetteer) if self._gazetteer is not None else None,
+            "gazetteer_hits": self.gazetteer_hits,
+            "nominatim_calls": self.nominatim_calls,
+            "cache": self.cache.stats()
+        }
+
+
+geocoder = Geocoder()
@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import struct
+
+import networkx as nx
+import numpy as np
+
+from distance import haversine
+from routing_graph import ALLOWED_TYPES, CACHE_DIR, ROADS_FILE, TRANSPORT_FILE, feature_id, load_features
+
+SNAPSHOT_FILE = os.path.join(CACHE_DIR, "graph.snapshot")
+
+MAGIC = b"MARGOGRF"
+SNAPSHOT_VERSION = 2
+ALIGNMENT = 64
+
+# Un bit par mode de transport dans le masque de chaque arête
+MODE_BITS = {transport_mode: 1 << i for i, transport_mode in enumerate(ALLOWED_TYPES)}
+
+
+def _source_info(paths):
+    return [{"path": os.path.abspath(path), "mtime": os.path.getmtime(path), "size": os.path.getsize(path)}
+            for path in paths]
+
+
+def build_snapshot(output_file=None, roads_file=None, transport_file=None):
+    """
+    Convert the GeoJSON files into a binary graph snapshot
+
+    The snapshot holds every road/line segment once with a bitmask of the transport modes
+    allowed on it, so that the graph of any mode can be rebuilt without parsing GeoJSON.
+
+    File layout: magic, version (uint32), header length (uint64), JSON header (array
+    offsets, string table, feature ids, source file mtimes), then the arrays aligned
+    on 64 bytes.
+    """
+    output_file = output_file or SNAPSHOT_FILE
+    roads_file = roads_file or ROADS_FILE
+    transport_file = transport_file or TRANSPORT_FILE
+
+    # Même liste que pour le graphe "transit" : toutes les routes puis les lignes de transport
+    features = load_features("transit", roads_file, transport_file)
+
+    node_ids = {}
+    coords = []
+    strings = []
+    string_ids = {}
+    columns = {name: [] for name in ("edge_u", "edge_v", "modes", "oneway",
+                                     "feature", "name", "highway", "destination")}
+
+    def string_id(value):
+        if value is None:
+            return -1
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    def node_id(coord):
+        node = tuple(coord)
+        if node not in node_ids:
+            node_ids[node] = len(coords)
+            coords.append(node)
+        return node_ids[node]
+
+    for feature_index, feature in enumerate(features):
+        if feature.get("geometry", {}).get("type") != "LineString":
+            continue
+        props = feature.get("properties", {})
+        highway = props.get("highway")
+
+        modes = MODE_BITS["transit"]
+        for transport_mode, allowed in ALLOWED_TYPES.items():
+            if highway in allowed:
+                modes |= MODE_BITS[transport_mode]
+
+        coordinates = feature["geometry"]["coordinates"]
+        for i in range(len(coordinates) - 1):
+            node1 = tuple(coordinates[i])
+            node2 = tuple(coordinates[i + 1])
+            columns["edge_u"].append(node_id(node1))
+            columns["edge_v"].append(node_id(node2))
+            columns["modes"].append(modes)
+            columns["oneway"].append(props.get("oneway") == "yes")
+            columns["feature"].append(feature_index)
+            columns["name"].append(string_id(props["name"]) if "name" in props else -1)
+            columns["highway"].append(string_id(highway))
+            columns["destination"].append(string_id(props["destination"]) if "destination" in props else -1)
+
+    coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    edge_u = np.array(columns["edge_u"], dtype=np.int32)
+    edge_v = np.array(columns["edge_v"], dtype=np.int32)
+    # Longueur de tous les segments en un seul calcul vectorisé
+    weights = haversine(coords[edge_u, 1], coords[edge_u, 0], coords[edge_v, 1], coords[edge_v, 0])
+
+    arrays = {
+        "coords": coords,
+        "edge_u": edge_u,
+        "edge_v": edge_v,
+        "weight": weights,
+        "modes": np.array(columns["modes"], dtype=np.uint8),
+        "oneway": np.array(columns["oneway"], dtype=np.uint8),
+        "feature": np.array(columns["feature"], dtype=np.int32),
+        "name": np.array(columns["name"], dtype=np.int32),
+        "highway": np.array(columns["highway"], dtype=np.int32),
+        "destination": np.array(columns["destination"], dtype=np.int32)
+    }
+    write_snapshot(output_file, arrays, strings, _source_info([roads_file, transport_file]),
+                   [feature_id(feature) for feature in features])
+    return output_file
+
+
+def write_snapshot(path, arrays, strings, sources, feature_ids=()):
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "sources": sources,
+        "modes": MODE_BITS,
+        "strings": strings,
+        # Id OSM de chaque feature, pour les mises à jour par feature (GraphRegistry.update_edges)
+        "feature_ids": list(feature_ids),
+        "arrays": layout
+    }, ensure_ascii=False).encode("utf-8")
+
+    prefix_size = len(MAGIC) + 4 + 8 + len(header)
+    data_start = (prefix_size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<IQ", SNAPSHOT_VERSION, len(header)))
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(data_start + layout[name]["offset"])
+            file.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+class GraphSnapshot:
+    """
+    Read-only view of a snapshot file, memory-mapped
+
+    Only the arrays are mapped: build_graph() still makes a networkx graph per worker in
+    private memory, so the snapshot makes a worker start faster but saves little memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a graph snapshot")
+            version, header_size = struct.unpack("<IQ", file.read(12))
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported snapshot version {version} (expected {SNAPSHOT_VERSION})")
+            header = json.loads(file.read(header_size).decode("utf-8"))
+
+        prefix_size = len(MAGIC) + 12 + header_size
+        data_start = (prefix_size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+        self.version = version
+        self.sources = header["sources"]
+        self.mode_bits = header["modes"]
+        self.strings = header["strings"]
+        self.feature_ids = header["feature_ids"]
+        self.arrays = {}
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if int(np.prod(shape)) == 0:
+                self.arrays[name] = np.empty(shape, dtype=spec["dtype"])
+            else:
+                self.arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r",
+                                              offset=data_start + spec["offset"], shape=shape)
+
+    def is_stale(self):
+        """True if a source GeoJSON file is newer than the snapshot"""
+        for source in self.sources:
+            path = source["path"]
+            if os.path.exists(path) and (os.path.getmtime(path) > source["mtime"]
+                                         or os.path.getsize(path) != source["size"]):
+                return True
+        return False
+
+    def _string(self, string_id):
+        return self.strings[string_id] if string_id >= 0 else None
+
+    def build_graph(self, transport_mode):
+        """
+        Rebuild the graph of a transport mode, identical to routing_graph.build_graph
+
+        Returns:
+            tuple (graph, streets) where streets is the node -> street info index
+        """
+        bit = self.mode_bits[transport_mode]
+        arrays = self.arrays
+        selected = np.flatnonzero(arrays["modes"] & bit)
+        nodes = [tuple(coord) for coord in arrays["coords"].tolist()]
+        directed = transport_mode == "driving"
+
+        G = nx.DiGraph() if directed else nx.Graph()
+        streets = {}
+        columns = zip(arrays["edge_u"][selected].tolist(), arrays["edge_v"][selected].tolist(),
+                      arrays["weight"][selected].tolist(), arrays["oneway"][selected].tolist(),
+                      arrays["feature"][selected].tolist(), arrays["name"][selected].tolist(),
+                      arrays["highway"][selected].tolist(), arrays["destination"][selected].tolist())
+
+        for u, v, weight, oneway, feature, name, highway, destination in columns:
+            node1, node2 = nodes[u], nodes[v]
+            street = {"feature": feature, "highway": self._string(highway)}
+            if name >= 0:
+                street["name"] = self.strings[name]
+            if destination >= 0:
+                street["destination"] = self.strings[destination]
+
+            G.add_node(node1, pos=node1)
+            G.add_node(node2, pos=node2)
+            if oneway and directed:
+                G.add_edge(node1, node2, weight=weight, oneway=True, **street)
+            else:
+                G.add_edge(node1, node2, weight=weight, **street)
+                if directed:
+                    G.add_edge(node2, node1, weight=weight, **street)
+
+            # Même règle que routing_graph.build_street_index
+            for node in (node1, node2):
+                info = streets.get(node)
+                if info is None:
+                    streets[node] = {"name": street.get("name"), "highway": street["highway"],
+                                     "destination": street.get("destination")}
+                    continue
+                if info["name"] is None and "name" in street:
+                    info["name"] = street["name"]
+                if info["destination"] is None and "destination" in street:
+                    info["destination"] = street["destination"]
+
+        return G, streets
+
+
+def load_snapshot(path=None):
+    """Open a snapshot file, or return None if it is missing, invalid or older than its sources"""
+    path = path or SNAPSHOT_FILE
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = GraphSnapshot(path)
+    except (ValueError, KeyError) as e:
+        print(f"Ignoring graph snapshot {path}: {e}")
+        return None
+    if snapshot.is_stale():
+        print(f"Ignoring graph snapshot {path}: the GeoJSON files are newer, rebuild it")
+        return None
+    return snapshot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the binary graph snapshot loaded by the backend workers")
+    parser.add_argument("--output", default=SNAPSHOT_FILE, help="snapshot file to write")
+    parser.add_argument("--roads", default=ROADS_FILE, help="road network GeoJSON")
+    parser.add_argument("--transport", default=TRANSPORT_FILE, help="public transport GeoJSON")
+    parser.add_argument("--check", action="store_true", help="only report whether the snapshot is up to date")
+    args = parser.parse_args()
+
+    if args.check:
+        if not os.path.exists(args.output):
+            print(f"{args.output} does not exist")
+        elif GraphSnapshot(args.output).is_stale():
+            print(f"{args.output} is older than its GeoJSON sources")
+        else:
+            print(f"{args.output} is up to date")
+    else:
+        path = build_snapshot(args.output, args.roads, args.transport)
+        print(f"Wrote graph snapshot to {path} ({os.path.getsize(path)} bytes)")
@@ -0,0 +1,60 @@
+from isochrone import isochrone_cache
+from route_cache import route_cache
+from routing_graph import graph_registry
+from transit_router import transit_router
+
+
+def invalidate(report):
+    """
+    Drop what was computed on the edges that changed (see GraphRegistry.update_edges)
+
+    - cached paths: only the ones going through a closed or slowed down edge, or all the
+      paths of the mode when an edge got cheaper or came back (any path may be shorter)
+    - isochrones of the changed modes
+    - the local transit router and its itineraries when the walking graph changed (its
+      walks and transfers follow the walking graph)
+    The CSR arrays and the ALT landmarks are carried over by RoutingGraph.patched.
+    """
+    for transport_mode, changes in report.items():
+        if changes["lowered"]:
+            route_cache.invalidate([transport_mode])
+        else:
+            edges = changes["edges"]
+            if not graph_registry.get(transport_mode).graph.is_directed():
+                edges = edges + [(v, u) for u, v in edges]
+            route_cache.invalidate_edges(transport_mode, edges)
+        for key, _, _ in isochrone_cache.items():
+            if key[0] == transport_mode:
+                isochrone_cache.pop(key)
+    if "walking" in report:
+        transit_router.reset()
+        route_cache.invalidate_transit("local")
+
+
+def apply_updates(changes):
+    """
+    GraphRegistry.update_edges, then the invalidation of what depended on the changed edges
+
+    In the server, which loads no graph, the report is empty: the local transit itineraries
+    it caches are dropped as soon as a walking feature changes.
+    """
+    report, unknown = graph_registry.update_edges(changes)
+    invalidate(report)
+    if any(transport_mode == "walking" and value not in unknown for transport_mode, value, _, _ in changes):
+        route_cache.invalidate_transit("local")
+    return report, unknown
+
+
+def update_report(changes):
+    """
+    GraphRegistry.feature_report of the features of update_edges changes
+
+    Runs in a routing worker, whose graphs already went through the changes (the server
+    process loads no graph, so its own report is empty).
+    """
+    return graph_registry.feature_report([(transport_mode, value) for transport_mode, value, _, _ in changes])
+
+
+def sync_updates(state):
+    """Bring the graphs of a worker process up to date with graph_registry.updates() of the server"""
+    invalidate(graph_registry.sync_updates(state))
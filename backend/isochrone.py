@@ -0,0 +1,141 @@
+import math
+import os
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping
+
+from cache import TTLCache
+from distance import EARTH_RADIUS_KM, distances_from
+from routing_graph import SPEEDS_KMH, graph_registry
+
+# Modes pour lesquels une isochrone a un sens avec une vitesse constante
+ISOCHRONE_MODES = ("walking", "cycling", "driving")
+# Largeur du tampon autour des rues atteintes
+ISOCHRONE_BUFFER_KM = 0.05
+# Les trous plus petits (îlots entre les rues) sont bouchés
+ISOCHRONE_MIN_HOLE_KM2 = 0.25
+ISOCHRONE_CACHE_SIZE = int(os.environ.get("ISOCHRONE_CACHE_SIZE", 256))
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+isochrone_cache = TTLCache(max_size=ISOCHRONE_CACHE_SIZE)
+
+
+def reached_segments(csr, dist, cutoff):
+    """
+    Pieces of the network reachable within cutoff km
+
+    Every edge leaving a reached node is kept, cut where the remaining budget runs out.
+
+    Returns:
+        arrays (starts, ends) of (lon, lat) coordinates, one row per segment
+    """
+    reached = np.array([node_id for node_id, d in dist.items() if d <= cutoff], dtype=np.int64)
+    if len(reached) == 0:
+        return np.empty((0, 2)), np.empty((0, 2))
+    costs = np.array([dist[node_id] for node_id in reached.tolist()])
+
+    first, last = csr.indptr[reached], csr.indptr[reached + 1]
+    counts = last - first
+    # Indices de toutes les arêtes sortantes des noeuds atteints, sans boucle Python
+    edges = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    sources = np.repeat(reached, counts)
+    weights = csr.weights[edges].astype(np.float64)
+    reach = np.minimum(weights, cutoff - np.repeat(costs, counts))
+    fraction = np.where(weights > 0, reach / np.where(weights > 0, weights, 1), 1.0)
+
+    starts = csr.coords[sources]
+    ends = starts + (csr.coords[csr.indices[edges]] - starts) * fraction[:, None]
+    # Noeuds isolés ou sans arête sortante : garder au moins le point lui-même
+    isolated = reached[counts == 0]
+    return (np.concatenate([starts, csr.coords[isolated]]),
+            np.concatenate([ends, csr.coords[isolated]]))
+
+
+def isochrone_polygon(starts, ends, method="buffer"):
+    """
+    Polygon around the reached segments
+
+    method="buffer" buffers the segments by ISOCHRONE_BUFFER_KM (follows the streets),
+    method="hull" takes the concave hull of their endpoints (smoother outline).
+    Longitudes are scaled by cos(latitude) first so that the buffer is round on the ground.
+    """
+    if len(starts) == 0:
+        return shapely.Polygon()
+    scale = np.array([math.cos(math.radians(float(starts[:, 1].mean()))), 1.0])
+    starts, ends = starts * scale, ends * scale
+    radius = ISOCHRONE_BUFFER_KM / KM_PER_DEGREE
+
+    if method == "hull":
+        points = shapely.multipoints(np.concatenate([starts, ends]))
+        polygon = shapely.concave_hull(points, ratio=0.3).buffer(radius)
+    else:
+        # Fusionner les segments (chaque rue est parcourue dans les deux sens) avant le tampon
+        lines = shapely.line_merge(shapely.union_all(shapely.linestrings(np.stack([starts, ends], axis=1))))
+        polygon = _fill_holes(lines.buffer(radius, quad_segs=2), ISOCHRONE_MIN_HOLE_KM2 / KM_PER_DEGREE ** 2)
+    polygon = polygon.simplify(radius / 4)
+    return shapely.set_precision(shapely.transform(polygon, lambda coords: coords / scale), 1e-6)
+
+
+def _fill_holes(polygon, min_area):
+    parts = polygon.geoms if polygon.geom_type == "MultiPolygon" else [polygon]
+    filled = [shapely.Polygon(part.exterior, [ring for ring in part.interiors
+                                              if shapely.Polygon(ring).area >= min_area])
+              for part in parts]
+    return filled[0] if len(filled) == 1 else shapely.MultiPolygon(filled)
+
+
+def compute_isochrones(routing_graph, transport_mode, lat, lng, minutes, method="buffer"):
+    """
+    Isochrone polygons around a point, one per time budget
+
+    A single Dijkstra bounded by the largest budget runs from the network node closest
+    to the point, at the speed of the mode. The features are cached per (mode, start
+    node, budgets, method); the cache is cleared when the graphs are reloaded. The start
+    of the answer depends on the requested point and is added after the cache lookup.
+
+    Returns:
+        GeoJSON FeatureCollection, largest budget first
+    """
+    csr = routing_graph.csr_graph()
+    node = routing_graph.node_index.nearest_nodes(lat, lng, 1)[0]
+    minutes = tuple(sorted(set(minutes), reverse=True))
+    key = (transport_mode, node, minutes, method)
+    features = isochrone_cache.get(key)
+    if features is None:
+        features = _isochrone_features(csr, node, SPEEDS_KMH[transport_mode], minutes, method)
+        isochrone_cache.set(key, features)
+
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "transport_mode": transport_mode,
+        "start": {"lat": node[1], "lng": node[0],
+                  "distance": round(float(distances_from([node], lat, lng)[0]), 3)}
+    }
+
+
+def isochrone(transport_mode, lat, lng, minutes, method="buffer"):
+    """compute_isochrones on the graph of the mode, in a routing worker"""
+    return compute_isochrones(graph_registry.get(transport_mode), transport_mode, lat, lng, minutes, method)
+
+
+def _isochrone_features(csr, node, speed, minutes, method):
+    dist = csr.distances({csr.position[node]: 0.0}, cutoff=speed * minutes[0] / 60)
+
+    features = []
+    for budget in minutes:
+        cutoff = speed * budget / 60
+        starts, ends = reached_segments(csr, dist, cutoff)
+        polygon = isochrone_polygon(starts, ends, method)
+        features.append({
+            "type": "Feature",
+            "geometry": mapping(polygon),
+            "properties": {
+                "minutes": budget,
+                "distance_km": round(cutoff, 3),
+                "nodes": sum(1 for d in dist.values() if d <= cutoff)
+            }
+        })
+    return features
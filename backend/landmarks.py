@@ -0,0 +1,262 @@
+import argparse
+import heapq
+import os
+import random
+from itertools import count
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+
+CACHE_DIR = os.path.join(Path(__file__).resolve().parent, "cache")
+
+
+def graph_fingerprint(graph):
+    """Cheap signature of a graph, used to detect stale preprocessing files"""
+    total_weight = sum(weight for _, _, weight in graph.edges(data="weight", default=0))
+    return f"{graph.number_of_nodes()}-{graph.number_of_edges()}-{total_weight:.6f}"
+
+
+def _distance_array(graph, nodes, position, landmark, reverse=False):
+    distances = np.full(len(nodes), np.inf)
+    search_graph = graph.reverse(copy=False) if reverse else graph
+    for node, d in nx.single_source_dijkstra_path_length(search_graph, landmark, weight="weight").items():
+        distances[position[node]] = d
+    return distances
+
+
+class LandmarkIndex:
+    """
+    ALT preprocessing (A*, Landmarks, Triangle inequality) for a routing graph
+
+    The distances from (and, for directed graphs, to) a few well spread landmarks are
+    computed once. By the triangle inequality they give a lower bound of the remaining
+    distance to the destination, which lets A* explore only a small part of the graph.
+    """
+
+    def __init__(self, graph, nodes, landmarks, from_landmarks, to_landmarks, fingerprint):
+        self.graph = graph
+        self.nodes = nodes
+        self.position = {node: i for i, node in enumerate(nodes)}
+        self.landmarks = landmarks
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def build(cls, graph, landmark_count=8, seed=0):
+        """Select landmarks with the farthest-point heuristic and compute their distances"""
+        nodes = list(graph.nodes())
+        position = {node: i for i, node in enumerate(nodes)}
+        landmark_count = min(landmark_count, len(nodes))
+
+        landmarks = []
+        from_columns = []
+        to_columns = []
+        # Distance minimale de chaque noeud aux landmarks déjà choisis
+        closest = np.full(len(nodes), np.inf)
+        current = random.Random(seed).randrange(len(nodes)) if nodes else None
+
+        for _ in range(landmark_count):
+            distances = _distance_array(graph, nodes, position, nodes[current])
+            landmarks.append(current)
+            from_columns.append(distances)
+            if graph.is_directed():
+                to_columns.append(_distance_array(graph, nodes, position, nodes[current], reverse=True))
+
+            closest = np.minimum(closest, distances)
+            reachable = np.where(np.isfinite(closest), closest, -1)
+            reachable[landmarks] = -1
+            current = int(reachable.argmax())
+            if reachable[current] <= 0:
+                break
+
+        from_landmarks = np.stack(from_columns, axis=1) if from_columns else np.empty((len(nodes), 0))
+        to_landmarks = np.stack(to_columns, axis=1) if to_columns else None
+        return cls(graph, nodes, np.array(landmarks, dtype=np.int64), from_landmarks, to_landmarks,
+                   graph_fingerprint(graph))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        arrays = {
+            "nodes": np.array(self.nodes, dtype=np.float64).reshape(-1, 2),
+            "landmarks": self.landmarks,
+            "from_landmarks": self.from_landmarks,
+            "fingerprint": np.array(self.fingerprint)
+        }
+        if self.to_landmarks is not None:
+            arrays["to_landmarks"] = self.to_landmarks
+        # Ecrire dans un fichier temporaire pour ne jamais laisser un fichier à moitié écrit,
+        # propre à ce processus : plusieurs processus de calcul peuvent enregistrer en même temps
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, graph, fingerprint=None):
+        """
+        Load a preprocessing file, or return None if it does not match the graph
+
+        fingerprint is the one of the graph by default; a graph whose edges were closed or
+        slowed down passes the one of its original graph, whose landmarks stay valid.
+        """
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            expected = fingerprint or graph_fingerprint(graph)
+            fingerprint = str(data["fingerprint"])
+            nodes = list(graph.nodes())
+            if fingerprint != expected:
+                return None
+            if not np.array_equal(data["nodes"], np.array(nodes, dtype=np.float64).reshape(-1, 2)):
+                return None
+            to_landmarks = data["to_landmarks"] if "to_landmarks" in data else None
+            return cls(graph, nodes, data["landmarks"], data["from_landmarks"], to_landmarks, fingerprint)
+
+    @classmethod
+    def load_or_build(cls, graph, path, landmark_count=8):
+        index = cls.load(path, graph)
+        if index is None:
+            index = cls.build(graph, landmark_count)
+            index.save(path)
+            print(f"Saved {len(index.landmarks)} landmarks to {path}")
+        return index
+
+    def rebind(self, graph):
+        """Same landmarks for a copy of the graph with the same nodes and weights no lower"""
+        return self.__class__(graph, self.nodes, self.landmarks, self.from_landmarks, self.to_landmarks,
+                              self.fingerprint)
+
+    def find_path(self, sources, targets, weight="weight"):
+        """
+        A* search from several sources to the closest of several targets
+
+        Same contract as path_search.multi_source_dijkstra: sources and targets map nodes
+        to the distance already travelled / still to travel outside the graph.
+        """
+        targets = {node: cost for node, cost in targets.items() if node in self.position}
+        if not targets:
+            return None, float("inf")
+
+        target_rows = [self.position[node] for node in targets]
+        target_costs = np.array(list(targets.values()))
+
+        # Bornes inférieures communes à toutes les cibles, en tenant compte de leur coût final :
+        # d(v, t) >= d(L, t) - d(L, v) et d(v, t) >= d(v, L) - d(t, L)
+        # (dans un graphe non orienté, d(v, L) = d(L, v))
+        to_landmarks = self.to_landmarks if self.to_landmarks is not None else self.from_landmarks
+        with np.errstate(invalid="ignore"):
+            forward_bound = (self.from_landmarks[target_rows] + target_costs[:, None]).min(axis=0)
+            backward_bound = (to_landmarks[target_rows] - target_costs[:, None]).max(axis=0)
+
+        heuristics = {}
+
+        def heuristic(node):
+            h = heuristics.get(node)
+            if h is None:
+                row = self.position[node]
+                with np.errstate(invalid="ignore"):
+                    terms = np.concatenate([forward_bound - self.from_landmarks[row],
+                                            to_landmarks[row] - backward_bound])
+                terms[np.isnan(terms)] = 0
+                h = max(float(terms.max()), 0.0) if len(terms) else 0.0
+                heuristics[node] = h
+            return h
+
+        adjacency = self.graph.adj
+        dist = {}
+        pred = {}
+        seen = {}
+        heap = []
+        tie = count()
+
+        for node, cost in sources.items():
+            if node in self.position and cost < seen.get(node, float("inf")):
+                seen[node] = cost
+                pred[node] = None
+                heapq.heappush(heap, (cost + heuristic(node), next(tie), cost, node))
+
+        best_cost = float("inf")
+        best_target = None
+
+        while heap:
+            f, _, d, node = heapq.heappop(heap)
+            if node in dist:
+                continue
+            if f >= best_cost:
+                break
+            dist[node] = d
+
+            if node in targets and d + targets[node] < best_cost:
+                best_cost = d + targets[node]
+                best_target = node
+
+            for neighbor, attributes in adjacency[node].items():
+                new_cost = d + attributes.get(weight, 1)
+                if neighbor not in dist and new_cost < seen.get(neighbor, float("inf")):
+                    seen[neighbor] = new_cost
+                    pred[neighbor] = node
+                    h = heuristic(neighbor)
+                    if h != float("inf"):
+                        heapq.heappush(heap, (new_cost + h, next(tie), new_cost, neighbor))
+
+        if best_target is None:
+            return None, float("inf")
+
+        path = [best_target]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        path.reverse()
+        return path, best_cost
+
+
+def check_against_networkx(graph, index, pairs=100, seed=0):
+    """
+    Compare ALT routes with nx.shortest_path on random node pairs
+
+    Returns:
+        list of (source, target, alt_length, networkx_length) for the pairs that differ
+    """
+    rng = random.Random(seed)
+    nodes = list(graph.nodes())
+    mismatches = []
+    for _ in range(pairs):
+        source, target = rng.choice(nodes), rng.choice(nodes)
+        try:
+            expected_path = nx.shortest_path(graph, source=source, target=target, weight="weight")
+            expected = nx.path_weight(graph, expected_path, weight="weight")
+        except nx.NetworkXNoPath:
+            expected = float("inf")
+
+        path, length = index.find_path({source: 0.0}, {target: 0.0})
+        if path is not None and (path[0] != source or path[-1] != target):
+            mismatches.append((source, target, length, expected))
+        elif not (length == expected or abs(length - expected) <= 1e-9 * max(1.0, expected)):
+            mismatches.append((source, target, length, expected))
+    return mismatches
+
+
+def landmark_file(transport_mode):
+    return os.path.join(CACHE_DIR, f"landmarks_{transport_mode}.npz")
+
+
+if __name__ == "__main__":
+    from routing_graph import graph_registry
+
+    parser = argparse.ArgumentParser(description="Precompute ALT landmarks for the routing graphs")
+    parser.add_argument("modes", nargs="*", default=["driving"], help="transport modes to preprocess")
+    parser.add_argument("--landmarks", type=int, default=8, help="number of landmarks")
+    parser.add_argument("--check", type=int, default=0, help="number of random pairs to check against networkx")
+    args = parser.parse_args()
+
+    for mode in args.modes:
+        routing_graph = graph_registry.get(mode)
+        index = LandmarkIndex.build(routing_graph.graph, args.landmarks)
+        index.save(landmark_file(mode))
+        print(f"{mode}: saved {len(index.landmarks)} landmarks to {landmark_file(mode)}")
+
+        if args.check:
+            mismatches = check_against_networkx(routing_graph.graph, index, args.check)
+            print(f"{mode}: {args.check - len(mismatches)}/{args.check} routes identical to nx.shortest_path")
+            for source, target, length, expected in mismatches[:10]:
+                print(f"  {source} -> {target}: ALT {length} vs networkx {expected}")
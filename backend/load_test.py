@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+
+from app import GRENOBLE_BOUNDS
+from bench_routing import Timings, git_commit
+from metrics import METRICS_PREFIX
+from stub_servers import mtag_stub, nominatim_stub
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODES = ("walking", "cycling", "driving", "transit")
+LINES = ("A", "B", "C", "D", "E", "C1", "C2", "C3", "C4", "C5", "C6", "12", "13", "16")
+STREETS = ("rue Félix Poulat", "avenue Alsace-Lorraine", "cours Jean Jaurès", "rue de Stalingrad",
+           "boulevard Gambetta", "avenue Jeanne d'Arc", "rue Thiers", "cours Berriat")
+DEFAULT_MIX = "optimize=6,mtag=2,geocode=2"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers, env):
+    """Run the API with uvicorn in a child process and wait until it answers"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BASE_DIR, env=dict(os.environ, **env))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("The server did not start within 60 s")
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in ("optimize", "mtag", "geocode"):
+            raise ValueError(f"Unknown request kind: {kind}")
+        weights[kind] = float(weight or 1)
+    return weights
+
+
+def make_request(kind, rng, modes, addresses):
+    """(path, query parameters) of a random request of this kind"""
+    if kind == "optimize":
+        def point():
+            return (rng.uniform(GRENOBLE_BOUNDS["min_lat"], GRENOBLE_BOUNDS["max_lat"]),
+                    rng.uniform(GRENOBLE_BOUNDS["min_lng"], GRENOBLE_BOUNDS["max_lng"]))
+        (start_lat, start_lng), (end_lat, end_lng) = point(), point()
+        return "/api/optimize", {"start_lat": start_lat, "start_lng": start_lng, "end_lat": end_lat,
+                                 "end_lng": end_lng, "transport_mode": rng.choice(modes)}
+    if kind == "mtag":
+        return f"/api/mtag/{rng.choice(LINES)}", {}
+    return "/api/geocode", {"address": rng.choice(addresses)}
+
+
+def event_loop_lag(metrics_text):
+    """(sum, count, {bucket bound: cumulative count}) of the event loop lag histogram of a /metrics page"""
+    name = METRICS_PREFIX + "event_loop_lag_seconds"
+    total, count, buckets = 0.0, 0, {}
+    for line in metrics_text.splitlines():
+        if not line.startswith(name):
+            continue
+        key, value = line.rsplit(" ", 1)
+        if key == name + "_sum":
+            total = float(value)
+        elif key == name + "_count":
+            count = int(float(value))
+        else:
+            bound = re.search(r'le="([^"]+)"', key)
+            if bound:
+                buckets[float(bound.group(1))] = int(float(value))
+    return total, count, buckets
+
+
+def lag_summary(before, after, duration):
+    """Event loop blocking between two /metrics pages"""
+    total = after[0] - before[0]
+    count = after[1] - before[1]
+    summary = {"blocked_seconds": round(total, 3), "blocked_ratio": round(total / duration, 4),
+               "wakeups": count}
+    if count:
+        summary["mean_lag_ms"] = round(total / count * 1000, 3)
+        # Borne supérieure du seuil contenant le 99e centile
+        for bound in sorted(after[2]):
+            if after[2][bound] - before[2].get(bound, 0) >= 0.99 * count:
+                summary["p99_lag_ms_at_most"] = bound * 1000 if bound != float("inf") else None
+                break
+    return summary
+
+
+async def run_load(base_url, weights, args, addresses):
+    """Send requests from args.concurrency clients for args.duration seconds"""
+    timings = Timings()
+    statuses = {kind: {} for kind in weights}
+    kinds, kind_weights = list(weights), list(weights.values())
+    modes = [mode for mode in args.modes.split(",") if mode]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        metrics_before = event_loop_lag((await client.get("/metrics")).text)
+        start = time.perf_counter()
+        deadline = start + args.duration
+
+        async def user(seed):
+            rng = random.Random(seed)
+            while time.perf_counter() < deadline:
+                kind = rng.choices(kinds, kind_weights)[0]
+                path, params = make_request(kind, rng, modes, addresses)
+                try:
+                    with timings.measure(kind):
+                        response = await client.get(path, params=params)
+                    status = str(response.status_code)
+                except httpx.TimeoutException:
+                    status = "timeout"
+                except httpx.HTTPError:
+                    status = "connection_error"
+                statuses[kind][status] = statuses[kind].get(status, 0) + 1
+
+        await asyncio.gather(*(user(args.seed * 1000 + i) for i in range(args.concurrency)))
+        duration = time.perf_counter() - start
+        metrics_after = event_loop_lag((await client.get("/metrics")).text)
+
+    summary = timings.summary()
+    endpoints = {}
+    for kind in kinds:
+        stats = summary.get(kind, {"count": 0})
+        count = sum(statuses[kind].values())
+        endpoints[kind] = dict(stats, count=count, throughput_rps=round(count / duration, 2),
+                               statuses=statuses[kind])
+        endpoints[kind].pop("errors", None)
+    total = sum(endpoint["count"] for endpoint in endpoints.values())
+    return {
+        "duration_s": round(duration, 2),
+        "requests": total,
+        "throughput_rps": round(total / duration, 2),
+        "endpoints": endpoints,
+        "event_loop": lag_summary(metrics_before, metrics_after, duration)
+    }
+
+
+def warm_up(base_url, modes, timeout):
+    """Build the graphs of every mode before measuring"""
+    with httpx.Client(base_url=base_url, timeout=timeout) as client:
+        for mode in modes:
+            try:
+                client.get("/api/optimize", params={"start_lat": 45.1885, "start_lng": 5.7245, "end_lat": 45.1920,
+                                                    "end_lng": 5.7300, "transport_mode": mode})
+            except httpx.HTTPError as e:
+                print(f"Warm-up of {mode} failed: {e}", file=sys.stderr)
+
+
+def print_summary(result):
+    print(f"{result['requests']} requests in {result['duration_s']} s: {result['throughput_rps']} req/s",
+          file=sys.stderr)
+    for kind, stats in result["endpoints"].items():
+        latency = (f"p50 {stats['p50']:.1f}  p95 {stats['p95']:.1f}  p99 {stats['p99']:.1f}  max {stats['max']:.1f} ms"
+                   if "p50" in stats else "no answer")
+        print(f"  {kind:9s} {stats['throughput_rps']:8.2f} req/s   {latency}   {stats['statuses']}", file=sys.stderr)
+    loop = result["event_loop"]
+    print(f"  event loop blocked {loop['blocked_seconds']} s ({loop['blocked_ratio'] * 100:.1f} % of the time),"
+          f" mean lag {loop.get('mean_lag_ms', 0)} ms", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the API against local MTAG and Nominatim stubs")
+    parser.add_argument("--concurrency", type=int, default=16, help="simultaneous clients")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of optimize, mtag and geocode requests")
+    parser.add_argument("--modes", default=",".join(MODES), help="transport modes of /api/optimize requests")
+    parser.add_argument("--addresses", type=int, default=200,
+                        help="distinct addresses of /api/geocode requests (fewer means more cache hits)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--timeout", type=float, default=30, help="client timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="seconds before each stub answer")
+    parser.add_argument("--stub-jitter", type=float, default=0.05, help="random extra latency of the stubs")
+    parser.add_argument("--stub-error-rate", type=float, default=0.0, help="share of 503 answers of the stubs")
+    parser.add_argument("--stub-hang-rate", type=float, default=0.0,
+                        help="share of stub requests left without answer (client timeouts)")
+    parser.add_argument("--mtag-plan", action="append",
+                        help="recorded MTAG plan answer (default: tram_route.json, repeatable)")
+    parser.add_argument("--mtag-schedule", action="append", default=[],
+                        help="recorded /api/ficheHoraires/json answer (repeatable)")
+    parser.add_argument("--nominatim-response", action="append", default=[],
+                        help="recorded Nominatim search answer (repeatable)")
+    parser.add_argument("--no-warmup", action="store_true", help="do not build the graphs before measuring")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    addresses = [f"{rng.randint(1, 150)} {rng.choice(STREETS)}, Grenoble" for _ in range(args.addresses)]
+    faults = {"latency": args.stub_latency, "jitter": args.stub_jitter, "error_rate": args.stub_error_rate,
+              "hang_rate": args.stub_hang_rate, "seed": args.seed}
+    plans = args.mtag_plan or [os.path.join(BASE_DIR, "tram_route.json")]
+
+    with mtag_stub(plans, args.mtag_schedule, **faults) as mtag, \
+            nominatim_stub(GRENOBLE_BOUNDS, args.nominatim_response, **faults) as nominatim, \
+            tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        env = {
+            "MTAG_BASE_URL": mtag.url,
+            "NOMINATIM_URL": nominatim.url + "/search",
+            # Cache de géocodage vide et jetable pour ne pas toucher celui du serveur
+            "GEOCODE_CACHE_FILE": os.path.join(tmp, "geocode_cache.json"),
+            "VERBOSE_LOGS": "0"
+        }
+        server = start_server(port, args.workers, env)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            if not args.no_warmup:
+                warm_up(base_url, [mode for mode in args.modes.split(",") if mode], args.timeout)
+            result = asyncio.run(run_load(base_url, weights, args, addresses))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        result["stubs"] = {"mtag": mtag.stats(), "nominatim": nominatim.stats()}
+
+    result = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {"concurrency": args.concurrency, "duration": args.duration, "mix": weights,
+                   "modes": args.modes.split(","), "workers": args.workers, "stubs": faults},
+        **result
+    }
+    print_summary(result)
+    body = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(body + "\n")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
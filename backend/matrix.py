@@ -0,0 +1,120 @@
+import asyncio
+import json
+import os
+
+from distance import distances_from
+from routing_graph import SPEEDS_KMH, graph_registry
+from routing_pool import routing_pool
+
+# Taille maximale d'une matrice (origines x destinations)
+MATRIX_MAX_PAIRS = int(os.environ.get("MATRIX_MAX_PAIRS", 250000))
+# Nombre d'origines confiées à un processus à la fois
+ORIGINS_PER_TASK = 8
+# Noeuds candidats autour de chaque point (comme /api/optimize)
+SNAP_CANDIDATES = 20
+
+
+def _snap(routing_graph, csr, points):
+    """For each (lat, lng), dict CSR node id -> distance from the point to that node"""
+    snapped = []
+    for lat, lng in points:
+        candidates, _ = routing_graph.snap_candidates(lat, lng, k=SNAP_CANDIDATES)
+        offsets = distances_from(candidates, lat, lng).tolist()
+        snapped.append({csr.position[node]: offset for node, offset in zip(candidates, offsets)})
+    return snapped
+
+
+def matrix_rows(transport_mode, origins, destinations):
+    """
+    Network distances (km) and costs from each origin to each destination
+
+    One one-to-many Dijkstra per origin on the compact graph of the mode, starting from
+    the candidate nodes around the origin and stopping once the candidate nodes of
+    every destination are settled. Runs in a worker of the routing pool, which brings
+    the graph up to date with the edge updates of the server first. The cost is the one
+    the search minimised (a slowed down road counts more than its length, as for the
+    durations of /api/optimize), the distance is the ground length of that path.
+
+    Returns:
+        list of rows of (distance, cost), None where a destination cannot be reached
+    """
+    routing_graph = graph_registry.get(transport_mode)
+    csr = routing_graph.csr_graph()
+    targets = _snap(routing_graph, csr, destinations)
+    all_targets = set().union(*targets)
+
+    rows = []
+    for sources in _snap(routing_graph, csr, origins):
+        dist, lengths = csr.distances(sources, targets=all_targets, lengths=True)
+        row = []
+        for target in targets:
+            best = min(((dist[node] + offset, node, offset) for node, offset in target.items() if node in dist),
+                       default=None)
+            row.append((lengths[best[1]] + best[2], best[0]) if best is not None else None)
+        rows.append(row)
+    return rows
+
+
+def _format_row(transport_mode, row):
+    speed = SPEEDS_KMH.get(transport_mode, 5)
+    distances = [round(pair[0], 3) if pair is not None else None for pair in row]
+    durations = [round(pair[1] / speed * 3600) if pair is not None else None for pair in row]
+    return distances, durations
+
+
+async def _batches(transport_mode, origins, destinations, request=None):
+    """
+    (first origin index, rows) of each batch of ORIGINS_PER_TASK origins, as they complete
+
+    The batches go through the routing pool, so they share its admission limit, timeout
+    and disconnect handling with the other routing requests (PoolSaturated, RoutingTimeout
+    and ClientDisconnected are raised as is). At most one batch per worker is pending at
+    a time, so a large matrix keeps every worker busy without filling the whole queue.
+    """
+    batches = [(i, origins[i:i + ORIGINS_PER_TASK]) for i in range(0, len(origins), ORIGINS_PER_TASK)]
+    in_flight = max(1, routing_pool.workers)
+
+    async def task(first, batch):
+        return first, await routing_pool.run(matrix_rows, transport_mode, batch, destinations, request=request)
+
+    pending = set()
+    try:
+        while batches or pending:
+            while batches and len(pending) < in_flight:
+                pending.add(asyncio.ensure_future(task(*batches.pop(0))))
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                yield finished.result()
+    finally:
+        # Erreur ou client parti : ne pas finir les lots restants
+        for unfinished in pending:
+            unfinished.cancel()
+
+
+async def compute_matrix(transport_mode, origins, destinations, request=None):
+    """Distance (km) and duration (s) matrices, rows in the order of the origins"""
+    results = [result async for result in _batches(transport_mode, origins, destinations, request)]
+
+    distances, durations = [], []
+    for _, rows in sorted(results, key=lambda result: result[0]):
+        for row in rows:
+            row_distances, row_durations = _format_row(transport_mode, row)
+            distances.append(row_distances)
+            durations.append(row_durations)
+    return {"transport_mode": transport_mode, "distances": distances, "durations": durations}
+
+
+async def stream_matrix(transport_mode, origins, destinations):
+    """NDJSON lines {"origin", "distances", "durations"}, sent as soon as each row is computed"""
+    # La réponse en streaming surveille elle-même la déconnexion du client et annule ce générateur
+    batches = _batches(transport_mode, origins, destinations)
+    try:
+        async for first, rows in batches:
+            lines = []
+            for i, row in enumerate(rows):
+                row_distances, row_durations = _format_row(transport_mode, row)
+                lines.append(json.dumps({"origin": first + i, "distances": row_distances,
+                                         "durations": row_durations}, separators=(",", ":")))
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+    finally:
+        await batches.aclose()
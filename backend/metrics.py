@@ -0,0 +1,245 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import math
+import os
+import sys
+import threading
+import time
+
+# Les messages de suivi des requêtes (log) peuvent être coupés en production : VERBOSE_LOGS=0
+VERBOSE_LOGS = os.environ.get("VERBOSE_LOGS", "1").lower() not in ("0", "false", "no", "off")
+
+# Bornes (secondes) des histogrammes de durée
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Période de mesure du retard de la boucle d'événements (0 pour ne pas la mesurer)
+EVENT_LOOP_MONITOR_INTERVAL = float(os.environ.get("EVENT_LOOP_MONITOR_INTERVAL", 0.05))
+
+
+def log(*args):
+    """print() for request tracing messages, silenced by VERBOSE_LOGS=0"""
+    if VERBOSE_LOGS:
+        print(*args)
+
+
+def log_error(*args):
+    """print() to stderr for unexpected errors, kept with VERBOSE_LOGS=0"""
+    print(*args, file=sys.stderr)
+
+
+def _format_labels(pairs):
+    """{name="value",...} from (name, value) pairs, values escaped"""
+    pairs = list(pairs)
+    if not pairs:
+        return ""
+    return "{" + ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, one value per combination of label values"""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(str(labels[name]) for name in self.labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(zip(self.labels, key)), value) for key, value in values]
+
+
+class Histogram:
+    """Distribution of durations (seconds) in cumulative buckets, per combination of label values"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Un compteur par borne (+ le dépassement), puis la somme
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts)) for key, counts in self._values.items())
+        samples = []
+        for key, counts in values:
+            cumulative = 0
+            labels = list(zip(self.labels, key))
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((self.name + "_bucket", _format_labels(labels + [("le", _format_value(bound))]),
+                                cumulative))
+            samples.append((self.name + "_sum", _format_labels(labels), counts[-1]))
+            samples.append((self.name + "_count", _format_labels(labels), cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms of the backend, rendered in the Prometheus text format
+
+    Collectors are called at each scrape to export values kept elsewhere (cache
+    statistics for instance) without counting them twice. A collector returns a list of
+    (name, type, help, [(labels dict, value), ...]).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, metric_type, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(labels.items())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+METRICS_PREFIX = "grenoble_transport_"
+
+request_duration = registry.histogram(
+    METRICS_PREFIX + "request_duration_seconds", "Time to answer an HTTP request", ("method", "route", "status"))
+stage_duration = registry.histogram(
+    METRICS_PREFIX + "stage_duration_seconds", "Time spent in each stage of a request", ("stage",))
+fallbacks = registry.counter(
+    METRICS_PREFIX + "fallbacks_total", "Answers given by a fallback after the preferred source failed",
+    ("source", "fallback"))
+mtag_requests = registry.counter(
+    METRICS_PREFIX + "mtag_requests_total", "HTTP requests sent to the MTAG API, by outcome", ("outcome",))
+nominatim_requests = registry.counter(
+    METRICS_PREFIX + "nominatim_requests_total", "Searches sent to Nominatim, by outcome", ("outcome",))
+event_loop_lag = registry.histogram(
+    METRICS_PREFIX + "event_loop_lag_seconds",
+    "Delay of the wake-ups of the event loop monitor: time during which the loop was blocked")
+
+# Étapes de la requête en cours (None hors d'une requête)
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextlib.contextmanager
+def span(stage):
+    """
+    Time a stage of the current request
+
+    The duration goes to the stage_duration_seconds histogram and to the trace of the
+    request (Server-Timing header). Threads started with asyncio.to_thread inherit
+    the trace of their request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_duration.observe(duration, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, duration))
+
+
+def start_trace():
+    """Start collecting the spans of a request: returns (spans list, token for end_trace)"""
+    trace = []
+    return trace, _trace.set(trace)
+
+
+def end_trace(token):
+    _trace.reset(token)
+
+
+def record_spans(trace):
+    """Add the stages timed in another process (a routing worker) to the metrics and the current request"""
+    current = _trace.get()
+    for stage, duration in trace:
+        stage_duration.observe(duration, stage=stage)
+        if current is not None:
+            current.append((stage, duration))
+
+
+def server_timing(trace, total):
+    """Server-Timing header value (durations in ms), repeated stages added up"""
+    durations = {}
+    for stage, duration in trace:
+        durations[stage] = durations.get(stage, 0.0) + duration
+    entries = [f"{stage};dur={duration * 1000:.2f}" for stage, duration in durations.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries)
+
+
+async def monitor_event_loop(interval=None):
+    """
+    Measure how late the event loop wakes up a task sleeping for interval seconds
+
+    The delay is time during which synchronous code (a long path search for instance)
+    kept the loop from serving other requests; it goes to event_loop_lag_seconds.
+    """
+    interval = interval or EVENT_LOOP_MONITOR_INTERVAL
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - start - interval))
@@ -1,98 +1,218 @@
-import requests
-import json
-import time
+import asyncio
+import os
+import random
 from datetime import datetime
 
-def calculate_tram_route(start_coords, end_coords, max_retries=3):
+import httpx
+
+from cache import AsyncLoadingCache
+from metrics import log, log_error, mtag_requests
+
+MTAG_BASE_URL = os.environ.get("MTAG_BASE_URL", "https://data.mobilites-m.fr")
+
+# Cache des fiches horaires : durée de validité, taille maximale et durée pendant
+# laquelle une fiche périmée peut encore être servie si MTAG est lent ou indisponible
+MTAG_SCHEDULE_TTL = float(os.environ.get("MTAG_SCHEDULE_TTL", 60))
+MTAG_SCHEDULE_CACHE_SIZE = int(os.environ.get("MTAG_SCHEDULE_CACHE_SIZE", 128))
+MTAG_SCHEDULE_STALE_TTL = float(os.environ.get("MTAG_SCHEDULE_STALE_TTL", 3600))
+
+
+class MTAGError(Exception):
+    """Raised when the MTAG API cannot answer a request"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MTAGClient:
+    """
+    Asynchronous client for the MTAG API
+
+    All calls share one pooled keep-alive HTTP session. Transient failures (timeouts,
+    5xx) are retried with exponential backoff using asyncio.sleep so the event loop is
+    never blocked, the number of requests in flight towards MTAG is limited and every
+    call has an overall deadline, time spent waiting for a free slot included.
+    """
+
+    def __init__(self, base_url=None, max_retries=3, timeout=10.0, deadline=30.0,
+                 backoff=0.5, max_concurrency=10, transport=None):
+        self.base_url = base_url or MTAG_BASE_URL
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._client = None
+        self._loop = None
+        self._semaphore = None
+
+    def _session(self):
+        # Le client HTTP et le sémaphore sont liés à la boucle d'événements courante
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                transport=self._transport
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._client, self._semaphore
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    @staticmethod
+    async def _limited_get(client, semaphore, path, params):
+        async with semaphore:
+            return await client.get(path, params=params)
+
+    async def get_json(self, path, params=None, deadline=None, max_retries=None):
+        """
+        GET a JSON document from the MTAG API
+
+        Args:
+            path: URL path relative to the base URL
+            params: query parameters
+            deadline: maximum time in seconds for the whole call, retries included
+            max_retries: maximum number of attempts (defaults to the client setting)
+
+        Raises:
+            MTAGError if MTAG answers with an error or does not answer before the deadline
+        """
+        deadline = deadline or self.deadline
+        max_retries = max_retries or self.max_retries
+        loop = asyncio.get_running_loop()
+        end = loop.time() + deadline
+        client, semaphore = self._session()
+        last_error = None
+        attempts = 0
+
+        for attempt in range(max_retries):
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            attempts += 1
+            try:
+                # L'attente d'une place libre compte dans l'échéance, comme la requête elle-même
+                response = await asyncio.wait_for(self._limited_get(client, semaphore, path, params),
+                                                  timeout=remaining)
+            except (asyncio.TimeoutError, httpx.TimeoutException):
+                mtag_requests.inc(outcome="timeout")
+                last_error = MTAGError("MTAG API request timed out")
+            except httpx.TransportError as e:
+                mtag_requests.inc(outcome="connection_error")
+                raise MTAGError(f"Connection error - failed to connect to the MTAG API: {e}") from e
+            else:
+                if response.status_code < 500:
+                    if response.status_code != 200:
+                        mtag_requests.inc(outcome="client_error")
+                        raise MTAGError(f"MTAG API returned status code {response.status_code}",
+                                        response.status_code)
+                    mtag_requests.inc(outcome="ok")
+                    return response.json()
+                mtag_requests.inc(outcome="server_error")
+                last_error = MTAGError(f"MTAG API returned status code {response.status_code}",
+                                       response.status_code)
+
+            if attempt < max_retries - 1:
+                log(f"{last_error}, retrying... (attempt {attempt+1}/{max_retries})")
+                # Attente exponentielle avec un peu d'aléa, sans dépasser l'échéance
+                delay = self.backoff * (2 ** attempt) * (1 + random.random() * 0.1)
+                await asyncio.sleep(max(0, min(delay, end - loop.time())))
+
+        if last_error is None:
+            last_error = MTAGError("MTAG API request timed out")
+        raise MTAGError(f"{last_error} after {attempts} attempts", last_error.status_code)
+
+    async def plan(self, start_coords, end_coords, deadline=None, max_retries=None):
+        """Query the OpenTripPlanner router of MTAG and return its raw JSON answer"""
+        now = datetime.now()
+        params = {
+            "fromPlace": f"{start_coords[0]},{start_coords[1]}",
+            "toPlace": f"{end_coords[0]},{end_coords[1]}",
+            "date": now.strftime("%Y-%m-%d"),
+            "time": now.strftime("%H:%M:%S"),
+            "mode": "TRAM,BUS",  # Include all public transport modes
+            "maxWalkDistance": 200,
+            "numItineraries": 3
+        }
+        log(f"Requesting transit route with params: {params}")
+        return await self.get_json("/api/routers/default/plan", params=params, deadline=deadline,
+                                   max_retries=max_retries)
+
+    async def fiche_horaires(self, route_name, deadline=None):
+        """Schedule of a line (ficheHoraires), e.g. route_name="A" for tram A"""
+        return await self.get_json("/api/ficheHoraires/json", params={"route": f"SEM:{route_name}"},
+                                   deadline=deadline)
+
+
+mtag_client = MTAGClient()
+
+schedule_cache = AsyncLoadingCache(
+    lambda route_name: mtag_client.fiche_horaires(route_name),
+    ttl=MTAG_SCHEDULE_TTL,
+    max_size=MTAG_SCHEDULE_CACHE_SIZE,
+    stale_ttl=MTAG_SCHEDULE_STALE_TTL
+)
+
+
+async def calculate_tram_route(start_coords, end_coords, max_retries=None, client=None):
     """
     Calculate a public transit route using the MTAG OpenTripPlanner API
-    
+
     Args:
         start_coords: tuple of (lat, lng) for start point
         end_coords: tuple of (lat, lng) for end point
         max_retries: maximum number of retry attempts for transient errors
-        
+            (defaults to the client setting)
+        client: MTAGClient to use (defaults to the shared one)
+
     Returns:
-        dict with route information or None if no route found
+        dict with route information or {"error": ...} if no route found
     """
-    for attempt in range(max_retries):
-        try:
-            # Correct MTAG OpenTripPlanner API endpoint
-            url = "https://data.mobilites-m.fr/api/routers/default/plan"
-            
-            # Format the request parameters with correct modes for public transport
-            params = {
-                "fromPlace": f"{start_coords[0]},{start_coords[1]}",
-                "toPlace": f"{end_coords[0]},{end_coords[1]}",
-                "date": datetime.now().strftime("%Y-%m-%d"),
-                "time": datetime.now().strftime("%H:%M:%S"),
-                "mode": "TRAM,BUS",  # Include all public transport modes
-                "maxWalkDistance": 200,  # Increased to 2km for better routes
-                "numItineraries": 3
-            }
-            print(f"Requesting transit route with params: {params}")
-            
-            # Make the request with a longer timeout
-            response = requests.get(url, params=params, timeout=30)
-            
-            print(f"MTAG API response status: {response.status_code}")
-            
-            # If we get a server error, retry
-            if response.status_code >= 500:
-                if attempt < max_retries - 1:
-                    print(f"Server error (status {response.status_code}), retrying... (attempt {attempt+1}/{max_retries})")
-                    time.sleep(2)  # Wait before retrying
-                    continue
-                else:
-                    return {"error": f"MTAG API returned status code {response.status_code} after {max_retries} attempts"}
-            
-            if response.status_code != 200:
-                return {"error": f"MTAG API returned status code {response.status_code}"}
-            
-            data = response.json()
-            
-            # Debug information
-            if "plan" in data and "itineraries" in data["plan"]:
-                print(f"Found {len(data['plan']['itineraries'])} itineraries")
-            else:
-                print("No itineraries found in MTAG API response")
-                print(f"Response keys: {data.keys()}")
-            
-            # Check if we have any itineraries
-            if "plan" not in data or "itineraries" not in data["plan"] or len(data["plan"]["itineraries"]) == 0:
-                return {"error": "No transit routes found by MTAG API"}
-            
-            itineraries = data.get("plan", {}).get("itineraries", [])
-            best_itinerary = min(itineraries, key=lambda x: x.get("duration", float('inf')))
-            # Return the first itinerary (usually the most optimal)
-            print(best_itinerary)
-            return best_itinerary
-            
-        except requests.exceptions.Timeout:
-            if attempt < max_retries - 1:
-                print(f"Request timeout, retrying... (attempt {attempt+1}/{max_retries})")
-                time.sleep(2)  # Wait before retrying
-            else:
-                return {"error": "MTAG API request timed out after multiple attempts"}
-        except requests.exceptions.ConnectionError:
-            return {"error": "Connection error - failed to connect to the MTAG API"}
-        except Exception as e:
-            print(f"Error calculating transit route: {e}")
-            return {"error": str(e)}
-    
-    return {"error": "Maximum retry attempts reached"}
+    client = client or mtag_client
+
+    try:
+        data = await client.plan(start_coords, end_coords, max_retries=max_retries)
+    except MTAGError as e:
+        return {"error": str(e)}
+    except Exception as e:
+        log_error(f"Error calculating transit route: {e}")
+        return {"error": str(e)}
+
+    # Debug information
+    if "plan" in data and "itineraries" in data["plan"]:
+        log(f"Found {len(data['plan']['itineraries'])} itineraries")
+    else:
+        log("No itineraries found in MTAG API response")
+        log(f"Response keys: {data.keys()}")
+
+    # Check if we have any itineraries
+    if "plan" not in data or "itineraries" not in data["plan"] or len(data["plan"]["itineraries"]) == 0:
+        return {"error": "No transit routes found by MTAG API"}
+
+    itineraries = data.get("plan", {}).get("itineraries", [])
+    best_itinerary = min(itineraries, key=lambda x: x.get("duration", float('inf')))
+    return best_itinerary
 
 
 # if __name__ == "__main__":
 #     # Test the function with sample coordinates in Grenoble
 #     start = (45.188529, 5.724524)  # Grenoble center
 #     end = (45.191676, 5.730119)   # Example destination
-    
-#     result = calculate_tram_route(start, end)
-    
+
+#     result = asyncio.run(calculate_tram_route(start, end))
+
 #     if "error" in result:
 #         print(f"Error: {result['error']}")
 #     else:
 #         print(f"Found route with duration: {result.get('duration')} seconds")
 #         print(f"Number of legs: {len(result.get('legs', []))}")
-
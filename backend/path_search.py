@@ -0,0 +1,83 @@
+import heapq
+from itertools import count
+
+import networkx as nx
+
+
+def component_labels(graph):
+    """
+    Label every node with the id of its connected component
+
+    Strongly connected components are used for directed graphs (driving), so that two
+    nodes sharing a label are always reachable from one another.
+    """
+    if graph.is_directed():
+        components = nx.strongly_connected_components(graph)
+    else:
+        components = nx.connected_components(graph)
+
+    labels = {}
+    for component_id, nodes in enumerate(components):
+        for node in nodes:
+            labels[node] = component_id
+    return labels
+
+
+def multi_source_dijkstra(graph, sources, targets, weight="weight"):
+    """
+    Single Dijkstra search from several sources to the closest of several targets
+
+    Args:
+        graph: networkx graph
+        sources: dict node -> initial cost (e.g. the distance from the real start point)
+        targets: dict node -> final cost (e.g. the distance to the real end point)
+        weight: edge attribute holding the edge cost
+
+    Returns:
+        tuple (path, cost) minimizing initial cost + path cost + final cost,
+        or (None, inf) if no target can be reached
+    """
+    adjacency = graph.adj
+    dist = {}
+    pred = {}
+    seen = {}
+    heap = []
+    tie = count()
+
+    for node, cost in sources.items():
+        if node in adjacency and cost < seen.get(node, float("inf")):
+            seen[node] = cost
+            pred[node] = None
+            heapq.heappush(heap, (cost, next(tie), node))
+
+    best_cost = float("inf")
+    best_target = None
+
+    while heap:
+        d, _, node = heapq.heappop(heap)
+        if node in dist:
+            continue
+        # Plus aucun chemin ne peut améliorer la meilleure arrivée trouvée
+        if d >= best_cost:
+            break
+        dist[node] = d
+
+        if node in targets and d + targets[node] < best_cost:
+            best_cost = d + targets[node]
+            best_target = node
+
+        for neighbor, attributes in adjacency[node].items():
+            new_cost = d + attributes.get(weight, 1)
+            if neighbor not in dist and new_cost < seen.get(neighbor, float("inf")):
+                seen[neighbor] = new_cost
+                pred[neighbor] = node
+                heapq.heappush(heap, (new_cost, next(tie), neighbor))
+
+    if best_target is None:
+        return None, float("inf")
+
+    path = [best_target]
+    while pred[path[-1]] is not None:
+        path.append(pred[path[-1]])
+    path.reverse()
+    return path, best_cost
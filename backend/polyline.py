@@ -0,0 +1,175 @@
+import math
+
+import numpy as np
+
+from distance import EARTH_RADIUS_KM
+
+# Formats de géométrie acceptés par /api/optimize
+GEOMETRY_FORMATS = ("points", "polyline", "flat")
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Largeur d'un pixel au zoom 0 à l'équateur (tuiles Web Mercator de 256 pixels)
+KM_PER_PIXEL_ZOOM_0 = 2 * math.pi * 6378.137 / 256
+# Changement de direction à partir duquel un point est un virage à conserver
+TURN_ANGLE_DEG = 45
+
+# Une différence de coordonnées tient sur 7 groupes de 5 bits jusqu'à la précision 1e-6
+_MAX_CHUNKS = 7
+
+
+def decode(polyline, precision=5):
+    """
+    Decode a Google encoded polyline (as used by OTP legGeometry)
+
+    The characters are processed as a NumPy byte array: the end of each value is found
+    from its last 5-bit chunk, the chunks are summed per value with reduceat and the
+    coordinates are rebuilt with a cumulative sum.
+
+    Returns:
+        (N, 2) float64 array of [lat, lng] points
+    """
+    data = np.frombuffer(polyline.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    if len(data) == 0:
+        return np.empty((0, 2))
+    if data.min() < 0 or data[-1] & 0x20:
+        raise ValueError("Invalid encoded polyline")
+
+    last = (data & 0x20) == 0
+    ends = np.flatnonzero(last)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Rang de chaque groupe de 5 bits dans sa valeur
+    rank = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    if rank.max() >= _MAX_CHUNKS:
+        raise ValueError("Invalid encoded polyline")
+    values = np.add.reduceat((data & 0x1f) << (5 * rank), starts)
+    if len(values) % 2:
+        raise ValueError("Invalid encoded polyline: odd number of values")
+
+    deltas = (values >> 1) ^ -(values & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def encode(coords, precision=5):
+    """
+    Encode [lat, lng] points as a Google polyline (inverse of decode)
+
+    Args:
+        coords: (N, 2) array-like of [lat, lng]
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) == 0:
+        return ""
+    rounded = np.round(coords * 10 ** precision).astype(np.int64)
+    deltas = np.diff(rounded, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    values = (deltas << 1) ^ (deltas >> 63)
+
+    shifted = values[:, None] >> (5 * np.arange(_MAX_CHUNKS))
+    chunks = shifted & 0x1f
+    # Nombre de groupes utiles : au moins un, puis un par tranche de 5 bits significatifs
+    lengths = np.maximum(1, (shifted != 0).sum(axis=1))
+    used = np.arange(_MAX_CHUNKS) < lengths[:, None]
+    more = np.arange(_MAX_CHUNKS) < (lengths - 1)[:, None]
+    characters = (chunks | (more * 0x20)) + 63
+    return characters[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def join(parts):
+    """
+    Concatenate (N, 2) arrays of points end to end
+
+    The first point of a part is dropped when it repeats the last point of the previous
+    one (the stop ending a walk and starting a ride, for instance).
+    """
+    parts = [np.asarray(part, dtype=np.float64).reshape(-1, 2) for part in parts]
+    joined = []
+    last = None
+    for part in parts:
+        if len(part) and last is not None and (part[0] == last).all():
+            part = part[1:]
+        if len(part):
+            joined.append(part)
+            last = part[-1]
+    return np.concatenate(joined) if joined else np.empty((0, 2))
+
+
+def format_points(coords, geometry="points"):
+    """
+    Geometry of an /api/optimize answer from an (N, 2) array of [lat, lng] points
+
+    "points" gives the usual list of {"lat", "lng"} objects, "polyline" an encoded polyline
+    string and "flat" a flat [lat0, lng0, lat1, lng1, ...] list.
+    """
+    if geometry == "polyline":
+        return encode(coords)
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if geometry == "flat":
+        return coords.ravel().tolist()
+    return [{"lat": lat, "lng": lng} for lat, lng in coords.tolist()]
+
+
+def zoom_tolerance(zoom, lat):
+    """Half the size of a map pixel (km) at this zoom level and latitude"""
+    return KM_PER_PIXEL_ZOOM_0 * math.cos(math.radians(lat)) / 2 ** zoom / 2
+
+
+def turn_points(coords, angle=TURN_ANGLE_DEG):
+    """Boolean mask of the points of an (N, 2) [lat, lng] array where the direction changes by more than angle"""
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    mask = np.zeros(len(coords), dtype=bool)
+    if len(coords) < 3:
+        return mask
+    vectors = np.diff(coords, axis=0) * [1.0, math.cos(math.radians(float(coords[:, 0].mean())))]
+    headings = np.degrees(np.arctan2(vectors[:, 1], vectors[:, 0]))
+    change = np.abs((headings[1:] - headings[:-1] + 180) % 360 - 180)
+    # Les points confondus (segment de longueur nulle) n'ont pas de direction
+    moving = (vectors != 0).any(axis=1)
+    mask[1:-1] = (change > angle) & moving[1:] & moving[:-1]
+    return mask
+
+
+def simplify_indices(coords, tolerance, keep=None):
+    """
+    Douglas-Peucker simplification of an (N, 2) array of [lat, lng] points
+
+    The points are projected on a local plane in km, then each range between two kept
+    points is split at its farthest point while that point is more than tolerance km
+    away from the chord (distances of a whole range computed at once with NumPy).
+
+    Args:
+        tolerance: largest distance (km) between the route and its simplified line
+        keep: optional boolean mask of points that must stay (turns, street changes);
+            they split the route into ranges simplified independently
+
+    Returns:
+        sorted indices of the kept points (first and last always included)
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = len(coords)
+    if n < 3 or tolerance <= 0:
+        return np.arange(n)
+    xy = coords[:, ::-1] * KM_PER_DEGREE
+    xy[:, 0] *= math.cos(math.radians(float(coords[:, 0].mean())))
+
+    kept = np.zeros(n, dtype=bool) if keep is None else np.array(keep, dtype=bool)
+    kept[[0, -1]] = True
+    anchors = np.flatnonzero(kept)
+    stack = list(zip(anchors[:-1].tolist(), anchors[1:].tolist()))
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = xy[first], xy[last]
+        chord = end - start
+        length = chord @ chord
+        points = xy[first + 1:last] - start
+        # Distance au segment (et non à la droite) pour les allers-retours
+        t = np.clip(points @ chord / length, 0, 1) if length > 0 else np.zeros(len(points))
+        gaps = points - t[:, None] * chord
+        distances = np.einsum("ij,ij->i", gaps, gaps)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance ** 2:
+            middle = first + 1 + farthest
+            kept[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return np.flatnonzero(kept)
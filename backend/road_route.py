@@ -0,0 +1,184 @@
+import json
+
+import numpy as np
+
+import metrics
+import polyline
+from distance import distances_from, path_length
+from metrics import log, span
+from route_cache import route_cache
+from routing_graph import SPEEDS_KMH, graph_registry
+from transit_router import transit_router
+
+
+def road_route(transport_mode, start_lat, start_lng, end_lat, end_lng, snap="node", engine="dijkstra",
+               geometry="points", tolerance=None):
+    """
+    Route on the road graph of a mode, as the encoded JSON answer of /api/optimize
+
+    Runs in a routing worker (see routing_pool.py) or in a thread of the server: it only
+    uses the graphs, the path cache and the metrics of its own process.
+
+    Raises:
+        LookupError: the graph of the mode has no node
+    """
+    # The graph is built once per mode and shared across requests
+    with span("graph"):
+        routing_graph = graph_registry.get(transport_mode)
+    G = routing_graph.graph
+
+    log(f"Using graph with {len(G.nodes())} nodes and {len(G.edges())} edges")
+
+    # APPROCHE SIMPLIFIÉE: chercher directement les noeuds les plus proches dans le graphe
+    # sans passer par la recherche des routes les plus proches
+
+    # Récupérer tous les noeuds du graphe
+    all_nodes = routing_graph.nodes
+
+    if not all_nodes:
+        raise LookupError("Road network graph is empty")
+
+    # Trouver les noeuds les plus proches pour le départ et l'arrivée
+    # Au lieu de prendre simplement le plus proche, on prend les 20 plus proches
+    # et on essaie de trouver une paire qui soit connectée dans le graphe
+    with span("snap"):
+        start_candidates, start_snap = routing_graph.snap_candidates(start_lat, start_lng, k=20, snap=snap)
+        end_candidates, end_snap = routing_graph.snap_candidates(end_lat, end_lng, k=20, snap=snap)
+
+        # Distance entre le point réel (ou projeté sur la route) et chaque candidat
+        start_ref = start_snap or {"lat": start_lat, "lng": start_lng, "distance": 0}
+        end_ref = end_snap or {"lat": end_lat, "lng": end_lng, "distance": 0}
+        start_offsets = dict(zip(start_candidates, (start_ref["distance"] + distances_from(
+            start_candidates, start_ref["lat"], start_ref["lng"])).tolist()))
+        end_offsets = dict(zip(end_candidates, (end_ref["distance"] + distances_from(
+            end_candidates, end_ref["lat"], end_ref["lng"])).tolist()))
+
+    log(f"Found {len(start_candidates)} start candidates and {len(end_candidates)} end candidates")
+
+    # Une seule recherche multi-sources / multi-cibles au lieu de tester chaque paire,
+    # sauf si un chemin a déjà été calculé entre les mêmes noeuds les plus proches
+    cache_key = (transport_mode, start_candidates[0], end_candidates[0], snap)
+    path = route_cache.get_path(cache_key)
+    if path is None:
+        with span("path"):
+            path, _ = routing_graph.find_path(start_offsets, end_offsets, engine=engine)
+        route_cache.set_path(cache_key, path)
+    direct = not path
+    if path:
+        closest_start_node, closest_end_node = path[0], path[-1]
+        log(f"Found valid path from {closest_start_node} to {closest_end_node} with {len(path)} nodes")
+    else:
+        # Par défaut, on prend les plus proches et on crée un itinéraire direct
+        closest_start_node = start_candidates[0]
+        closest_end_node = end_candidates[0]
+        log("No path found between candidates, creating direct route")
+        path = [closest_start_node, closest_end_node]
+
+    # Calculer les distances (en passant par le point projeté sur la route si snap="edge")
+    # (un chemin venant du cache peut partir d'un noeud qui n'est pas parmi les candidats)
+    start_distance = start_offsets.get(closest_start_node)
+    if start_distance is None:
+        start_distance = start_ref["distance"] + float(distances_from(
+            [closest_start_node], start_ref["lat"], start_ref["lng"])[0])
+    end_distance = end_offsets.get(closest_end_node)
+    if end_distance is None:
+        end_distance = end_ref["distance"] + float(distances_from(
+            [closest_end_node], end_ref["lat"], end_ref["lng"])[0])
+
+    log(f"Selected start node: {closest_start_node}, distance: {start_distance:.4f}km")
+    log(f"Selected end node: {closest_end_node}, distance: {end_distance:.4f}km")
+
+    # Log information about the start and end nodes for debugging
+    if transport_mode == "driving" and metrics.VERBOSE_LOGS:
+        log(f"Checking start node {closest_start_node} connections:")
+        log(f"- Outgoing edges: {len(list(G.out_edges(closest_start_node)))}")
+        log(f"- Incoming edges: {len(list(G.in_edges(closest_start_node)))}")
+
+        log(f"Checking end node {closest_end_node} connections:")
+        log(f"- Outgoing edges: {len(list(G.out_edges(closest_end_node)))}")
+        log(f"- Incoming edges: {len(list(G.in_edges(closest_end_node)))}")
+
+    # Convertir le chemin en coordonnées pour l'affichage : un tableau (N, 2) de [lat, lng],
+    # converti une seule fois au format demandé
+    head = [(start_lat, start_lng)]  # Point de départ réel
+
+    # Ajouter le point le plus proche sur le réseau routier
+    if start_snap:
+        head.append((start_snap["lat"], start_snap["lng"]))
+    head.append((closest_start_node[1], closest_start_node[0]))
+
+    # Trouver le nom de la rue et la destination pour chaque point (index précalculé)
+    street_info = []
+    with span("names"):
+        for point in path:
+            street = routing_graph.street_at(point)
+            street_name = street["name"] or "rue non identifiée"
+            destination = street["destination"] if transport_mode == "driving" else None
+
+            # Stocker les informations de rue pour chaque segment
+            street_info.append({
+                "name": street_name,
+                "destination": destination
+            })
+
+    # Ajouter le point le plus proche du point d'arrivée
+    tail = [(closest_end_node[1], closest_end_node[0])]
+
+    # Ajouter le point d'arrivée réel
+    if end_snap:
+        tail.append((end_snap["lat"], end_snap["lng"]))
+    tail.append((end_lat, end_lng))
+
+    # Points du chemin (les noeuds sont des tuples (lng, lat))
+    path_points = np.array(path, dtype=np.float64).reshape(-1, 2)[:, ::-1]
+    if tolerance:
+        # Garder les changements de rue (ou de direction indiquée) et les virages,
+        # pour que streetNames reste aligné avec les points gardés
+        with span("simplify"):
+            names = [(info["name"], info["destination"]) for info in street_info]
+            keep = polyline.turn_points(path_points)
+            keep[1:] |= [names[i] != names[i - 1] for i in range(1, len(names))]
+            kept = polyline.simplify_indices(path_points, tolerance, keep)
+            path_points = path_points[kept]
+            street_info = [street_info[i] for i in kept.tolist()]
+    middle = path_points[1:-1]
+    route_points = np.concatenate([np.array(head), middle, np.array(tail)])
+
+    # Distance du point de départ réel au noeud le plus proche, puis le long du chemin (un
+    # itinéraire direct est mesuré à vol d'oiseau, donc un seul calcul vectorisé suffit),
+    # enfin du dernier noeud à l'arrivée
+    length = path_length(path)
+    distance = start_distance + length + end_distance
+
+    # Calculer la durée en fonction du mode de transport, sur le coût du chemin que la
+    # recherche a minimisé : une route ralentie (facteur) compte plus que sa longueur
+    cost = length if direct else routing_graph.path_cost(path)
+    speed = SPEEDS_KMH.get(transport_mode, 5)
+    duration = ((start_distance + cost + end_distance) / speed) * 60 * 60  # Durée en secondes
+
+    # Encodé ici (comme JSONResponse) : seuls des octets repassent au serveur
+    with span("encode"):
+        return json.dumps({
+            "route": polyline.format_points(route_points, geometry),
+            "distance": round(distance, 2),
+            "duration": round(duration),
+            "transport_mode": transport_mode,
+            "streetNames": [info["name"] for info in street_info],
+            "streetDestinations": [info["destination"] for info in street_info if info["destination"]]
+        }, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def local_transit_plan(start, end):
+    """Itinerary of the local transit router (MTAG format), None if walking is faster"""
+    return transit_router.get().plan(start, end)
+
+
+def transit_cache_key(start_lat, start_lng, end_lat, end_lng):
+    """Key of a transit itinerary in the route cache: nodes of the transit graph closest to both ends"""
+    try:
+        node_index = graph_registry.get("transit").node_index
+    except Exception as e:
+        log(f"Transit route cache disabled: {e}")
+        return None
+    return ("transit", node_index.nearest_nodes(start_lat, start_lng, 1)[0],
+            node_index.nearest_nodes(end_lat, end_lng, 1)[0])
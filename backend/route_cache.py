@@ -0,0 +1,92 @@
+import json
+import os
+
+from cache import TTLCache
+
+ROUTE_CACHE_SIZE = int(os.environ.get("ROUTE_CACHE_SIZE", 4096))
+ROUTE_CACHE_MAX_BYTES = int(os.environ.get("ROUTE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Les itinéraires MTAG dépendent de l'heure de départ : ils ne restent valables que peu de temps
+ROUTE_CACHE_TRANSIT_TTL = float(os.environ.get("ROUTE_CACHE_TRANSIT_TTL", 300))
+
+# Taille approximative d'un noeud dans une liste Python : tuple de deux floats + pointeur
+_BYTES_PER_NODE = 56 + 2 * 24 + 8
+
+NO_PATH = ()
+
+
+def path_size(path):
+    return 64 + _BYTES_PER_NODE * len(path)
+
+
+def result_size(result):
+    # Le JSON encodé donne un ordre de grandeur (les objets Python prennent plus de place)
+    return 2 * len(json.dumps(result))
+
+
+class RouteCache:
+    """
+    Cache of /api/optimize results keyed by (transport_mode, snapped start, snapped end, ...)
+
+    - paths found on the graph of a mode (NO_PATH when the ends are not connected), so
+      that near-duplicate requests snapping to the same nodes skip the search; the
+      response is still built around the real start and end points of each request
+    - transit itineraries from MTAG, which expire after ROUTE_CACHE_TRANSIT_TTL seconds
+
+    Both are LRU caches bounded by number of entries and approximate memory use.
+    invalidate() drops the entries of reloaded graphs, invalidate_edges() only the paths
+    going through edges that were closed or slowed down.
+    """
+
+    def __init__(self, max_size=None, max_bytes=None, transit_ttl=None):
+        max_size = max_size or ROUTE_CACHE_SIZE
+        max_bytes = max_bytes or ROUTE_CACHE_MAX_BYTES
+        transit_ttl = transit_ttl if transit_ttl is not None else ROUTE_CACHE_TRANSIT_TTL
+        self.paths = TTLCache(max_size=max_size, max_weight=max_bytes, weigher=path_size)
+        self.transit = TTLCache(max_size=max_size, ttl=transit_ttl or None,
+                                max_weight=max_bytes, weigher=result_size)
+
+    def get_path(self, key):
+        """Cached path (tuple of nodes), NO_PATH, or None on a miss"""
+        return self.paths.get(key)
+
+    def set_path(self, key, path):
+        self.paths.set(key, tuple(path) if path else NO_PATH)
+
+    def get_transit(self, key):
+        return self.transit.get(key)
+
+    def set_transit(self, key, result):
+        self.transit.set(key, result)
+
+    def invalidate(self, modes=None):
+        """Drop the entries computed on the graphs of the given modes (all by default)"""
+        for cache in (self.paths, self.transit):
+            if modes is None:
+                cache.clear()
+                continue
+            for key, _, _ in cache.items():
+                if key[0] in modes:
+                    cache.pop(key)
+
+    def invalidate_edges(self, transport_mode, edges):
+        """
+        Drop the cached paths of a mode going through any of the given edges (u, v)
+
+        Enough when the edges only got more expensive: the other paths are still the best.
+        """
+        edges = set(edges)
+        for key, path, _ in self.paths.items():
+            if key[0] == transport_mode and any(step in edges for step in zip(path, path[1:])):
+                self.paths.pop(key)
+
+    def invalidate_transit(self, source):
+        """Drop the transit itineraries computed by a source ("mtag" or "local")"""
+        for key, result, _ in self.transit.items():
+            if result.get("source") == source:
+                self.transit.pop(key)
+
+    def stats(self):
+        return {"paths": self.paths.stats(), "transit": self.transit.stats()}
+
+
+route_cache = RouteCache()
@@ -0,0 +1,188 @@
+import bisect
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import box, shape
+
+from geocoding import normalize_address
+from routing_graph import ROADS_FILE
+
+# Nombre d'objets envoyés par morceau dans une réponse en streaming
+STREAM_CHUNK_SIZE = 500
+
+
+def parse_maxspeed(value):
+    """Leading integer of an OSM maxspeed ("50", "30 mph"...), or None ("none", "FR:urban"...)"""
+    if value is None:
+        return None
+    match = re.match(r"\s*(\d+)", str(value))
+    return int(match.group(1)) if match else None
+
+
+class FeatureIndex:
+    """
+    Indexes over the features of one version of the road network file
+
+    - an inverted index highway -> feature ids
+    - the features with a numeric maxspeed sorted by speed (a "maxspeed <= x" filter is
+      one bisection) and the ids of the features without one
+    - an inverted index of the normalized name tokens (prefix match on each token)
+    - the one-way features and an STRtree over the geometries for bbox queries
+    - every feature already encoded as JSON, so that answers only concatenate bytes
+
+    A query starts from the smallest candidate list given by an index, then checks the
+    other filters on those candidates with per-feature arrays. The index is never
+    changed once built, so the ids of a query always match the features it streams.
+    """
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        with open(self.path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        features = data.pop("features", [])
+
+        encoded = []
+        geometries = []
+        highway_ids = {}
+        token_ids = {}
+        speeds = np.full(len(features), np.nan)
+        oneway = np.zeros(len(features), dtype=bool)
+        highways = []
+
+        for i, feature in enumerate(features):
+            props = feature.get("properties") or {}
+            encoded.append(json.dumps(feature, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            geometries.append(shape(feature["geometry"]) if feature.get("geometry") else shapely.Point())
+            highway = props.get("highway")
+            highways.append(highway)
+            highway_ids.setdefault(highway, []).append(i)
+            speed = parse_maxspeed(props.get("maxspeed"))
+            if speed is not None:
+                speeds[i] = speed
+            oneway[i] = props.get("oneway") == "yes"
+            for token in set(normalize_address(props.get("name") or "").split()):
+                token_ids.setdefault(token, []).append(i)
+
+        with_speed = np.flatnonzero(~np.isnan(speeds))
+        order = np.argsort(speeds[with_speed], kind="stable")
+
+        self.header = data
+        self.encoded = encoded
+        self.geometries = np.array(geometries, dtype=object)
+        self.tree = STRtree(self.geometries)
+        self.highways = np.array(highways, dtype=object)
+        self.highway_ids = {highway: np.array(ids, dtype=np.int64) for highway, ids in highway_ids.items()}
+        self.speeds = speeds
+        self.sorted_speeds = speeds[with_speed][order]
+        self.speed_ids = with_speed[order]
+        self.no_speed_ids = np.flatnonzero(np.isnan(speeds))
+        self.oneway = oneway
+        self.oneway_ids = {True: np.flatnonzero(oneway), False: np.flatnonzero(~oneway)}
+        self.tokens = sorted(token_ids)
+        self.token_ids = {token: np.array(ids, dtype=np.int64) for token, ids in token_ids.items()}
+        print(f"Indexed {len(features)} road features of {self.path}")
+
+    def _name_ids(self, name):
+        """Features whose name holds every token of the query (the last one as a prefix)"""
+        tokens = normalize_address(name).split()
+        ids = None
+        for n, token in enumerate(tokens):
+            if n == len(tokens) - 1:
+                start = bisect.bisect_left(self.tokens, token)
+                end = bisect.bisect_left(self.tokens, token + "\uffff")
+                postings = [self.token_ids[t] for t in self.tokens[start:end]]
+                matches = np.unique(np.concatenate(postings)) if postings else np.empty(0, dtype=np.int64)
+            else:
+                matches = self.token_ids.get(token, np.empty(0, dtype=np.int64))
+            ids = matches if ids is None else np.intersect1d(ids, matches, assume_unique=True)
+        return ids if ids is not None else np.arange(len(self.encoded))
+
+    def query(self, route_types=None, max_speed=None, name=None, oneway=None, bbox=None):
+        """
+        Ids (in file order) of the features matching every given filter
+
+        Args:
+            route_types: list of highway values (any of them)
+            max_speed: keep features with maxspeed <= max_speed or without a maxspeed
+            name: words of the street name, accents and case ignored
+            oneway: True/False to keep only one-way/two-way features
+            bbox: (min_lng, min_lat, max_lng, max_lat), keeps the features that intersect it
+        """
+        candidates = {}
+        if route_types:
+            # Un type donné deux fois ne doit pas renvoyer deux fois ses routes
+            ids = [self.highway_ids[t] for t in set(route_types) if t in self.highway_ids]
+            candidates["route_types"] = np.unique(np.concatenate(ids)) if ids else np.empty(0, dtype=np.int64)
+        if max_speed:
+            end = bisect.bisect_right(self.sorted_speeds, max_speed)
+            candidates["max_speed"] = np.concatenate([self.speed_ids[:end], self.no_speed_ids])
+        if name:
+            candidates["name"] = self._name_ids(name)
+        if bbox:
+            candidates["bbox"] = self.tree.query(box(*bbox), predicate="intersects")
+        if oneway is not None:
+            candidates["oneway"] = self.oneway_ids[oneway]
+
+        if not candidates:
+            return np.arange(len(self.encoded))
+
+        # Partir de la plus petite liste et vérifier les autres filtres sur ses éléments seulement
+        first = min(candidates, key=lambda key: len(candidates[key]))
+        ids = candidates[first]
+        if route_types and first != "route_types":
+            ids = ids[np.isin(self.highways[ids], list(route_types))]
+        if max_speed and first != "max_speed":
+            speeds = self.speeds[ids]
+            ids = ids[np.isnan(speeds) | (speeds <= max_speed)]
+        if oneway is not None and first != "oneway":
+            ids = ids[self.oneway[ids] == oneway]
+        if bbox and first != "bbox":
+            ids = ids[shapely.intersects(self.geometries[ids], box(*bbox))]
+        if name and first != "name":
+            ids = np.intersect1d(ids, candidates["name"])
+        return np.sort(ids)
+
+    def stream(self, ids):
+        """Chunks of the FeatureCollection made of the given features"""
+        header = json.dumps(self.header, ensure_ascii=False, separators=(",", ":"))
+        yield (header[:-1] + ("," if len(header) > 2 else "") + '"features":[').encode("utf-8")
+        encoded = self.encoded
+        for start in range(0, len(ids), STREAM_CHUNK_SIZE):
+            chunk = b",".join(encoded[i] for i in ids[start:start + STREAM_CHUNK_SIZE].tolist())
+            yield chunk if start == 0 else b"," + chunk
+        yield b"]}"
+
+
+class RouteIndex:
+    """
+    FeatureIndex of a road network file, for /api/routes/filter, rebuilt when the file changes
+
+    Callers take one index with current() and use it both to query and to stream, so that
+    a rebuild in between cannot pair the ids of one version with the features of another.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """FeatureIndex of the file as it is on disk, built on first use or after a change"""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime, stat.st_size)
+        index = self._index
+        if index is None or index.signature != signature:
+            with self._lock:
+                index = self._index
+                if index is None or index.signature != signature:
+                    index = self._index = FeatureIndex(self.path, signature)
+        return index
+
+
+route_index = RouteIndex(ROADS_FILE)
@@ -0,0 +1,685 @@
+import copy
+import json
+import os
+import threading
+from pathlib import Path
+
+import networkx as nx
+import numpy as np
+
+from csr_graph import CSRGraph, networkx_memory_usage
+from distance import calculate_distance, haversine
+from landmarks import CACHE_DIR, LandmarkIndex, graph_fingerprint, landmark_file
+from metrics import span
+from path_search import component_labels, multi_source_dijkstra
+from spatial_index import NodeIndex
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+ROADS_FILE = os.path.join(BASE_DIR, "grenoble.geojson")
+TRANSPORT_FILE = os.path.join(BASE_DIR, "data_transport_commun_grenoble_formate.geojson")
+if not os.path.exists(TRANSPORT_FILE):
+    # Le fichier formaté (misEnForme.py) contient les mêmes données que l'original
+    TRANSPORT_FILE = os.path.join(BASE_DIR, "data_transport_commun_grenoble.geojson")
+
+# Types de routes autorisés pour chaque mode de transport
+# (une liste vide signifie que toutes les LineString sont acceptées)
+ALLOWED_TYPES = {
+    "walking": ["footway", "path", "pedestrian", "steps", "residential", "service"],
+    "cycling": ["cycleway", "residential", "path", "footway", "secondary", "tertiary"],
+    "driving": ["motorway", "trunk", "primary", "secondary", "tertiary", "residential", "service"],
+    "transit": []
+}
+
+# Vitesse moyenne (km/h) utilisée pour estimer les durées de chaque mode
+SPEEDS_KMH = {
+    "walking": 5,
+    "cycling": 15,
+    "driving": 40,
+    "transit": 20
+}
+
+UNKNOWN_STREET = {"name": None, "highway": None, "destination": None}
+
+# Changements applicables aux arêtes d'une feature (voir GraphRegistry.update_edges)
+EDGE_ACTIONS = ("close", "factor", "restore")
+
+
+def load_features(transport_mode, roads_file=None, transport_file=None):
+    """Load the LineString features used to build the graph of a transport mode"""
+    with open(roads_file or ROADS_FILE, 'r') as file:
+        features = json.load(file)["features"]
+
+    if transport_mode == "transit":
+        with open(transport_file or TRANSPORT_FILE, 'r') as file:
+            transport_data = json.load(file)
+        features = features + [f for f in transport_data["features"]
+                               if f.get("geometry", {}).get("type") == "LineString"]
+
+    return features
+
+
+def feature_id(feature):
+    """OSM id of a feature ("way/123" in Overpass exports), or the route_id of a transit line"""
+    props = feature.get("properties", {})
+    value = feature.get("id", props.get("@id", props.get("id", props.get("route_id"))))
+    return str(value) if value is not None else None
+
+
+def _share_adjacency(graph, nodes):
+    """
+    Copy of a graph sharing its storage, except the neighbor dicts of the given nodes
+
+    Only the outer adjacency dicts (one entry per node) and the neighbor dicts of
+    `nodes` are copied, so that the edges around these nodes can be changed without
+    touching the original graph, still read by other requests.
+    """
+    shared = graph.__class__()
+    shared.graph.update(graph.graph)
+    shared._node = graph._node
+    shared._adj = dict(graph._adj)
+    for node in nodes:
+        shared._adj[node] = dict(graph._adj[node])
+    if graph.is_directed():
+        shared._pred = dict(graph._pred)
+        for node in nodes:
+            shared._pred[node] = dict(graph._pred[node])
+    return shared
+
+
+def build_street_index(valid_features):
+    """
+    Map every graph node to the street it belongs to
+
+    Returns:
+        dict node -> {"name", "highway", "destination"} taken from the first feature
+        going through the node (the first named one for the name)
+    """
+    streets = {}
+    for feature in valid_features:
+        props = feature.get("properties", {})
+        coords = feature["geometry"]["coordinates"]
+        if len(coords) < 2:
+            continue
+        for coord in coords:
+            node = tuple(coord)
+            info = streets.get(node)
+            if info is None:
+                streets[node] = {
+                    "name": props.get("name"),
+                    "highway": props.get("highway"),
+                    "destination": props.get("destination")
+                }
+                continue
+            if info["name"] is None and "name" in props:
+                info["name"] = props["name"]
+            if info["destination"] is None and "destination" in props:
+                info["destination"] = props["destination"]
+    return streets
+
+
+def build_graph(transport_mode, features):
+    """
+    Build the routing graph of a transport mode from GeoJSON features
+
+    Args:
+        transport_mode: one of the keys of ALLOWED_TYPES
+        features: list of GeoJSON features (non LineString features are ignored), the
+            "feature" attribute of each edge is the index of its feature in this list
+
+    Returns:
+        tuple (graph, valid_features) - always a DiGraph for driving to respect one-way streets
+    """
+    G = nx.DiGraph() if transport_mode == "driving" else nx.Graph()
+    allowed = ALLOWED_TYPES[transport_mode]
+
+    valid_features = []
+    segments = []
+    starts = []
+    ends = []
+    for feature_index, feature in enumerate(features):
+        if feature.get("geometry", {}).get("type") != "LineString":
+            continue
+
+        props = feature.get("properties", {})
+        # Skip features that don't match our transport mode
+        if transport_mode != "transit" and props.get("highway") not in allowed:
+            continue
+
+        valid_features.append(feature)
+        coords = feature["geometry"]["coordinates"]
+
+        # Attributs de la rue stockés sur chaque arête pour éviter de reparcourir les features
+        street = {"feature": feature_index, "highway": props.get("highway")}
+        if "name" in props:
+            street["name"] = props["name"]
+        if "destination" in props:
+            street["destination"] = props["destination"]
+
+        segments.append((coords, street, props.get("oneway")))
+        starts.extend(coords[:-1])
+        ends.extend(coords[1:])
+
+    # Longueur de tous les segments de toutes les LineString en un seul calcul vectorisé
+    starts = np.array(starts, dtype=np.float64).reshape(-1, 2)
+    ends = np.array(ends, dtype=np.float64).reshape(-1, 2)
+    weights = iter(haversine(starts[:, 1], starts[:, 0], ends[:, 1], ends[:, 0]).tolist())
+
+    for coords, street, oneway in segments:
+        one_way = oneway == "yes"
+
+        # For one-way streets, we need to check the direction
+        oneway_direction = 1
+        if oneway == "-1" or oneway == "reverse":
+            oneway_direction = -1
+
+        for i in range(len(coords) - 1):
+            node1 = tuple(coords[i])
+            node2 = tuple(coords[i + 1])
+            dist = next(weights)
+
+            G.add_node(node1, pos=node1)
+            G.add_node(node2, pos=node2)
+
+            if one_way and transport_mode == "driving":
+                if oneway_direction == 1:
+                    G.add_edge(node1, node2, weight=dist, oneway=True, **street)
+                else:
+                    G.add_edge(node2, node1, weight=dist, oneway=True, **street)
+            else:
+                G.add_edge(node1, node2, weight=dist, **street)
+                # For non-driving modes or two-way streets, add both directions
+                if G.is_directed():
+                    G.add_edge(node2, node1, weight=dist, **street)
+
+    return G, valid_features
+
+
+class RoutingGraph:
+    """Read-only routing graph of one transport mode, shared across requests"""
+
+    def __init__(self, transport_mode, graph, valid_features=None, streets=None):
+        self.transport_mode = transport_mode
+        self.graph = graph
+        self.valid_features = valid_features
+        self.nodes = list(graph.nodes())
+        self.node_index = NodeIndex(graph)
+        self.components = component_labels(graph)
+        self.streets = streets if streets is not None else build_street_index(valid_features or [])
+        self._landmarks = None
+        self._csr = None
+        self._lock = threading.Lock()
+        # Changements en cours (feature -> (action, facteur)) et arêtes d'origine des features modifiées
+        self.edge_changes = {}
+        self.base_fingerprint = None
+        self._feature_edges = None
+        self._original_edges = {}
+
+    def landmark_index(self):
+        """ALT preprocessing of the graph, loaded from disk or computed on first use"""
+        if self._landmarks is None:
+            with self._lock:
+                if self._landmarks is None:
+                    if self.base_fingerprint is None:
+                        self._landmarks = LandmarkIndex.load_or_build(self.graph, landmark_file(self.transport_mode))
+                    else:
+                        # Graphe modifié : les distances du graphe d'origine restent des bornes
+                        # inférieures, sinon calculer (sans l'enregistrer) celles de ce graphe
+                        self._landmarks = (LandmarkIndex.load(landmark_file(self.transport_mode), self.graph,
+                                                              self.base_fingerprint)
+                                           or LandmarkIndex.build(self.graph))
+        return self._landmarks
+
+    def feature_edges(self):
+        """dict feature index -> edges (u, v) built from it, computed on first use"""
+        if self._feature_edges is None:
+            with self._lock:
+                if self._feature_edges is None:
+                    feature_edges = {}
+                    for u, v, feature in self.graph.edges(data="feature"):
+                        feature_edges.setdefault(feature, []).append((u, v))
+                    self._feature_edges = feature_edges
+        return self._feature_edges
+
+    def patched(self, changes):
+        """
+        Copy of the routing graph with some features closed, reopened or slowed down
+
+        The copy shares the nodes, the spatial index, the street names and the components
+        of this graph; only the neighbor dicts around the changed edges are copied, so
+        that requests still running on this graph are not affected (copy-and-swap).
+        Weights never go below the original ones, so the component labels, the ALT
+        landmarks of the original graph and the haversine bound of the CSR A* stay valid.
+
+        Args:
+            changes: dict feature index -> ("close", None), ("factor", multiplier of the
+                original weights, at least 1) or ("restore", None)
+
+        Returns:
+            tuple (routing graph, changed edges [(u, v), ...], lowered) where lowered
+            tells whether an edge got cheaper or came back, which can shorten any path
+        """
+        feature_edges = self.feature_edges()
+        edges = [(u, v, action, factor) for feature, (action, factor) in changes.items()
+                 for u, v in feature_edges.get(feature, ())]
+        graph = _share_adjacency(self.graph, {node for u, v, _, _ in edges for node in (u, v)})
+        successors = graph._adj
+        # Graphe non orienté : chaque arête est rangée chez ses deux extrémités
+        predecessors = graph._pred if graph.is_directed() else graph._adj
+
+        changed = []
+        weights = {}
+        lowered = False
+        for u, v, action, factor in edges:
+            current = successors[u].get(v)
+            # Au premier changement, l'arête du graphe est encore celle d'origine
+            original = self._original_edges.setdefault((u, v), current)
+            if original is None:
+                continue
+            if action == "close":
+                data = None
+            elif action == "factor":
+                data = dict(original, weight=original["weight"] * factor)
+            else:
+                data = original
+            old_weight = current["weight"] if current is not None else float("inf")
+            new_weight = data["weight"] if data is not None else float("inf")
+            if old_weight == new_weight:
+                continue
+            if data is None:
+                successors[u].pop(v, None)
+                predecessors[v].pop(u, None)
+            else:
+                successors[u][v] = data
+                predecessors[v][u] = data
+            changed.append((u, v))
+            weights[(u, v)] = new_weight
+            if not graph.is_directed():
+                weights[(v, u)] = new_weight
+            lowered = lowered or new_weight < old_weight
+        nx.freeze(graph)
+
+        routing_graph = copy.copy(self)
+        routing_graph.graph = graph
+        routing_graph._lock = threading.Lock()
+        routing_graph.base_fingerprint = self.base_fingerprint or graph_fingerprint(self.graph)
+        routing_graph.edge_changes = dict(self.edge_changes)
+        for feature, change in changes.items():
+            if change[0] == "restore":
+                routing_graph.edge_changes.pop(feature, None)
+            else:
+                routing_graph.edge_changes[feature] = change
+        # Les tableaux CSR gardent leur structure (une arête fermée y pèse l'infini)
+        routing_graph._csr = self._csr.reweighted(weights) if self._csr is not None else None
+        landmarks = self._landmarks
+        routing_graph._landmarks = None
+        if landmarks is not None and landmarks.fingerprint == routing_graph.base_fingerprint:
+            routing_graph._landmarks = landmarks.rebind(graph)
+        return routing_graph, changed, lowered
+
+    def path_cost(self, path):
+        """Sum of the edge weights along a path of the graph, closures and factors included"""
+        adjacency = self.graph._adj
+        return sum(adjacency[u][v]["weight"] for u, v in zip(path, path[1:]))
+
+    def street_at(self, node):
+        """Return the street info ({"name", "highway", "destination"}) of a node"""
+        return self.streets.get(node, UNKNOWN_STREET)
+
+    def snap_candidates(self, lat, lng, k=20, snap="node"):
+        """
+        Find the graph nodes from which a route starting (or ending) at a point can begin
+
+        Args:
+            lat, lng: coordinates of the point
+            k: number of candidate nodes to return
+            snap: "node" to snap onto the nearest vertices, "edge" to snap onto the
+                nearest position along an edge (its endpoints become the first candidates)
+
+        Returns:
+            tuple (candidates, snapped) where candidates are node tuples ordered by
+            preference and snapped is the position on the edge ({"lat", "lng",
+            "distance"}) or None when snapping onto nodes
+        """
+        candidates = self.node_index.nearest_nodes(lat, lng, k)
+        if snap != "edge":
+            return candidates, None
+
+        # L'index est celui du graphe d'origine : ne pas s'accrocher à une route fermée depuis
+        allowed = self.graph.has_edge if self.edge_changes else None
+        edge = self.node_index.snap_to_edge(lat, lng, allowed=allowed)
+        if edge is None:
+            return candidates, None
+
+        endpoints = [edge["u"], edge["v"]] if edge["fraction"] <= 0.5 else [edge["v"], edge["u"]]
+        candidates = endpoints + [node for node in candidates if node not in endpoints]
+        snapped = {"lat": edge["lat"], "lng": edge["lng"], "distance": edge["distance"]}
+        return candidates[:max(k, 2)], snapped
+
+    def csr_graph(self):
+        """Compact array-backed copy of the graph, built on first use"""
+        if self._csr is None:
+            with self._lock:
+                if self._csr is None:
+                    self._csr = CSRGraph.from_networkx(self.graph, self.nodes)
+        return self._csr
+
+    def stats(self):
+        """Size and memory use of the graph and of its optional compact representation"""
+        stats = {
+            "nodes": self.graph.number_of_nodes(),
+            "edges": self.graph.number_of_edges(),
+            "networkx_bytes": networkx_memory_usage(self.graph)
+        }
+        if self._csr is not None:
+            stats["csr_bytes"] = self._csr.memory_usage()
+        if self.edge_changes:
+            stats["changed_features"] = len(self.edge_changes)
+        return stats
+
+    def find_path(self, start_offsets, end_offsets, engine="dijkstra"):
+        """
+        Find the best path between candidate start and end nodes with a single search
+
+        Only the candidates lying in a component shared by both ends are kept when there
+        is one, so that the search never explores a piece of the network that cannot
+        reach the destination.
+
+        Args:
+            start_offsets: dict start candidate -> distance from the real start point
+            end_offsets: dict end candidate -> distance to the real end point
+            engine: "dijkstra", "alt" (A* with landmarks, see landmarks.py) or "csr"
+                (A* on the compact array graph, see csr_graph.py)
+
+        Returns:
+            tuple (path, cost) or (None, inf) if no candidate pair is connected
+        """
+        shared = ({self.components[node] for node in start_offsets}
+                  & {self.components[node] for node in end_offsets})
+        if shared:
+            start_offsets = {node: cost for node, cost in start_offsets.items() if self.components[node] in shared}
+            end_offsets = {node: cost for node, cost in end_offsets.items() if self.components[node] in shared}
+        elif not self.graph.is_directed():
+            # Pas de composante commune : aucun chemin possible dans un graphe non orienté
+            return None, float("inf")
+
+        if engine == "alt":
+            return self.landmark_index().find_path(start_offsets, end_offsets)
+        if engine == "csr":
+            return self.csr_graph().find_path(start_offsets, end_offsets)
+        return multi_source_dijkstra(self.graph, start_offsets, end_offsets)
+
+
+class GraphRegistry:
+    """
+    Keep one routing graph per transport mode in memory
+
+    Graphs are built lazily on first use (or eagerly with preload) and frozen so that
+    concurrent requests can share them safely. reload() drops them so that they are
+    rebuilt from the GeoJSON files, e.g. after the files changed on disk. Whether a
+    mode is stale only depends on its source files, so that the server process, which
+    holds no graph, can tell which graphs of its workers need a reload.
+
+    When an up-to-date binary snapshot exists (see graph_snapshot.py) the graphs are
+    built from its memory-mapped arrays instead of parsing the GeoJSON files. The graphs
+    themselves stay private to each process.
+
+    update_edges() closes, reopens or slows down roads by feature id in the loaded graphs
+    (copy-and-swap, see RoutingGraph.patched). The changes are kept and applied again to
+    the graphs built later, after a reload for instance, until they are restored.
+    """
+
+    def __init__(self, roads_file=None, transport_file=None, snapshot_file=None):
+        self.roads_file = roads_file or ROADS_FILE
+        self.transport_file = transport_file or TRANSPORT_FILE
+        self.snapshot_file = snapshot_file
+        self._snapshot = None
+        self._graphs = {}
+        self._lock = threading.Lock()
+        # Signature des fichiers sources au moment de la construction (ou du dernier rechargement)
+        self._sources = {transport_mode: self._signature(transport_mode) for transport_mode in ALLOWED_TYPES}
+        # (mode, feature id) -> (action, facteur) des changements en cours
+        self._updates = {}
+        self.updates_version = 0
+        # Id de chaque feature, dans l'ordre de load_features("transit")
+        self._feature_ids = None
+
+    def _source_files(self, transport_mode):
+        if transport_mode == "transit":
+            return [self.roads_file, self.transport_file]
+        return [self.roads_file]
+
+    def _signature(self, transport_mode):
+        # La taille en plus de la date : un fichier remplacé par une copie plus ancienne change aussi
+        return tuple((os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else None
+                     for path in self._source_files(transport_mode))
+
+    def _load_snapshot(self):
+        if self._snapshot is None:
+            from graph_snapshot import load_snapshot
+            self._snapshot = load_snapshot(self.snapshot_file) or False
+        return self._snapshot or None
+
+    def _build(self, transport_mode):
+        snapshot = self._load_snapshot()
+        if snapshot is not None:
+            G, streets = snapshot.build_graph(transport_mode)
+            nx.freeze(G)
+            if self._feature_ids is None:
+                self._feature_ids = snapshot.feature_ids
+            routing_graph = RoutingGraph(transport_mode, G, streets=streets)
+        else:
+            features = load_features(transport_mode, self.roads_file, self.transport_file)
+            G, valid_features = build_graph(transport_mode, features)
+            nx.freeze(G)
+            if transport_mode == "transit":
+                # Les routes puis les lignes : la liste de tous les modes
+                self._feature_ids = [feature_id(feature) for feature in features]
+            routing_graph = RoutingGraph(transport_mode, G, valid_features)
+
+        changes = self._feature_changes(transport_mode)
+        if changes:
+            routing_graph, _, _ = routing_graph.patched(changes)
+        return routing_graph
+
+    def _feature_index(self):
+        """dict feature id -> indexes of the features with that id"""
+        if self._feature_ids is None:
+            features = load_features("transit", self.roads_file, self.transport_file)
+            self._feature_ids = [feature_id(feature) for feature in features]
+        index = {}
+        for feature_index, value in enumerate(self._feature_ids):
+            if value is not None:
+                index.setdefault(value, []).append(feature_index)
+        return index
+
+    def _feature_changes(self, transport_mode):
+        """Changes kept for a mode, as RoutingGraph.patched expects them"""
+        updates = [(value, change) for (mode, value), change in self._updates.items() if mode == transport_mode]
+        if not updates:
+            return {}
+        index = self._feature_index()
+        return {feature_index: change for value, change in updates for feature_index in index.get(value, ())}
+
+    def get(self, transport_mode):
+        """Return the RoutingGraph of a transport mode, building it if needed"""
+        if transport_mode not in ALLOWED_TYPES:
+            raise KeyError(f"Unknown transport mode: {transport_mode}")
+
+        routing_graph = self._graphs.get(transport_mode)
+        if routing_graph is not None:
+            return routing_graph
+
+        with self._lock:
+            # Another request may have built it while we were waiting for the lock
+            routing_graph = self._graphs.get(transport_mode)
+            if routing_graph is None:
+                signature = self._signature(transport_mode)
+                with span("graph_build"):
+                    routing_graph = self._build(transport_mode)
+                self._graphs[transport_mode] = routing_graph
+                self._sources[transport_mode] = signature
+                G = routing_graph.graph
+                print(f"Built {transport_mode} graph with {len(G.nodes())} nodes and {len(G.edges())} edges")
+        return routing_graph
+
+    def preload(self, modes=None):
+        """Build the graphs of the given modes (all modes by default)"""
+        for transport_mode in modes or ALLOWED_TYPES:
+            self.get(transport_mode)
+
+    def is_stale(self, transport_mode, signature=None):
+        """
+        True if the GeoJSON files of a mode changed on disk since its last build or reload,
+        or since the given built_sources() signature of another process
+        """
+        return self._signature(transport_mode) != (signature or self._sources[transport_mode])
+
+    def built_sources(self):
+        """Signature of the source files of each graph built in this process"""
+        return {transport_mode: self._sources[transport_mode] for transport_mode in list(self._graphs)}
+
+    def reload(self, modes=None, only_stale=False):
+        """
+        Drop the cached graphs so that they are rebuilt on next use
+
+        Args:
+            modes: transport modes to reload (all modes by default)
+            only_stale: only reload the modes whose source files changed on disk
+
+        Returns:
+            list of the reloaded modes, loaded in this process or not
+        """
+        with self._lock:
+            reloaded = []
+            for transport_mode in modes or ALLOWED_TYPES:
+                if only_stale and not self.is_stale(transport_mode):
+                    continue
+                self._graphs.pop(transport_mode, None)
+                self._sources[transport_mode] = self._signature(transport_mode)
+                reloaded.append(transport_mode)
+            if reloaded:
+                # Le snapshot est relu (ou ignoré s'il est devenu obsolète) à la reconstruction,
+                # les ids des features aussi
+                self._snapshot = None
+                self._feature_ids = None
+        return reloaded
+
+    def update_edges(self, changes):
+        """
+        Close, reopen or slow down roads in the graphs by feature id, without rebuilding them
+
+        Args:
+            changes: list of (transport_mode, feature id, action, factor) where action is
+                "close", "factor" (original weights multiplied by factor, at least 1 so
+                that the preprocessing stays valid) or "restore"
+
+        Returns:
+            tuple (report, unknown): report maps every loaded mode whose graph changed to
+            {"edges": changed edges, "lowered": whether an edge got cheaper or came back},
+            unknown lists the feature ids found in no feature of the GeoJSON files
+
+        Raises:
+            ValueError: unknown mode or action, or factor below 1
+        """
+        for transport_mode, _, action, factor in changes:
+            if transport_mode not in ALLOWED_TYPES:
+                raise ValueError(f"Unknown transport mode: {transport_mode}")
+            if action not in EDGE_ACTIONS:
+                raise ValueError(f"Unknown edge action: {action}")
+            if action == "factor" and not (factor is not None and 1 <= factor < float("inf")):
+                raise ValueError("factor must be a number of at least 1")
+
+        with self._lock:
+            index = self._feature_index()
+            unknown = sorted({value for _, value, _, _ in changes if value not in index})
+            by_mode = {}
+            for transport_mode, value, action, factor in changes:
+                if value not in index:
+                    continue
+                change = (action, factor if action == "factor" else None)
+                if action == "restore":
+                    self._updates.pop((transport_mode, value), None)
+                else:
+                    self._updates[(transport_mode, value)] = change
+                for feature_index in index[value]:
+                    by_mode.setdefault(transport_mode, {})[feature_index] = change
+
+            report = {}
+            for transport_mode, feature_changes in by_mode.items():
+                routing_graph = self._graphs.get(transport_mode)
+                if routing_graph is None:
+                    # Appliqués à la construction du graphe
+                    continue
+                routing_graph, edges, lowered = routing_graph.patched(feature_changes)
+                self._graphs[transport_mode] = routing_graph
+                if edges:
+                    report[transport_mode] = {"edges": edges, "lowered": lowered}
+            self.updates_version += 1
+        return report, unknown
+
+    def updates(self):
+        """(version, {(mode, feature id): (action, factor)}) of the changes in progress"""
+        with self._lock:
+            return self.updates_version, dict(self._updates)
+
+    def sync_updates(self, state):
+        """
+        Apply the changes of another process (its updates()) to this registry
+
+        Used by the routing and matrix workers, which keep their own graphs. The changes
+        may be None when the sender knows this registry already has their version.
+
+        Returns:
+            the report of update_edges, empty if nothing changed
+        """
+        version, updates = state
+        if version == self.updates_version:
+            return {}
+        if updates is None:
+            raise RuntimeError(f"Edge updates {version} missing (worker at version {self.updates_version})")
+        changes = [(mode, value, "restore", None) for mode, value in self._updates if (mode, value) not in updates]
+        changes += [(mode, value, action, factor) for (mode, value), (action, factor) in updates.items()
+                    if self._updates.get((mode, value)) != (action, factor)]
+        report, _ = self.update_edges(changes)
+        self.updates_version = version
+        return report
+
+    def feature_report(self, features):
+        """
+        Where the given features are in the graphs loaded by this process
+
+        Args:
+            features: list of (transport_mode, feature id)
+
+        Returns:
+            tuple (edges, unknown): edges maps every loaded mode among the given ones to
+            the number of its edges built from the features, unknown lists the feature ids
+            found in no feature of the GeoJSON files
+        """
+        with self._lock:
+            index = self._feature_index()
+        unknown = sorted({value for _, value in features if value not in index})
+        edges = {}
+        for transport_mode, value in features:
+            routing_graph = self._graphs.get(transport_mode)
+            if routing_graph is None or value not in index:
+                continue
+            feature_edges = routing_graph.feature_edges()
+            edges[transport_mode] = edges.get(transport_mode, 0) + sum(
+                len(feature_edges.get(feature_index, ())) for feature_index in index[value])
+        return edges, unknown
+
+    def loaded_modes(self):
+        return list(self._graphs)
+
+    def stats(self):
+        return {transport_mode: routing_graph.stats() for transport_mode, routing_graph in self._graphs.items()}
+
+
+graph_registry = GraphRegistry()
+
+
+def graph_stats():
+    """graph_registry.stats() of the process that runs it (a routing worker)"""
+    return {"pid": os.getpid(), "graphs": graph_registry.stats()}
@@ -0,0 +1,351 @@
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from cache import merge_stats
+from graph_updates import sync_updates
+from isochrone import isochrone_cache
+from metrics import log, span
+from route_cache import route_cache
+from routing_graph import graph_registry
+from transit_router import transit_router
+
+# Processus de calcul des itinéraires (0 : calculer dans des threads du serveur)
+ROUTING_WORKERS = int(os.environ.get("ROUTING_WORKERS", min(2, os.cpu_count() or 1)))
+# Calculs en attente ou en cours au-delà desquels les nouvelles requêtes reçoivent un 503
+ROUTING_QUEUE_LIMIT = int(os.environ.get("ROUTING_QUEUE_LIMIT", 32))
+# Délai maximal d'un calcul (secondes) avant de répondre 504
+ROUTING_TIMEOUT = float(os.environ.get("ROUTING_TIMEOUT", 30))
+# Graphes chargés par chaque processus à son démarrage
+ROUTING_PRELOAD_MODES = [mode for mode in os.environ.get(
+    "ROUTING_PRELOAD_MODES", "walking,cycling,driving").split(",") if mode]
+
+
+class PoolSaturated(Exception):
+    """Too many routing computations waiting: the request should be retried later"""
+
+
+class RoutingTimeout(Exception):
+    """The computation did not finish within the routing timeout"""
+
+
+class ClientDisconnected(Exception):
+    """The client went away before the computation finished"""
+
+
+def _preload(modes):
+    # Chaque processus garde ses propres graphes : les charger avant la première requête
+    for transport_mode in modes:
+        try:
+            graph_registry.get(transport_mode)
+        except Exception as e:
+            print(f"Routing worker {os.getpid()} could not preload the {transport_mode} graph: {e}")
+
+
+
+
+# Génération des caches de ce processus (voir RoutingPool.clear_caches)
+_cache_generation = 0
+
+
+def worker_caches():
+    """Statistics of the caches filled by the computations of this process"""
+    return {"route_paths": route_cache.paths.stats(), "isochrones": isochrone_cache.stats()}
+
+
+def clear_worker_caches():
+    """Empty the caches of worker_caches() in this process"""
+    route_cache.invalidate()
+    isochrone_cache.clear()
+
+
+def reload_worker_graphs(modes):
+    """Drop the graphs of some modes in this process, and everything computed from them"""
+    graph_registry.reload(modes)
+    clear_worker_caches()
+    if "walking" in modes or "transit" in modes:
+        # Les trajets à pied des itinéraires locaux suivent le graphe piéton
+        transit_router.reset()
+
+
+def _worker_state():
+    # Pid, caches, signature des fichiers sources des graphes construits par ce processus
+    # et version des changements de routes qu'il a appliqués
+    return os.getpid(), worker_caches(), graph_registry.built_sources(), graph_registry.updates_version
+
+
+def _traced_call(function, args, updates, cache_generation):
+    """
+    Run function in a worker process
+
+    Returns:
+        tuple (result, stages timed, (worker pid, statistics of its caches, sources of its graphs,
+        version of its edge updates))
+    """
+    global _cache_generation
+    trace, token = metrics.start_trace()
+    try:
+        if cache_generation != _cache_generation:
+            clear_worker_caches()
+            _cache_generation = cache_generation
+        # Fermetures et pénalités reçues par le serveur depuis le dernier calcul de ce processus
+        with span("graph_sync"):
+            sync_updates(updates)
+        return function(*args), trace, _worker_state()
+    finally:
+        metrics.end_trace(token)
+
+
+async def _disconnected(request):
+    # Le corps est déjà lu (requêtes GET) : le prochain message est la déconnexion
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+class RoutingPool:
+    """
+    Bounded pool of processes computing routes away from the event loop
+
+    Each worker loads the graphs of ROUTING_PRELOAD_MODES when it starts and keeps its
+    own graphs and path cache; the edge updates of the server are applied to them before
+    each computation. Only their version is sent while every worker reported applying
+    the latest ones. At most queue_limit computations wait or run at once:
+    beyond that run() raises PoolSaturated instead of queueing without bound.
+    A computation that is still queued is dropped when its request times out or its
+    client disconnects; one that already started runs to completion in its worker
+    (and still counts against the limit) but its result is thrown away.
+
+    Every result carries the cache statistics of its worker and the signature of the
+    files its graphs were built from; cache_stats() adds up the latest ones of each
+    worker and stale_modes() compares the others with the files on disk. clear_caches()
+    empties the caches of every worker, each one before its next computation.
+
+    The workers are spawned rather than forked: the server runs threads (event loop,
+    to_thread calls) that a fork would copy in the middle of whatever they were doing.
+    """
+
+    def __init__(self, workers=ROUTING_WORKERS, queue_limit=ROUTING_QUEUE_LIMIT, timeout=ROUTING_TIMEOUT,
+                 preload=ROUTING_PRELOAD_MODES):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.preload = preload
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._worker_caches = {}
+        self._worker_sources = {}
+        self._worker_versions = {}
+        self.cache_generation = 0
+        self.counts = {"completed": 0, "rejected": 0, "timeouts": 0, "disconnected": 0, "restarts": 0}
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.workers > 0:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context("spawn"),
+                                                         initializer=_preload, initargs=(self.preload,))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                                                        thread_name_prefix="routing")
+            return self._executor
+
+    def start(self):
+        """Start the workers now (they load their graphs in the background)"""
+        if self.workers > 0:
+            executor = self._get_executor()
+            for _ in range(self.workers):
+                # Chaque processus signale ses graphes une fois chargés
+                executor.submit(_worker_state).add_done_callback(
+                    functools.partial(self._record_state, executor, None))
+            log(f"Routing pool started with {self.workers} workers preloading {', '.join(self.preload)}")
+
+    def shutdown(self):
+        """Stop the workers; the next computation starts new ones (after a graph reload for instance)"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            # Les nouveaux processus partent avec des caches vides
+            self._worker_caches = {}
+            self._worker_sources = {}
+            self._worker_versions = {}
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.counts["restarts"] += 1
+
+    def _updates_state(self):
+        """graph_registry.updates() for the workers, without the changes while none is behind"""
+        version = graph_registry.updates_version
+        pids = self.worker_pids()
+        with self._lock:
+            current = pids and all(self._worker_versions.get(pid) == version for pid in pids)
+        if current:
+            return version, None
+        return graph_registry.updates()
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _record_state(self, executor, index, future):
+        # Même quand la requête a abandonné le résultat, les caches du processus ont changé
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        pid, caches, sources, version = result[index] if index is not None else result
+        with self._lock:
+            # Résultat d'un processus arrêté depuis : ses caches ont disparu avec lui
+            if executor is self._executor:
+                self._worker_caches[pid] = caches
+                self._worker_sources[pid] = sources
+                # Les résultats d'un même processus peuvent arriver dans le désordre
+                self._worker_versions[pid] = max(version, self._worker_versions.get(pid, version))
+
+    def _submit(self, function, args):
+        with self._lock:
+            if self._pending >= self.queue_limit:
+                self.counts["rejected"] += 1
+                raise PoolSaturated(f"{self._pending} routing computations pending")
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            if self.workers > 0:
+                future = executor.submit(_traced_call, function, args, self._updates_state(),
+                                         self.cache_generation)
+            else:
+                # Le thread hérite de la requête en cours : ses étapes vont directement dans sa trace
+                future = executor.submit(contextvars.copy_context().run, function, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        # Libérer la place quand le calcul est vraiment fini (ou retiré de la file), pas
+        # quand la requête abandonne
+        future.add_done_callback(self._release)
+        if self.workers > 0:
+            future.add_done_callback(functools.partial(self._record_state, executor, 2))
+        return asyncio.wrap_future(future)
+
+    async def run(self, function, *args, request=None):
+        """
+        function(*args) in a worker, within the routing timeout
+
+        Raises:
+            PoolSaturated: queue_limit computations are already pending
+            RoutingTimeout: no result within the timeout
+            ClientDisconnected: the client of request disconnected first
+        """
+        future = self._submit(function, args)
+        watcher = asyncio.ensure_future(_disconnected(request)) if request is not None else None
+        try:
+            done, _ = await asyncio.wait([future] + ([watcher] if watcher else []), timeout=self.timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if future in done:
+                if future.cancelled():
+                    # Processus arrêtés (rechargement des graphes) avant que le calcul ne commence
+                    raise PoolSaturated("Routing workers restarted")
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    # Un processus a été tué (mémoire) : repartir avec des processus neufs
+                    self.shutdown()
+                    raise
+                self.counts["completed"] += 1
+                if self.workers <= 0:
+                    return result
+                result, trace, _ = result
+                metrics.record_spans(trace)
+                return result
+            if watcher in done:
+                self.counts["disconnected"] += 1
+                raise ClientDisconnected()
+            self.counts["timeouts"] += 1
+            raise RoutingTimeout(f"No route within {self.timeout:g} s")
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            if not future.done():
+                future.cancel()
+
+    def clear_caches(self):
+        """Empty the path and isochrone caches of the workers (benchmarks without cache hits)"""
+        if self.workers <= 0:
+            clear_worker_caches()
+        else:
+            # Les processus ne reçoivent rien hors des calculs : la consigne part avec le prochain
+            self.cache_generation += 1
+
+    def stale_modes(self, modes):
+        """
+        Modes whose graph was built by a worker from files that changed on disk since
+
+        A mode that no worker has built yet is not stale: it will be built from the
+        current files.
+        """
+        if self.workers <= 0:
+            built = [graph_registry.built_sources()]
+        else:
+            with self._lock:
+                built = list(self._worker_sources.values())
+        return [transport_mode for transport_mode in modes
+                if any(transport_mode in sources and graph_registry.is_stale(transport_mode, sources[transport_mode])
+                       for sources in built)]
+
+    def reload(self, modes):
+        """Rebuild the graphs of some modes in the workers (with empty caches); new worker
+        processes rebuild all the graphs they preload"""
+        if self.workers <= 0:
+            # Les graphes des threads de calcul sont ceux du serveur
+            reload_worker_graphs(modes)
+        else:
+            # Les processus gardent leur copie des graphes et leurs caches : les remplacer
+            self.shutdown()
+            self.start()
+
+    def worker_pids(self):
+        """Pids of the running worker processes (none with thread workers)"""
+        with self._lock:
+            executor = self._executor
+        if self.workers <= 0 or executor is None:
+            return []
+        return list(executor._processes or {})
+
+    def cache_stats(self):
+        """Statistics of the caches of worker_caches(), summed over the workers"""
+        local = worker_caches()
+        if self.workers <= 0:
+            # Les calculs tournent dans des threads du serveur : ses caches sont ceux des calculs
+            return local
+        with self._lock:
+            reported = list(self._worker_caches.values())
+        if not reported:
+            return local
+        return {name: merge_stats([caches[name] for caches in reported]) for name in local}
+
+    def stats(self):
+        return {"workers": self.workers, "queue_limit": self.queue_limit, "timeout": self.timeout,
+                "pending": self._pending, **self.counts}
+
+
+routing_pool = RoutingPool()
+
+
+def pool_metrics():
+    """Pending computations and outcomes of the routing pool, for /metrics"""
+    stats = routing_pool.stats()
+    prefix = metrics.METRICS_PREFIX + "routing_pool_"
+    return [
+        (prefix + "pending", "gauge", "Route computations waiting or running", [({}, stats["pending"])]),
+        (prefix + "queue_limit", "gauge", "Pending computations beyond which requests get a 503",
+         [({}, stats["queue_limit"])]),
+        (prefix + "computations_total", "counter", "Route computations by outcome",
+         [({"outcome": outcome}, stats[outcome]) for outcome in ("completed", "rejected", "timeouts", "disconnected")])
+    ]
+
+
+metrics.registry.add_collector(pool_metrics)
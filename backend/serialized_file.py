@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # brotli est optionnel : gzip seulement
+    brotli = None
+
+
+class SerializedPayload:
+    """One version of a JSON file, serialized once and compressed in every supported encoding"""
+
+    def __init__(self, body, mtime, size):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.mtime = mtime
+        self.size = size
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=6, mtime=0)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=9)
+        # ETag forte : une valeur différente par encodage, car les octets diffèrent
+        self.etags = {encoding: f'"{digest}-{encoding}"' for encoding in self.bodies}
+
+    def select_encoding(self, accept_encoding):
+        """Best encoding allowed by an Accept-Encoding header (br, then gzip, then none)"""
+        accepted = {}
+        for part in (accept_encoding or "").split(","):
+            name, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            if name:
+                accepted[name.strip().lower()] = quality
+        for encoding in ("br", "gzip"):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+    def not_modified(self, if_none_match, if_modified_since):
+        """True if the client copy (from its conditional headers) is still current"""
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or bool(tags & set(self.etags.values()))
+        if if_modified_since:
+            try:
+                return int(self.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+
+class SerializedFile:
+    """
+    JSON file served as pre-encoded bytes
+
+    The file is parsed once, re-encoded compactly and compressed; requests then only
+    copy bytes. A stat of the file on each access detects changes on disk and triggers
+    a reload.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._payload = None
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def _signature(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime, stat.st_size
+
+    def _is_current(self, signature):
+        payload = self._payload
+        return payload is not None and (payload.mtime, payload.size) == signature
+
+    def get(self):
+        """Current payload, reloaded if the file changed since the last call"""
+        signature = self._signature()
+        if self._is_current(signature):
+            return self._payload
+        with self._lock:
+            signature = self._signature()
+            if not self._is_current(signature):
+                with open(self.path, "r", encoding="utf-8") as file:
+                    data = json.load(file)
+                body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                self._payload = SerializedPayload(body, *signature)
+                self.loads += 1
+                print(f"Serialized {self.path}: {len(body)} bytes, "
+                      + ", ".join(f"{encoding} {len(data)}" for encoding, data in self._payload.bodies.items()
+                                  if encoding != "identity"))
+        return self._payload
+
+    async def get_async(self):
+        """Same as get, but parsing a changed file happens outside of the event loop"""
+        payload = self._payload
+        if payload is not None and self._is_current(self._signature()):
+            return payload
+        return await asyncio.to_thread(self.get)
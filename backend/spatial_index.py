@@ -0,0 +1,173 @@
+import math
+import threading
+
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import Point, LineString
+
+EARTH_RADIUS_KM = 6371
+
+
+class NodeIndex:
+    """
+    Spatial index over the nodes of a routing graph
+
+    Node coordinates are projected once to a local equirectangular plane (in km), which
+    is accurate enough at the scale of a city. Nodes are bucketed in a uniform grid so
+    that the k nearest nodes of a point are found by only looking at the cells around it.
+    Edges are indexed in a shapely STRtree (built on first use) to snap a point onto the
+    closest position of the network, not only onto a vertex.
+    """
+
+    def __init__(self, graph, cell_size_km=0.25, max_rings=32):
+        self.graph = graph
+        self.max_rings = max_rings
+        self.nodes = list(graph.nodes())
+        self.cell_size = cell_size_km
+        self._edge_tree = None
+        self._edges = None
+        self._lock = threading.Lock()
+
+        coords = np.array(self.nodes, dtype=np.float64).reshape(-1, 2)
+        self.ref_lat = float(coords[:, 1].mean()) if len(coords) else 0.0
+        self._cos_ref = math.cos(math.radians(self.ref_lat))
+        self.xy = self._project(coords[:, 0], coords[:, 1])
+
+        # Grille uniforme : cellule (i, j) -> indices des noeuds qu'elle contient
+        self.cells = {}
+        if len(self.nodes):
+            cell_ids = np.floor(self.xy / self.cell_size).astype(np.int64)
+            order = np.lexsort((cell_ids[:, 1], cell_ids[:, 0]))
+            sorted_ids = cell_ids[order]
+            breaks = np.flatnonzero(np.any(np.diff(sorted_ids, axis=0) != 0, axis=1)) + 1
+            for chunk in np.split(order, breaks):
+                key = (int(cell_ids[chunk[0], 0]), int(cell_ids[chunk[0], 1]))
+                self.cells[key] = chunk
+            self._min_cell = cell_ids.min(axis=0)
+            self._max_cell = cell_ids.max(axis=0)
+
+    def _project(self, lon, lat):
+        """Project lon/lat degrees to x/y kilometres around the reference latitude"""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        x = np.radians(lon) * EARTH_RADIUS_KM * self._cos_ref
+        y = np.radians(lat) * EARTH_RADIUS_KM
+        return np.stack([x, y], axis=-1)
+
+    def _unproject(self, x, y):
+        lon = math.degrees(x / (EARTH_RADIUS_KM * self._cos_ref))
+        lat = math.degrees(y / EARTH_RADIUS_KM)
+        return lon, lat
+
+    def nearest_indices(self, lat, lng, k=1):
+        """Return (indices, distances_km) of the k nearest nodes, closest first"""
+        if not self.nodes:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        k = min(k, len(self.nodes))
+        point = self._project(lng, lat)
+        cx, cy = (int(v) for v in np.floor(point / self.cell_size))
+        max_ring = int(max(
+            abs(cx - self._min_cell[0]), abs(cx - self._max_cell[0]),
+            abs(cy - self._min_cell[1]), abs(cy - self._max_cell[1])
+        ))
+
+        # Parcourir des anneaux de cellules de plus en plus grands jusqu'à ce que les k
+        # candidats trouvés soient plus proches que tout noeud hors de la zone explorée
+        found = []
+        for ring in range(min(max_ring, self.max_rings) + 1):
+            for cell in self._ring_cells(cx, cy, ring):
+                chunk = self.cells.get(cell)
+                if chunk is not None:
+                    found.append(chunk)
+
+            if found and sum(len(chunk) for chunk in found) >= k:
+                candidates = np.concatenate(found)
+                dists = np.hypot(*(self.xy[candidates] - point).T)
+                kth = np.partition(dists, k - 1)[k - 1]
+                # Any node outside the explored square is at least this far away
+                if kth <= ring * self.cell_size or ring >= max_ring:
+                    order = np.argsort(dists, kind="stable")[:k]
+                    return candidates[order], dists[order]
+
+        # Point loin du réseau : un calcul vectorisé sur tous les noeuds est plus rapide
+        dists = np.hypot(*(self.xy - point).T)
+        order = np.argsort(dists, kind="stable")[:k]
+        return order, dists[order]
+
+    @staticmethod
+    def _ring_cells(cx, cy, ring):
+        """Cells on the border of the square of half-width ring centered on (cx, cy)"""
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for i in range(cx - ring, cx + ring + 1):
+            yield (i, cy - ring)
+            yield (i, cy + ring)
+        for j in range(cy - ring + 1, cy + ring):
+            yield (cx - ring, j)
+            yield (cx + ring, j)
+
+    def nearest_nodes(self, lat, lng, k=1):
+        """Return the k nearest graph nodes (lon, lat tuples), closest first"""
+        indices, _ = self.nearest_indices(lat, lng, k)
+        return [self.nodes[i] for i in indices]
+
+    def _build_edge_tree(self):
+        with self._lock:
+            if self._edge_tree is None:
+                edges = list(self.graph.edges())
+                position = {node: i for i, node in enumerate(self.nodes)}
+                lines = [LineString([self.xy[position[u]], self.xy[position[v]]]) for u, v in edges]
+                self._edges = edges
+                self._edge_tree = STRtree(lines)
+        return self._edge_tree
+
+    def _nearest_edge(self, tree, point, allowed):
+        """Index of the closest edge accepted by allowed(u, v), None if there is none nearby"""
+        radius = self.cell_size
+        while radius <= self.cell_size * self.max_rings:
+            indices = [i for i in tree.query(point, predicate="dwithin", distance=radius).tolist()
+                       if allowed(*self._edges[i])]
+            if indices:
+                return min(indices, key=lambda i: tree.geometries[i].distance(point))
+            radius *= 2
+        return None
+
+    def snap_to_edge(self, lat, lng, allowed=None):
+        """
+        Snap a point onto the closest edge of the graph
+
+        Args:
+            allowed: optional predicate (u, v) -> bool skipping the edges it rejects
+                (the closed roads of a patched graph, which shares this index)
+
+        Returns:
+            dict with the edge endpoints ("u", "v"), the snapped position ("lat", "lng"),
+            its position along the edge ("fraction", 0 at u and 1 at v) and the distance
+            from the original point ("distance", in km), or None if the graph has no edge
+        """
+        tree = self._build_edge_tree()
+        if not self._edges:
+            return None
+
+        point = Point(self._project(lng, lat))
+        index = int(tree.query_nearest(point, all_matches=False)[0])
+        if allowed is not None and not allowed(*self._edges[index]):
+            index = self._nearest_edge(tree, point, allowed)
+            if index is None:
+                return None
+        line = tree.geometries[index]
+        along = line.project(point)
+        snapped = line.interpolate(along)
+        snapped_lng, snapped_lat = self._unproject(snapped.x, snapped.y)
+        u, v = self._edges[index]
+
+        return {
+            "u": u,
+            "v": v,
+            "lat": snapped_lat,
+            "lng": snapped_lng,
+            "fraction": along / line.length if line.length > 0 else 0.0,
+            "distance": point.distance(snapped)
+        }
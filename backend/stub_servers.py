@@ -0,0 +1,156 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Durée pendant laquelle une requête "bloquée" reste sans réponse (plus que les délais des clients)
+HANG_SECONDS = 30
+
+
+class StubServer:
+    """
+    Local HTTP server answering GET requests with recorded JSON responses
+
+    routes maps a path prefix to a list of encoded bodies (replayed in turn) or to a
+    function (path, query dict) -> JSON-serializable answer. Faults can be injected:
+    latency (seconds, plus up to jitter), error_rate (share of 503 answers) and
+    hang_rate (share of requests left without answer for HANG_SECONDS).
+    """
+
+    def __init__(self, routes, latency=0.0, jitter=0.0, error_rate=0.0, hang_rate=0.0, seed=0):
+        self.routes = routes
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.calls = {prefix: 0 for prefix in routes}
+        self.faults = {"errors": 0, "hangs": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # En-têtes et corps sont envoyés séparément : sans cela, l'accusé de réception
+            # retardé ajoute ~40 ms à chaque réponse
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body = stub._answer(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _answer(self, path):
+        url = urlsplit(path)
+        prefix = next((prefix for prefix in self.routes if url.path.startswith(prefix)), None)
+        with self._lock:
+            draw = self._random.random()
+            delay = self.latency + self._random.random() * self.jitter
+            if prefix is not None:
+                index = self.calls[prefix]
+                self.calls[prefix] += 1
+            if draw < self.hang_rate:
+                self.faults["hangs"] += 1
+            elif draw < self.hang_rate + self.error_rate:
+                self.faults["errors"] += 1
+
+        if draw < self.hang_rate:
+            time.sleep(HANG_SECONDS)
+            return 504, b"{}"
+        time.sleep(delay)
+        if prefix is None:
+            return 404, b"{}"
+        if draw < self.hang_rate + self.error_rate:
+            return 503, b'{"error": "injected failure"}'
+
+        responses = self.routes[prefix]
+        if callable(responses):
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            return 200, json.dumps(responses(url.path, query)).encode("utf-8")
+        return 200, responses[index % len(responses)]
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), **self.faults}
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _load_json(paths):
+    documents = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            documents.append(json.load(f))
+    return documents
+
+
+def _schedule(path, query):
+    """Small ficheHoraires answer (two directions, a few stops) for lines without recorded answers"""
+    route = query.get("route", "SEM:A")
+    now = int(time.time() * 1000)
+    return {str(direction): {
+        "arrets": [{"stopId": f"{route}:{direction}:{i}", "stopName": f"Arrêt {i}",
+                    "lat": 45.18 + i * 0.002, "lon": 5.72 + i * 0.002,
+                    "trips": [now + (i * 2 + k * 10) * 60000 for k in range(4)]} for i in range(8)],
+        "prevTime": now - 600000,
+        "nextTime": now + 3600000
+    } for direction in (0, 1)}
+
+
+def mtag_stub(plan_files, schedule_files=(), **faults):
+    """
+    Stub of the MTAG API (MTAG_BASE_URL)
+
+    plan_files hold full OpenTripPlanner answers or single itineraries like
+    tram_route.json; schedule_files recorded /api/ficheHoraires/json answers
+    (a small generated schedule by default).
+    """
+    plans = [data if "plan" in data else {"plan": {"itineraries": [data]}} for data in _load_json(plan_files)]
+    schedules = _load_json(schedule_files)
+    routes = {"/api/routers/default/plan": [json.dumps(plan).encode("utf-8") for plan in plans]}
+    routes["/api/ficheHoraires/json"] = ([json.dumps(schedule).encode("utf-8") for schedule in schedules]
+                                         if schedules else _schedule)
+    return StubServer(routes, **faults)
+
+
+def nominatim_stub(bounds, result_files=(), **faults):
+    """
+    Stub of Nominatim (NOMINATIM_URL is its url + "/search")
+
+    Replays recorded search answers, or places every address at a point of the bounds
+    derived from a hash of the query (the same address always gets the same point).
+    """
+    results = _load_json(result_files)
+    if results:
+        return StubServer({"/search": [json.dumps(result).encode("utf-8") for result in results]}, **faults)
+
+    def search(path, query):
+        address = query.get("q", "")
+        digest = hashlib.sha256(address.encode("utf-8")).digest()
+        u, v = int.from_bytes(digest[:4], "big") / 2 ** 32, int.from_bytes(digest[4:8], "big") / 2 ** 32
+        return [{
+            "lat": str(bounds["min_lat"] + u * (bounds["max_lat"] - bounds["min_lat"])),
+            "lon": str(bounds["min_lng"] + v * (bounds["max_lng"] - bounds["min_lng"])),
+            "display_name": f"{address}, Grenoble, Isère, France"
+        }]
+
+    return StubServer({"/search": search}, **faults)
@@ -0,0 +1,39 @@
+import os
+import random
+import sys
+
+import networkx as nx
+import pytest
+
+# Les modules du backend s'importent à plat, comme quand uvicorn est lancé depuis backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from distance import calculate_distance  # noqa: E402
+
+
+def grid_graph(size=12, directed=False, seed=0):
+    """
+    Small street grid around Grenoble: (lng, lat) nodes, haversine weights (km)
+    stretched at random, a few streets missing and, when directed, a few one-way streets
+    """
+    rng = random.Random(seed)
+    G = nx.DiGraph() if directed else nx.Graph()
+    step = 0.001
+    for i in range(size):
+        for j in range(size):
+            node = (round(5.70 + i * step, 6), round(45.18 + j * step, 6))
+            G.add_node(node, pos=node)
+            for di, dj in ((1, 0), (0, 1)):
+                if i + di >= size or j + dj >= size or rng.random() < 0.1:
+                    continue
+                neighbor = (round(5.70 + (i + di) * step, 6), round(45.18 + (j + dj) * step, 6))
+                weight = calculate_distance(node[1], node[0], neighbor[1], neighbor[0]) * rng.uniform(1, 2)
+                G.add_edge(node, neighbor, weight=weight)
+                if directed and rng.random() > 0.2:
+                    G.add_edge(neighbor, node, weight=weight)
+    return G
+
+
+@pytest.fixture
+def make_grid():
+    return grid_graph
@@ -0,0 +1,23 @@
+from cache import TTLCache, merge_stats
+
+
+def test_merge_stats_adds_up_worker_caches():
+    first = TTLCache(max_size=4, max_weight=100, weigher=len)
+    second = TTLCache(max_size=4, max_weight=100, weigher=len)
+    first.set("a", "xx")
+    first.get("a")
+    first.get("b")
+    second.set("c", "yyy")
+    second.get("c")
+    second.get("c")
+
+    merged = merge_stats([first.stats(), second.stats()])
+
+    assert merged["size"] == 2 and merged["max_size"] == 8
+    assert merged["hits"] == 3 and merged["misses"] == 1
+    assert merged["bytes"] == 5 and merged["max_bytes"] == 200
+    assert merged["hit_ratio"] == 0.75
+
+
+def test_merge_stats_without_lookups():
+    assert merge_stats([TTLCache().stats()])["hit_ratio"] == 0.0
@@ -0,0 +1,93 @@
+import random
+
+import networkx as nx
+import pytest
+
+from csr_graph import CSRGraph
+from distance import calculate_distance
+
+# Les poids sont stockés en float32
+REL = 1e-5
+
+
+def ids(csr, costs):
+    return {csr.position[node]: cost for node, cost in costs.items()}
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_distances_match_networkx(make_grid, directed):
+    graph = make_grid(directed=directed)
+    csr = CSRGraph.from_networkx(graph)
+    start = next(iter(graph.nodes()))
+
+    dist = csr.distances({csr.position[start]: 0.0})
+    expected = nx.single_source_dijkstra_path_length(graph, start)
+
+    assert {csr.nodes[node_id]: cost for node_id, cost in dist.items()} == pytest.approx(expected, rel=REL)
+    cutoff = sorted(expected.values())[len(expected) // 2]
+    assert set(csr.distances({csr.position[start]: 0.0}, cutoff=cutoff)) == {
+        csr.position[node] for node, cost in expected.items() if cost <= cutoff}
+
+
+@pytest.mark.parametrize("directed", [False, True])
+@pytest.mark.parametrize("heuristic", [False, True])
+def test_shortest_path_matches_networkx(make_grid, directed, heuristic):
+    graph = make_grid(directed=directed, seed=5)
+    csr = CSRGraph.from_networkx(graph)
+    rng = random.Random(6)
+    nodes = list(graph.nodes())
+
+    for _ in range(50):
+        start, end = rng.sample(nodes, 2)
+        path, cost = csr.shortest_path({csr.position[start]: 0.0}, {csr.position[end]: 0.0}, heuristic=heuristic)
+        try:
+            expected = nx.dijkstra_path_length(graph, start, end)
+        except nx.NetworkXNoPath:
+            assert path is None and cost == float("inf")
+            continue
+        assert cost == pytest.approx(expected, rel=REL)
+        assert nx.path_weight(graph, [csr.nodes[node_id] for node_id in path], "weight") == pytest.approx(cost, rel=REL)
+
+
+def test_astar_estimate_never_overestimates(make_grid):
+    # Poids égaux à la distance à vol d'oiseau : sans la marge, l'arrondi float32 rendrait
+    # l'estimation plus grande que le coût restant
+    graph = make_grid(seed=7)
+    for u, v, attributes in graph.edges(data=True):
+        attributes["weight"] = calculate_distance(u[1], u[0], v[1], v[0])
+    csr = CSRGraph.from_networkx(graph)
+    rng = random.Random(8)
+
+    for target in rng.sample(range(csr.number_of_nodes()), 20):
+        estimate = csr._heuristic({target: 0.0})
+        # Graphe non orienté : le coût restant est la distance depuis la cible
+        remaining = csr.distances({target: 0.0})
+        assert all(estimate(node_id) <= cost for node_id, cost in remaining.items())
+
+    nodes = list(graph.nodes())
+    for _ in range(50):
+        sources = {node: rng.uniform(0, 0.05) for node in rng.sample(nodes, 3)}
+        targets = {node: rng.uniform(0, 0.05) for node in rng.sample(nodes, 3)}
+        _, astar = csr.shortest_path(ids(csr, sources), ids(csr, targets), heuristic=True)
+        _, dijkstra = csr.shortest_path(ids(csr, sources), ids(csr, targets), heuristic=False)
+        assert astar == dijkstra
+
+
+def test_reweighted_distances_keep_the_ground_length(make_grid):
+    graph = make_grid(seed=9)
+    csr = CSRGraph.from_networkx(graph)
+    start = csr.position[next(iter(graph.nodes()))]
+    # Graphe non orienté : les deux sens de chaque arête, comme RoutingGraph.patched
+    slow = csr.reweighted({edge: w * 3 for u, v, w in graph.edges(data="weight") for edge in ((u, v), (v, u))})
+
+    dist, lengths = csr.distances({start: 0.0}, lengths=True)
+    slow_dist, slow_lengths = slow.distances({start: 0.0}, lengths=True)
+
+    assert slow_dist == pytest.approx({node_id: 3 * cost for node_id, cost in dist.items()}, rel=REL)
+    assert slow_lengths == pytest.approx(lengths, rel=REL)
+    # Longueur au sol : la distance à vol d'oiseau du point de départ au plus
+    lon, lat = csr.coords[start]
+    for node_id, length in lengths.items():
+        other_lon, other_lat = csr.coords[node_id]
+        assert length <= dist[node_id] + 1e-9
+        assert length >= calculate_distance(lat, lon, other_lat, other_lon) * (1 - REL)
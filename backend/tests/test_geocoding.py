@@ -0,0 +1,75 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import geocoding
+from geocoding import Gazetteer, Geocoder, _strip_city
+from stub_servers import nominatim_stub
+
+BOUNDS = {"min_lat": 45.15, "max_lat": 45.22, "min_lng": 5.68, "max_lng": 5.78}
+
+
+@pytest.mark.parametrize("key, expected", [
+    ("rue x 38000 grenoble", "rue x"),
+    ("rue x 38100 grenoble", "rue x"),
+    ("rue x grenoble france", "rue x"),
+    ("rue x grenoble", "rue x"),
+    ("rue x france", "rue x"),
+    ("rue x", "rue x"),
+])
+def test_city_suffix_is_stripped(key, expected):
+    assert _strip_city(key) == expected
+
+
+def test_lookup_with_postcode():
+    gazetteer = Gazetteer({"rue felix poulat": {"lat": 45.19, "lng": 5.72, "display_name": "Rue Félix Poulat"}})
+
+    assert gazetteer.lookup("Rue Félix-Poulat, 38000 Grenoble")["lat"] == 45.19
+    assert gazetteer.lookup("rue felix poula", fuzzy=False)["lat"] == 45.19  # préfixe
+    assert gazetteer.lookup("rue flix poulat", fuzzy=False) is None
+    assert gazetteer.lookup("rue flix poulat")["lat"] == 45.19
+
+
+@pytest.fixture
+def roads_file(tmp_path):
+    path = tmp_path / "roads.geojson"
+    path.write_text(json.dumps({"type": "FeatureCollection", "features": [{
+        "type": "Feature",
+        "properties": {"name": "Rue Félix Poulat", "highway": "residential"},
+        "geometry": {"type": "LineString", "coordinates": [[5.720, 45.190], [5.722, 45.191]]}
+    }]}), encoding="utf-8")
+    return str(path)
+
+
+def test_geocode_order_and_batched_saves(tmp_path, roads_file, monkeypatch):
+    cache_file = str(tmp_path / "geocode_cache.json")
+    monkeypatch.setattr(geocoding, "GEOCODE_CACHE_SAVE_EVERY", 2)
+
+    with nominatim_stub(BOUNDS) as stub:
+        monkeypatch.setattr(geocoding, "NOMINATIM_URL", stub.url + "/search")
+        geocoder = Geocoder(cache_file=cache_file, roads_file=roads_file,
+                            transport_file=str(tmp_path / "missing.geojson"))
+
+        async def scenario():
+            results = [await geocoder.geocode("rue felix poulat, 38000 Grenoble"),
+                       await geocoder.geocode("Rue Félix Poullat"),
+                       await geocoder.geocode("12 avenue Alsace-Lorraine"),
+                       await geocoder.geocode("12 Avenue Alsace Lorraine")]
+            # Une seule nouvelle réponse : rien n'est encore écrit
+            saved_early = os.path.exists(cache_file)
+            results.append(await geocoder.geocode("3 cours Berriat"))
+            await geocoder._save_task
+            await geocoder.geocode("8 rue Thiers")
+            await geocoder.close()
+            return results, saved_early
+
+        results, saved_early = asyncio.run(scenario())
+
+    assert [result["source"] for result in results] == ["gazetteer", "gazetteer", "nominatim", "cache", "nominatim"]
+    assert not saved_early
+    assert stub.stats()["calls"]["/search"] == 3
+    # Écrit au bout de deux réponses, puis à la fermeture
+    with open(cache_file, "r", encoding="utf-8") as f:
+        assert {key for key, _, _ in json.load(f)} == {"12 avenue alsace lorraine", "3 cours berriat", "8 rue thiers"}
@@ -0,0 +1,84 @@
+import json
+
+from routing_graph import ALLOWED_TYPES, GraphRegistry
+
+
+def write_geojson(path, features):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": features}, file)
+
+
+def street(osm_id, coordinates):
+    return {"type": "Feature", "properties": {"@id": osm_id, "highway": "residential"},
+            "geometry": {"type": "LineString", "coordinates": coordinates}}
+
+
+def test_reload_only_stale_uses_the_source_files(tmp_path):
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18]])])
+    write_geojson(transport, [])
+    registry = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+
+    # Aucun graphe chargé dans ce processus : seuls les fichiers comptent
+    assert registry.reload(only_stale=True) == []
+
+    write_geojson(transport, [street("line/A", [[5.72, 45.18], [5.72, 45.19]])])
+    assert registry.reload(only_stale=True) == ["transit"]
+    assert registry.reload(only_stale=True) == []
+
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18]]),
+                          street("way/2", [[5.73, 45.18], [5.74, 45.18]])])
+    assert sorted(registry.reload(only_stale=True)) == sorted(ALLOWED_TYPES)
+    assert registry.reload(["walking"]) == ["walking"]
+
+
+def test_reload_drops_the_built_graph(tmp_path):
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18], [5.73, 45.19]])])
+    write_geojson(transport, [])
+    registry = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    walking = registry.get("walking")
+
+    assert not registry.is_stale("walking")
+    assert registry.reload(["walking"], only_stale=True) == []
+    assert registry.get("walking") is walking
+
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18]])])
+    assert registry.is_stale("walking")
+    assert registry.reload(["walking"], only_stale=True) == ["walking"]
+    assert registry.get("walking") is not walking
+    assert len(registry.get("walking").graph) == 2
+
+
+def test_feature_report_counts_the_edges_of_loaded_graphs(tmp_path):
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18], [5.73, 45.19]]),
+                          street("way/2", [[5.73, 45.19], [5.74, 45.19]])])
+    write_geojson(transport, [])
+    registry = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    registry.get("walking")
+    registry.update_edges([("walking", "way/1", "factor", 2.0)])
+
+    edges, unknown = registry.feature_report([("walking", "way/1"), ("driving", "way/2"), ("walking", "way/9")])
+
+    # Le graphe driving n'est pas chargé dans ce processus
+    assert edges == {"walking": 2}
+    assert unknown == ["way/9"]
+
+
+def test_staleness_against_the_graphs_of_another_process(tmp_path):
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18]])])
+    write_geojson(transport, [])
+    worker = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    server = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    worker.get("walking")
+    built = worker.built_sources()
+
+    assert list(built) == ["walking"]
+    assert not server.is_stale("walking", built["walking"])
+
+    write_geojson(roads, [street("way/1", [[5.72, 45.18], [5.73, 45.18], [5.73, 45.19]])])
+    # Le serveur n'a rien construit : seule la signature du processus de calcul dit si son graphe est périmé
+    server.reload(only_stale=True)
+    assert server.is_stale("walking", built["walking"])
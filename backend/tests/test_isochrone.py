@@ -0,0 +1,20 @@
+from isochrone import compute_isochrones, isochrone_cache
+from routing_graph import RoutingGraph
+
+
+def test_cached_answer_keeps_the_requested_start(make_grid):
+    isochrone_cache.clear()
+    routing_graph = RoutingGraph("walking", make_grid())
+    node = routing_graph.node_index.nearest_nodes(45.185, 5.705, 1)[0]
+
+    # Deux points différents rattachés au même noeud du réseau
+    first = compute_isochrones(routing_graph, "walking", node[1] + 0.0001, node[0], [5, 10])
+    second = compute_isochrones(routing_graph, "walking", node[1], node[0] + 0.0001, [10, 5])
+
+    assert isochrone_cache.stats()["hits"] == 1
+    assert second["features"] == first["features"]
+    assert [f["properties"]["minutes"] for f in first["features"]] == [10, 5]
+    assert first["start"]["lat"] == second["start"]["lat"] == node[1]
+    assert first["start"]["distance"] > 0 and second["start"]["distance"] > 0
+    assert first["start"]["distance"] != second["start"]["distance"]
+    isochrone_cache.clear()
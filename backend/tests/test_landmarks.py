@@ -0,0 +1,85 @@
+import os
+import random
+
+import networkx as nx
+import pytest
+
+from landmarks import LandmarkIndex, check_against_networkx, graph_fingerprint
+from path_search import multi_source_dijkstra
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_alt_distances_equal_dijkstra(make_grid, directed):
+    graph = make_grid(directed=directed)
+    index = LandmarkIndex.build(graph, landmark_count=4)
+
+    assert check_against_networkx(graph, index, pairs=200) == []
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_alt_multi_source_matches_multi_source_dijkstra(make_grid, directed):
+    graph = make_grid(directed=directed, seed=1)
+    index = LandmarkIndex.build(graph)
+    rng = random.Random(2)
+    nodes = list(graph.nodes())
+
+    for _ in range(50):
+        sources = {node: rng.uniform(0, 0.2) for node in rng.sample(nodes, 3)}
+        targets = {node: rng.uniform(0, 0.2) for node in rng.sample(nodes, 3)}
+        path, cost = index.find_path(sources, targets)
+        expected_path, expected = multi_source_dijkstra(graph, sources, targets)
+
+        assert cost == pytest.approx(expected)
+        if path is not None:
+            # Le chemin trouvé coûte bien ce qui est annoncé
+            assert sources[path[0]] + nx.path_weight(graph, path, "weight") + targets[path[-1]] == pytest.approx(cost)
+
+
+def test_unreachable_target(make_grid):
+    graph = make_grid()
+    island = (5.5, 45.0)
+    graph.add_node(island, pos=island)
+    index = LandmarkIndex.build(graph)
+
+    assert index.find_path({next(iter(graph.nodes())): 0.0}, {island: 0.0}) == (None, float("inf"))
+
+
+def test_saved_landmarks_are_checked_against_the_graph(make_grid, tmp_path):
+    graph = make_grid()
+    path = str(tmp_path / "landmarks.npz")
+    LandmarkIndex.build(graph).save(path)
+
+    loaded = LandmarkIndex.load(path, graph)
+    assert loaded is not None and loaded.fingerprint == graph_fingerprint(graph)
+    assert check_against_networkx(graph, loaded, pairs=50) == []
+
+    changed = graph.copy()
+    u, v = next(iter(changed.edges()))
+    changed[u][v]["weight"] *= 2
+    assert LandmarkIndex.load(path, changed) is None
+
+
+def test_landmarks_stay_exact_when_weights_only_grow(make_grid):
+    graph = make_grid(seed=3)
+    index = LandmarkIndex.build(graph)
+    slower = graph.copy()
+    rng = random.Random(4)
+    for u, v in rng.sample(list(slower.edges()), 40):
+        slower[u][v]["weight"] *= rng.uniform(1, 5)
+
+    # Les distances du graphe d'origine restent des bornes inférieures
+    assert check_against_networkx(slower, index.rebind(slower), pairs=200) == []
+
+
+def test_save_writes_through_a_file_of_this_process(make_grid, tmp_path, monkeypatch):
+    graph = make_grid()
+    path = str(tmp_path / "landmarks.npz")
+    written = []
+    replace = os.replace
+    monkeypatch.setattr(os, "replace", lambda source, target: written.append(source) or replace(source, target))
+    LandmarkIndex.build(graph).save(path)
+
+    # Deux processus qui enregistrent en même temps n'écrivent pas dans le même fichier temporaire
+    assert written == [f"{path}.{os.getpid()}.tmp.npz"]
+    assert os.listdir(tmp_path) == ["landmarks.npz"]
+    assert LandmarkIndex.load(path, graph) is not None
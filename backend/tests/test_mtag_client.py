@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+import pytest
+
+from mtag_api import MTAGClient, MTAGError, calculate_tram_route
+from stub_servers import StubServer, mtag_stub
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAM_ROUTE = os.path.join(BACKEND_DIR, "tram_route.json")
+SCHEDULE = "/api/ficheHoraires/json"
+
+
+def run(coroutine_function, client):
+    async def main():
+        try:
+            return await coroutine_function()
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def failing_then_ok_seed(error_rate):
+    """Seed of a stub whose first answer is an injected 503 and whose second is not"""
+    for seed in range(1000):
+        rng = random.Random(seed)
+        # Le serveur tire un nombre pour la panne puis un pour la latence à chaque requête
+        first, _, second, _ = (rng.random() for _ in range(4))
+        if first < error_rate <= second:
+            return seed
+    raise AssertionError("no suitable seed")
+
+
+def test_plan_through_stub():
+    with mtag_stub([TRAM_ROUTE]) as stub:
+        client = MTAGClient(base_url=stub.url)
+        route = run(lambda: calculate_tram_route((45.19, 5.72), (45.17, 5.75), client=client), client)
+
+    with open(TRAM_ROUTE, "r", encoding="utf-8") as f:
+        assert route == json.load(f)
+    assert stub.stats()["calls"]["/api/routers/default/plan"] == 1
+
+
+def test_server_errors_are_retried():
+    seed = failing_then_ok_seed(0.5)
+    with mtag_stub([TRAM_ROUTE], error_rate=0.5, seed=seed) as stub:
+        client = MTAGClient(base_url=stub.url, backoff=0.01)
+        data = run(lambda: client.fiche_horaires("A"), client)
+
+    assert set(data) == {"0", "1"}
+    assert stub.stats()["calls"][SCHEDULE] == 2
+    assert stub.stats()["errors"] == 1
+
+
+def test_gives_up_after_max_retries():
+    with mtag_stub([TRAM_ROUTE], error_rate=1.0) as stub:
+        client = MTAGClient(base_url=stub.url, max_retries=3, backoff=0.01)
+        with pytest.raises(MTAGError) as error:
+            run(lambda: client.fiche_horaires("A"), client)
+
+    assert error.value.status_code == 503
+    assert "after 3 attempts" in str(error.value)
+    assert stub.stats()["calls"][SCHEDULE] == 3
+
+
+def test_client_errors_are_not_retried():
+    with StubServer({"/other": [b"{}"]}) as stub:
+        client = MTAGClient(base_url=stub.url, backoff=0.01)
+        with pytest.raises(MTAGError) as error:
+            run(lambda: client.fiche_horaires("A"), client)
+
+    assert error.value.status_code == 404
+    assert stub.stats()["calls"]["/other"] == 0
+
+
+def test_hung_request_stops_at_the_deadline():
+    with mtag_stub([TRAM_ROUTE], hang_rate=1.0) as stub:
+        client = MTAGClient(base_url=stub.url, backoff=0.01)
+        start = time.monotonic()
+        with pytest.raises(MTAGError, match="timed out"):
+            run(lambda: client.get_json(SCHEDULE, deadline=0.5), client)
+
+    assert time.monotonic() - start < 1.5
+    assert stub.stats()["hangs"] >= 1
+
+
+def test_waiting_for_a_slot_counts_in_the_deadline():
+    with mtag_stub([TRAM_ROUTE], latency=2.0) as stub:
+        # Une seule requête à la fois : les autres attendent une place
+        client = MTAGClient(base_url=stub.url, max_concurrency=1)
+
+        async def calls():
+            started = time.monotonic()
+
+            async def call():
+                try:
+                    await client.get_json(SCHEDULE, deadline=0.5)
+                except MTAGError:
+                    pass
+                return time.monotonic() - started
+
+            return await asyncio.gather(*(call() for _ in range(3)))
+
+        durations = run(calls, client)
+
+    assert max(durations) < 1.2
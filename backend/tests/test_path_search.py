@@ -0,0 +1,56 @@
+import random
+
+import networkx as nx
+import pytest
+
+from path_search import component_labels, multi_source_dijkstra
+
+
+def networkx_cost(graph, sources, targets):
+    """Same search with networkx: a virtual start linked to the sources, the targets to a virtual end"""
+    G = graph.to_directed()
+    for node, cost in sources.items():
+        G.add_edge("start", node, weight=cost)
+    for node, cost in targets.items():
+        G.add_edge(node, "end", weight=cost)
+    try:
+        return nx.dijkstra_path_length(G, "start", "end")
+    except nx.NetworkXNoPath:
+        return float("inf")
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_multi_source_matches_networkx(make_grid, directed):
+    graph = make_grid(directed=directed, seed=3)
+    rng = random.Random(4)
+    nodes = list(graph.nodes())
+
+    for _ in range(50):
+        sources = {node: rng.uniform(0, 0.2) for node in rng.sample(nodes, 4)}
+        targets = {node: rng.uniform(0, 0.2) for node in rng.sample(nodes, 4)}
+        path, cost = multi_source_dijkstra(graph, sources, targets)
+
+        assert cost == pytest.approx(networkx_cost(graph, sources, targets))
+        if path is not None:
+            assert path[0] in sources and path[-1] in targets
+            assert sources[path[0]] + nx.path_weight(graph, path, "weight") + targets[path[-1]] == pytest.approx(cost)
+
+
+def test_source_that_is_a_target(make_grid):
+    graph = make_grid()
+    node = next(iter(graph.nodes()))
+
+    assert multi_source_dijkstra(graph, {node: 0.1}, {node: 0.2}) == ([node], pytest.approx(0.3))
+
+
+def test_unreachable_targets(make_grid):
+    graph = make_grid(directed=True)
+    island = (5.5, 45.0)
+    graph.add_node(island, pos=island)
+    labels = component_labels(graph)
+    start = next(iter(graph.nodes()))
+
+    assert labels[island] != labels[start]
+    assert multi_source_dijkstra(graph, {start: 0.0}, {island: 0.0}) == (None, float("inf"))
+    # Noeud absent du graphe : ignoré
+    assert multi_source_dijkstra(graph, {(0.0, 0.0): 0.0}, {start: 0.0}) == (None, float("inf"))
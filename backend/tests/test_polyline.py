@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import polyline
+
+# Exemple de la documentation de Google (Encoded Polyline Algorithm Format)
+GOOGLE_POINTS = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+GOOGLE_ENCODED = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def reference_encode(points, precision=5):
+    """Scalar version of the algorithm, one character at a time"""
+    factor = 10 ** precision
+    result = []
+    previous = (0, 0)
+    for point in points:
+        current = tuple(int(round(value * factor)) for value in point)
+        for value, last in zip(current, previous):
+            value = (value - last) << 1
+            if value < 0:
+                value = ~value
+            while value >= 0x20:
+                result.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            result.append(chr(value + 63))
+        previous = current
+    return "".join(result)
+
+
+def random_points(count, seed):
+    rng = np.random.default_rng(seed)
+    # Des petits pas (tracé d'une rue) et quelques grands sauts, dans les deux sens
+    steps = rng.normal(scale=0.001, size=(count, 2)) * np.where(rng.random((count, 1)) < 0.05, 1000, 1)
+    return np.array([45.18, 5.72]) + np.cumsum(steps, axis=0)
+
+
+def test_google_example():
+    assert polyline.encode(GOOGLE_POINTS) == GOOGLE_ENCODED
+    np.testing.assert_allclose(polyline.decode(GOOGLE_ENCODED), GOOGLE_POINTS)
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_encode_matches_reference(precision):
+    points = random_points(500, seed=precision)
+    assert polyline.encode(points, precision) == reference_encode(points.tolist(), precision)
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_round_trip(precision):
+    points = random_points(1000, seed=10 + precision)
+    decoded = polyline.decode(polyline.encode(points, precision), precision)
+
+    assert decoded.shape == points.shape
+    np.testing.assert_allclose(decoded, np.round(points, precision), atol=10 ** -precision / 2)
+
+
+def test_empty():
+    assert polyline.encode([]) == ""
+    assert polyline.decode("").shape == (0, 2)
+
+
+@pytest.mark.parametrize("encoded", ["_p~iF~ps|U_", "_p~iF", "abc\x1f"])
+def test_invalid_polyline(encoded):
+    with pytest.raises(ValueError):
+        polyline.decode(encoded)
+
+
+def test_format_points():
+    assert polyline.format_points(GOOGLE_POINTS, "polyline") == GOOGLE_ENCODED
+    assert polyline.format_points(GOOGLE_POINTS, "flat") == [38.5, -120.2, 40.7, -120.95, 43.252, -126.453]
+    assert polyline.format_points(GOOGLE_POINTS)[1] == {"lat": 40.7, "lng": -120.95}
+
+
+def test_simplify_stays_within_tolerance():
+    points = random_points(400, seed=3)
+    points = np.array([45.18, 5.72]) + (points - points[0]) / 1000
+    tolerance = 0.005
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[100, 250]] = True
+    kept = polyline.simplify_indices(points, tolerance, keep)
+
+    assert kept[0] == 0 and kept[-1] == len(points) - 1
+    assert {100, 250} <= set(kept.tolist())
+    assert len(kept) < len(points)
+    # Distance (km, plan local) de chaque point retiré au segment simplifié qui le remplace
+    xy = points[:, ::-1] * polyline.KM_PER_DEGREE
+    xy[:, 0] *= np.cos(np.radians(points[:, 0].mean()))
+    for first, last in zip(kept[:-1], kept[1:]):
+        start, chord = xy[first], xy[last] - xy[first]
+        for point in xy[first + 1:last]:
+            t = np.clip((point - start) @ chord / (chord @ chord), 0, 1) if chord @ chord else 0
+            assert np.linalg.norm(point - start - t * chord) <= tolerance + 1e-12
+
+
+def test_join_drops_the_repeated_boundary_points():
+    walk = [(45.18, 5.72), (45.181, 5.721), (45.182, 5.722)]
+    ride = np.array([(45.182, 5.722), (45.182, 5.722), (45.19, 5.73)])
+
+    joined = polyline.join([walk, [], ride, [(45.19, 5.73)]])
+
+    # Seul le premier point de chaque partie est comparé au dernier point gardé
+    assert joined.tolist() == [[45.18, 5.72], [45.181, 5.721], [45.182, 5.722], [45.182, 5.722], [45.19, 5.73]]
+    assert polyline.join([]).shape == (0, 2)
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+import graph_updates
+import matrix
+import road_route
+from distance import calculate_distance
+from route_cache import RouteCache
+from routing_graph import SPEEDS_KMH, GraphRegistry
+
+# Deux chemins de A à C : la diagonale way/1 (par M) et le détour way/2 (par B)
+A, M, C, B = (5.720, 45.180), (5.7225, 45.1825), (5.725, 45.185), (5.725, 45.180)
+
+
+def street(osm_id, coordinates):
+    return {"type": "Feature", "properties": {"@id": osm_id, "highway": "residential", "name": osm_id},
+            "geometry": {"type": "LineString", "coordinates": [list(point) for point in coordinates]}}
+
+
+def filler(osm_id, point, step):
+    # Rue isolée dont les noeuds occupent les candidats voisins d'un point : il ne reste de
+    # candidat relié à l'autre extrémité que le point lui-même
+    return street(osm_id, [(point[0], point[1] + step * (10 + i)) for i in range(25)])
+
+
+def length(points):
+    return sum(calculate_distance(u[1], u[0], v[1], v[0]) for u, v in zip(points, points[1:]))
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    with open(roads, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": [
+            street("way/1", [A, M, C]), street("way/2", [A, B, C]),
+            filler("way/3", A, -0.00001), filler("way/4", C, 0.00001)]}, file)
+    with open(transport, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": []}, file)
+    registry = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    monkeypatch.setattr(road_route, "graph_registry", registry)
+    monkeypatch.setattr(road_route, "route_cache", RouteCache())
+    monkeypatch.setattr(matrix, "graph_registry", registry)
+    return registry
+
+
+def walk(registry):
+    # Les changements invalident les chemins en cache dans le serveur (graph_updates) : ici, repartir de zéro
+    road_route.route_cache = RouteCache()
+    return json.loads(road_route.road_route("walking", A[1], A[0], C[1], C[0]))
+
+
+def seconds(km):
+    return round(km / SPEEDS_KMH["walking"] * 3600)
+
+
+@pytest.mark.parametrize("engine", ["dijkstra", "alt", "csr"])
+def test_factor_raises_the_duration_not_the_distance(registry, engine):
+    route = json.loads(road_route.road_route("walking", A[1], A[0], C[1], C[0], engine=engine))
+    assert route["streetNames"][1] == "way/1"
+    assert route["duration"] == seconds(length([A, M, C]))
+
+    registry.update_edges([("walking", "way/1", "factor", 1.2)])
+    route = walk(registry)
+
+    assert route["streetNames"][1] == "way/1"
+    assert route["distance"] == round(length([A, M, C]), 2)
+    assert route["duration"] == seconds(1.2 * length([A, M, C]))
+
+
+def test_closed_street_is_avoided(registry):
+    registry.update_edges([("walking", "way/1", "close", None)])
+    route = walk(registry)
+
+    assert {"lat": M[1], "lng": M[0]} not in route["route"]
+    assert {"lat": B[1], "lng": B[0]} in route["route"]
+    assert route["distance"] == round(length([A, B, C]), 2)
+    assert route["duration"] == seconds(length([A, B, C]))
+
+
+def test_matrix_factor_raises_the_duration_not_the_distance(registry):
+    registry.update_edges([("walking", "way/1", "factor", 1.2)])
+    rows = matrix.matrix_rows("walking", [(A[1], A[0])], [(C[1], C[0])])
+    distances, durations = matrix._format_row("walking", rows[0])
+
+    assert distances == [round(length([A, M, C]), 3)]
+    assert durations == [seconds(1.2 * length([A, M, C]))]
+
+
+def test_cached_paths_are_dropped_in_both_directions(registry, monkeypatch):
+    cache = RouteCache()
+    monkeypatch.setattr(road_route, "route_cache", cache)
+    monkeypatch.setattr(graph_updates, "route_cache", cache)
+    monkeypatch.setattr(graph_updates, "graph_registry", registry)
+    road_route.road_route("walking", A[1], A[0], C[1], C[0])
+    road_route.road_route("walking", C[1], C[0], A[1], A[0])
+
+    # Clé : mode, noeuds les plus proches du départ et de l'arrivée, accroche
+    assert {key for key, _, _ in cache.paths.items()} == {("walking", A, C, "node"), ("walking", C, A, "node")}
+    road_route.road_route("walking", A[1] + 0.000001, A[0], C[1], C[0])
+    assert cache.paths.stats()["hits"] == 1
+
+    # Graphe piéton non orienté : le chemin de C à A passe par les arêtes (M, A) et (C, M)
+    report, _ = registry.update_edges([("walking", "way/2", "factor", 1.5)])
+    graph_updates.invalidate(report)
+    assert cache.paths.stats()["size"] == 2
+    report, _ = registry.update_edges([("walking", "way/1", "factor", 1.2)])
+    graph_updates.invalidate(report)
+    assert cache.paths.stats()["size"] == 0
+
+
+def test_edge_snapping_skips_closed_streets(registry):
+    near_m = (45.1826, 5.7224)
+    candidates, _ = registry.get("walking").snap_candidates(*near_m, snap="edge")
+    assert M in candidates[:2]
+
+    registry.update_edges([("walking", "way/1", "close", None)])
+    walking = registry.get("walking")
+    candidates, snapped = walking.snap_candidates(*near_m, snap="edge")
+
+    # Le graphe modifié partage l'index des arêtes du graphe d'origine
+    assert walking.graph.has_edge(candidates[0], candidates[1])
+    assert M not in candidates[:2]
+    assert snapped["distance"] > 0.1
@@ -0,0 +1,68 @@
+import json
+import os
+
+import numpy as np
+
+from route_index import RouteIndex
+
+
+def road(osm_id, highway, name=None, maxspeed=None, oneway=None, coordinates=((5.72, 45.18), (5.73, 45.19))):
+    properties = {"@id": osm_id, "highway": highway, "name": name, "maxspeed": maxspeed, "oneway": oneway}
+    return {"type": "Feature", "properties": {k: v for k, v in properties.items() if v is not None},
+            "geometry": {"type": "LineString", "coordinates": [list(c) for c in coordinates]}}
+
+
+def write_roads(path, features):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": features}, file)
+
+
+def streamed(index, ids):
+    return json.loads(b"".join(index.stream(ids)))
+
+
+def test_filters(tmp_path):
+    path = tmp_path / "roads.geojson"
+    write_roads(path, [
+        road("way/1", "primary", "Cours Jean Jaurès", "50"),
+        road("way/2", "residential", "Rue Félix Poulat", "30", "yes"),
+        road("way/3", "primary", "Avenue Alsace Lorraine"),
+        road("way/4", "footway", coordinates=((5.80, 45.25), (5.81, 45.26))),
+    ])
+    index = RouteIndex(str(path)).current()
+
+    assert index.query().tolist() == [0, 1, 2, 3]
+    assert index.query(route_types=["primary"]).tolist() == [0, 2]
+    assert index.query(max_speed=40).tolist() == [1, 2, 3]
+    assert index.query(name="felix pou").tolist() == [1]
+    assert index.query(oneway=True).tolist() == [1]
+    assert index.query(bbox=(5.79, 45.24, 5.82, 45.27)).tolist() == [3]
+    assert index.query(route_types=["primary"], max_speed=40).tolist() == [2]
+
+
+def test_duplicate_route_types(tmp_path):
+    path = tmp_path / "roads.geojson"
+    write_roads(path, [road("way/1", "primary"), road("way/2", "secondary"), road("way/3", "primary")])
+    index = RouteIndex(str(path)).current()
+
+    ids = index.query(route_types=["primary", "primary", "secondary"])
+    assert ids.tolist() == [0, 1, 2]
+    assert len(streamed(index, ids)["features"]) == 3
+
+
+def test_stream_uses_the_queried_version(tmp_path):
+    path = tmp_path / "roads.geojson"
+    write_roads(path, [road("way/1", "primary"), road("way/2", "secondary")])
+    routes = RouteIndex(str(path))
+    index = routes.current()
+    ids = index.query(route_types=["secondary"])
+
+    # Le fichier change entre la requête et l'envoi de la réponse
+    write_roads(path, [road("way/3", "secondary")])
+    os.utime(path, (1, 1))
+    assert routes.current() is not index
+
+    features = streamed(index, ids)["features"]
+    assert [f["properties"]["@id"] for f in features] == ["way/2"]
+    assert routes.current().query(route_types=["secondary"]).tolist() == [0]
+    np.testing.assert_array_equal(index.query(route_types=["secondary"]), ids)
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from route_cache import route_cache
+from routing_graph import graph_registry
+from routing_pool import RoutingPool
+
+
+def remember(key):
+    """Cache a path in the process that runs it and return the size of its path cache"""
+    route_cache.set_path(("walking", key), [(5.72, 45.18), (5.73, 45.19)])
+    return route_cache.paths.stats()["size"]
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_clear_caches_reaches_the_workers(workers):
+    route_cache.invalidate()
+    pool = RoutingPool(workers=workers, preload=[])
+
+    async def main():
+        sizes = [await pool.run(remember, key) for key in ("a", "b")]
+        stats = pool.cache_stats()["route_paths"]
+        pool.clear_caches()
+        sizes.append(await pool.run(remember, "c"))
+        return sizes, stats, pool.cache_stats()["route_paths"], pool.worker_pids()
+
+    try:
+        sizes, stats, cleared, pids = asyncio.run(main())
+    finally:
+        pool.shutdown()
+        route_cache.invalidate()
+
+    assert sizes == [1, 2, 1]
+    assert stats["size"] == 2 and cleared["size"] == 1
+    assert len(pids) == workers
+
+
+def test_updates_are_sent_only_to_workers_behind(monkeypatch):
+    pool = RoutingPool(workers=1, preload=[])
+
+    async def main():
+        await pool.run(len, "a")
+        state = pool._updates_state()
+        # Changement reçu par le serveur : le processus n'a pas encore cette version
+        monkeypatch.setattr(graph_registry, "updates_version", graph_registry.updates_version + 1)
+        behind = pool._updates_state()
+        await pool.run(len, "b")
+        return state, behind, pool._updates_state()
+
+    try:
+        state, behind, synced = asyncio.run(main())
+    finally:
+        pool.shutdown()
+
+    assert state[1] is None
+    assert behind[1] is not None
+    assert synced == (behind[0], None)
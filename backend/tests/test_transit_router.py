@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+import polyline
+from routing_graph import GraphRegistry
+from transit_router import TransitRouter
+
+# Tram A d'ouest en est le long de 45.18, bus 12 vers le nord le long de 5.76 ; le bus part
+# à 220 m du dernier arrêt du tram : correspondance à pied
+TRAM = [(5.70 + i * 0.005, 45.18) for i in range(13)]
+BUS = [(5.76, 45.182 + i * 0.002) for i in range(20)]
+DEPARTURE = 8 * 3600
+
+
+def feature(geometry_type, coordinates, **properties):
+    return {"type": "Feature", "properties": properties,
+            "geometry": {"type": geometry_type, "coordinates": coordinates}}
+
+
+def street(osm_id, points):
+    return feature("LineString", [list(point) for point in points], **{"@id": osm_id, "highway": "residential"})
+
+
+@pytest.fixture(scope="module")
+def router(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("transit")
+    roads, transport = tmp_path / "roads.geojson", tmp_path / "transport.geojson"
+    features = [street("way/1", TRAM), street("way/2", [(5.76, 45.18)] + BUS)]
+    stops = [feature("Point", list(point), name=f"Tram {i}", id=f"T{i}") for i, point in enumerate(TRAM[::2])]
+    stops += [feature("Point", list(point), name=f"Bus {i}", id=f"B{i}") for i, point in enumerate(BUS[::4])]
+    lines = [feature("LineString", [list(point) for point in TRAM], route_id="A"),
+             feature("LineString", [list(point) for point in BUS], route_id="12", route_short_name="12")]
+    with open(roads, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": features}, file)
+    with open(transport, "w", encoding="utf-8") as file:
+        json.dump({"type": "FeatureCollection", "features": stops + lines}, file)
+    registry = GraphRegistry(str(roads), str(transport), snapshot_file=str(tmp_path / "none.snapshot"))
+    return TransitRouter(str(transport), registry.get("walking"))
+
+
+def test_plan_with_a_walking_transfer(router):
+    start, end = (45.1802, 5.7003), (45.2178, 5.7601)
+    plan = router.plan(start, end, departure=DEPARTURE)
+
+    legs = plan["legs"]
+    assert [leg["mode"] for leg in legs] == ["WALK", "TRAM", "WALK", "BUS", "WALK"]
+    assert [leg.get("routeShortName") for leg in legs] == [None, "A", None, "12", None]
+    assert plan["transfers"] == 1
+    assert (legs[0]["from"]["lat"], legs[0]["from"]["lon"]) == start
+    assert (legs[-1]["to"]["lat"], legs[-1]["to"]["lon"]) == end
+    assert legs[1]["from"]["stopId"] == "T0" and legs[1]["to"]["stopId"] == "T6"
+    assert legs[2]["from"]["stopId"] == "T6" and legs[3]["from"]["stopId"] == "B0"
+
+    for leg, following in zip(legs, legs[1:]):
+        assert leg["to"] == following["from"]
+        # Attente à l'arrêt avant de monter, pas avant de marcher
+        assert leg["endTime"] <= following["startTime"]
+        if following["mode"] == "WALK":
+            assert leg["endTime"] == following["startTime"]
+    for leg in legs:
+        assert leg["duration"] == pytest.approx(leg["endTime"] - leg["startTime"])
+        if leg["mode"] != "WALK":
+            assert len(polyline.decode(leg["legGeometry"]["points"])) == leg["legGeometry"]["length"]
+    assert plan["startTime"] == DEPARTURE and plan["endTime"] == legs[-1]["endTime"]
+    assert plan["duration"] == pytest.approx(plan["endTime"] - DEPARTURE)
+    assert plan["walkDistance"] == pytest.approx(sum(leg["distance"] for leg in legs if leg["mode"] == "WALK"))
+    # Le transfert à pied suit la rue entre les deux arrêts
+    assert legs[2]["distance"] == pytest.approx(222, abs=5)
+
+
+def test_opposite_direction_uses_the_reverse_patterns(router):
+    plan = router.plan((45.2178, 5.7601), (45.1802, 5.7003), departure=DEPARTURE)
+
+    assert [leg["mode"] for leg in plan["legs"]] == ["WALK", "BUS", "WALK", "TRAM", "WALK"]
+    assert plan["legs"][3]["to"]["stopId"] == "T0"
+
+
+def test_no_plan_when_walking_is_faster(router):
+    assert router.plan((45.1802, 5.7203), (45.1802, 5.7253), departure=DEPARTURE) is None
+
+
+def test_no_plan_without_service_or_stop(router):
+    # Après le dernier départ
+    assert router.plan((45.1802, 5.7003), (45.2178, 5.7601), departure=25 * 3600) is None
+    # Aucun arrêt à moins de MAX_ACCESS_KM de l'arrivée
+    assert router.plan((45.1802, 5.7003), (45.30, 5.90), departure=DEPARTURE) is None
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import math
+import os
+import threading
+
+import shapely
+from shapely import STRtree
+from shapely.geometry import box, mapping, shape
+
+from cache import TTLCache
+from routing_graph import ROADS_FILE, TRANSPORT_FILE
+from serialized_file import SerializedPayload
+
+TILE_SIZE = 256
+MAX_ZOOM = 22
+# Au-delà de ce niveau, les géométries sont envoyées sans simplification
+MAX_SIMPLIFY_ZOOM = 17
+# Marge autour de chaque tuile (en pixels) pour que les lignes coupées se raccordent
+TILE_BUFFER = 4
+TILE_CACHE_SIZE = int(os.environ.get("TILE_CACHE_SIZE", 2048))
+
+# Aux petits niveaux de zoom, seules les grandes routes sont envoyées (même règle que GeojsonLayer)
+MAJOR_HIGHWAYS = {"motorway", "trunk", "primary", "secondary"}
+MIN_DETAIL_ZOOM = 12
+
+
+def tile_bounds(z, x, y):
+    """(west, south, east, north) in degrees of a Web Mercator (XYZ) tile"""
+    n = 2 ** z
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+class TileLayer:
+    """
+    GeoJSON tiles cut from one dataset
+
+    The features are indexed in a shapely STRtree. A tile only holds the features that
+    intersect it, clipped to the tile (plus a small buffer), simplified to half a pixel
+    and rounded to the pixel grid of its zoom level. Encoded tiles are kept in an LRU
+    cache; the index and the cache are rebuilt when the file changes on disk.
+    """
+
+    def __init__(self, path, major_only_below=None, cache_size=None):
+        self.path = path
+        self.major_only_below = major_only_below
+        self.cache = TTLCache(max_size=cache_size or TILE_CACHE_SIZE)
+        self._signature = None
+        self._tree = None
+        self._geometries = None
+        self._properties = None
+        self._major = None
+        self._lock = threading.Lock()
+
+    def _load(self, signature):
+        with open(self.path, "r", encoding="utf-8") as file:
+            features = json.load(file).get("features", [])
+        geometries, properties, major = [], [], []
+        for feature in features:
+            if not feature.get("geometry"):
+                continue
+            props = feature.get("properties") or {}
+            geometries.append(shape(feature["geometry"]))
+            properties.append(props)
+            major.append(props.get("highway") in MAJOR_HIGHWAYS)
+
+        self._geometries = geometries
+        self._properties = properties
+        self._major = major
+        self._tree = STRtree(geometries)
+        self.cache.clear()
+        self._signature = signature
+        print(f"Indexed {len(geometries)} features of {self.path} for tiles")
+
+    def _ensure_loaded(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime, stat.st_size)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    self._load(signature)
+        return signature
+
+    def _render(self, z, x, y):
+        west, south, east, north = tile_bounds(z, x, y)
+        margin_x = (east - west) * TILE_BUFFER / TILE_SIZE
+        margin_y = (north - south) * TILE_BUFFER / TILE_SIZE
+        clip = box(west - margin_x, south - margin_y, east + margin_x, north + margin_y)
+        # Taille d'un pixel en degrés (la plus petite des deux directions)
+        pixel = min(east - west, north - south) / TILE_SIZE
+        major_only = self.major_only_below is not None and z < self.major_only_below
+
+        features = []
+        for i in sorted(self._tree.query(clip, predicate="intersects").tolist()):
+            if major_only and not self._major[i]:
+                continue
+            geometry = self._geometries[i]
+            if geometry.geom_type != "Point":
+                geometry = geometry.intersection(clip)
+                if z < MAX_SIMPLIFY_ZOOM:
+                    geometry = geometry.simplify(pixel / 2, preserve_topology=False)
+                    geometry = shapely.set_precision(geometry, pixel / 4)
+                if geometry.is_empty:
+                    continue
+            features.append({"type": "Feature", "geometry": mapping(geometry), "properties": self._properties[i]})
+
+        return json.dumps({"type": "FeatureCollection", "features": features},
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def tile(self, z, x, y):
+        """Encoded tile as a SerializedPayload (bodies per encoding and ETags)"""
+        signature = self._ensure_loaded()
+        key = (z, x, y)
+        payload = self.cache.get(key)
+        if payload is None:
+            payload = SerializedPayload(self._render(z, x, y), *signature)
+            self.cache.set(key, payload)
+        return payload
+
+    async def tile_async(self, z, x, y):
+        """Same as tile, but a tile that is not cached is computed outside of the event loop"""
+        if self._signature is not None:
+            payload = self.cache.get((z, x, y), count=False)
+            if payload is not None and os.stat(self.path).st_mtime == self._signature[0]:
+                self.cache.hits += 1
+                return payload
+        return await asyncio.to_thread(self.tile, z, x, y)
+
+    def stats(self):
+        return {"features": len(self._geometries) if self._geometries is not None else None,
+                "cache": self.cache.stats()}
+
+
+tile_layers = {
+    "routes": TileLayer(ROADS_FILE, major_only_below=MIN_DETAIL_ZOOM),
+    "transport": TileLayer(TRANSPORT_FILE)
+}
@@ -0,0 +1,429 @@
+import json
+import math
+import threading
+from datetime import datetime
+
+import numpy as np
+from shapely import STRtree
+from shapely.geometry import LineString, Point
+from shapely.ops import substring
+
+import polyline
+from distance import distances_from, segment_lengths
+from routing_graph import SPEEDS_KMH, graph_registry
+
+# Le fichier de transport ne contient ni horaires ni fréquences : hypothèses par type de ligne
+LINE_TYPES = {
+    "TRAM": {"speed_kmh": 18, "headway": 6 * 60},
+    "BUS": {"speed_kmh": 15, "headway": 12 * 60}
+}
+# Les lignes Chrono (C1, C2...) passent plus souvent que les autres bus
+CHRONO_HEADWAY = 8 * 60
+# Service de 5h30 à 0h30 (secondes depuis minuit)
+SERVICE_START = 5 * 3600 + 30 * 60
+SERVICE_END = 24 * 3600 + 30 * 60
+DWELL_TIME = 20
+BOARDING_SLACK = 30
+
+# Distance maximale entre un arrêt et le tracé d'une ligne pour qu'il soit desservi
+STOP_MATCH_KM = 0.03
+MAX_ACCESS_KM = 1.0
+MAX_TRANSFER_KM = 0.4
+MAX_ROUNDS = 4
+# Distance maximale entre un arrêt et le noeud du réseau piéton auquel il est rattaché
+MAX_STOP_SNAP_KM = 0.3
+
+KM_PER_DEGREE = math.pi * 6371 / 180
+
+
+def _line_type(props):
+    if props.get("type"):
+        return props["type"].upper() if props["type"].upper() in LINE_TYPES else "BUS"
+    route_id = str(props.get("route_id", ""))
+    # Les lignes de tram de Grenoble sont désignées par une lettre (A à E)
+    return "TRAM" if len(route_id) == 1 and route_id.isalpha() else "BUS"
+
+
+class Pattern:
+    """One direction of a line: its stops in order, their position along the line and travel offsets"""
+
+    def __init__(self, route, stops, positions_km, positions_deg, line):
+        self.route = route
+        self.stops = stops
+        self.positions_km = positions_km
+        self.positions_deg = positions_deg
+        self.line = line
+        speed = LINE_TYPES[route["mode"]]["speed_kmh"]
+        self.headway = route["headway"]
+        # Décalages (s) d'arrivée et de départ à chaque arrêt depuis le départ du terminus
+        self.arrival = [0.0]
+        self.departure = [0.0]
+        for i in range(1, len(stops)):
+            travel = abs(positions_km[i] - positions_km[i - 1]) / speed * 3600
+            self.arrival.append(self.departure[-1] + travel)
+            self.departure.append(self.arrival[-1] + DWELL_TIME)
+
+    def next_trip(self, index, time):
+        """Departure time from the first stop of the first trip leaving stop `index` at or after `time`"""
+        offset = self.departure[index]
+        k = max(0, math.ceil((time - SERVICE_START - offset) / self.headway))
+        start = SERVICE_START + k * self.headway
+        return start if start <= SERVICE_END else None
+
+
+class TransitRouter:
+    """
+    Local public transport router (RAPTOR) on the stops and lines of the transport file
+
+    The stops lying within STOP_MATCH_KM of a line are ordered along it, giving one
+    pattern per direction. The file has no timetable, so trips are generated from a
+    headway and a commercial speed per type of line (tram, bus). Walking to the first
+    stop, from the last one and between stops goes through the walking graph.
+
+    plan() returns an itinerary shaped like the MTAG (OpenTripPlanner) answers, so that
+    extract_tram_route turns it into the same segments.
+    """
+
+    def __init__(self, transport_file, walking_graph):
+        self.walking = walking_graph
+        self.csr = walking_graph.csr_graph()
+        self._load(transport_file)
+        self._snap_stops()
+        self._build_transfers()
+
+    def _load(self, transport_file):
+        with open(transport_file, "r", encoding="utf-8") as file:
+            features = json.load(file)["features"]
+
+        self.stops = []
+        for feature in features:
+            if feature.get("geometry", {}).get("type") != "Point":
+                continue
+            props = feature.get("properties", {})
+            lng, lat = feature["geometry"]["coordinates"][:2]
+            self.stops.append({
+                "name": props.get("name", "Arrêt inconnu"),
+                "id": props.get("id"),
+                "station": props.get("parent_station") or props.get("name"),
+                "lat": lat,
+                "lng": lng
+            })
+        stop_points = [Point(stop["lng"], stop["lat"]) for stop in self.stops]
+        tree = STRtree(stop_points)
+
+        lines = [feature for feature in features if feature.get("geometry", {}).get("type") == "LineString"]
+        # Chaque tracé est un sens (ou une variante) de la ligne ; une ligne décrite par un
+        # seul tracé est parcourue dans les deux sens
+        line_counts = {}
+        for feature in lines:
+            route_id = feature.get("properties", {}).get("route_id") or feature.get("properties", {}).get("id")
+            line_counts[route_id] = line_counts.get(route_id, 0) + 1
+
+        self.patterns = []
+        for feature in lines:
+            props = feature.get("properties", {})
+            coords = np.array(feature["geometry"]["coordinates"], dtype=np.float64)[:, :2]
+            line = LineString(coords)
+            mode = _line_type(props)
+            short_name = props.get("route_short_name") or props.get("name") or props.get("route_id", "")
+            headway = LINE_TYPES[mode]["headway"]
+            if mode == "BUS" and str(short_name).startswith("C"):
+                headway = CHRONO_HEADWAY
+            route = {
+                "mode": mode,
+                "short_name": short_name,
+                "route_id": props.get("route_id") or props.get("id", ""),
+                "headway": headway
+            }
+
+            # Longueur cumulée du tracé en degrés (pour project) et en km
+            cumulative_deg = np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))])
+            cumulative_km = np.concatenate([[0.0], np.cumsum(segment_lengths(coords))])
+
+            # Un seul quai par station : le plus proche du tracé
+            matched = {}
+            for i in tree.query(line, predicate="dwithin", distance=STOP_MATCH_KM / KM_PER_DEGREE).tolist():
+                stop = self.stops[i]
+                gap = line.distance(stop_points[i])
+                if stop["station"] not in matched or gap < matched[stop["station"]][1]:
+                    matched[stop["station"]] = (i, gap)
+            if len(matched) < 2:
+                continue
+
+            ordered = sorted((line.project(stop_points[i]), i) for i, _ in matched.values())
+            positions_deg = [position for position, _ in ordered]
+            positions_km = np.interp(positions_deg, cumulative_deg, cumulative_km).tolist()
+            stops = [i for _, i in ordered]
+
+            self.patterns.append(Pattern(route, stops, positions_km, positions_deg, line))
+            if line_counts[route["route_id"]] == 1:
+                self.patterns.append(Pattern(route, stops[::-1], positions_km[::-1], positions_deg[::-1], line))
+
+        self.stop_patterns = [[] for _ in self.stops]
+        for p, pattern in enumerate(self.patterns):
+            for index, stop in enumerate(pattern.stops):
+                self.stop_patterns[stop].append((p, index))
+
+    def _snap_stops(self):
+        """Walking graph node (CSR id) of each stop and the distance to it"""
+        self.stop_nodes = []
+        self.node_stops = {}
+        for s, stop in enumerate(self.stops):
+            indices, distances = self.walking.node_index.nearest_indices(stop["lat"], stop["lng"], 1)
+            if len(indices) == 0 or distances[0] > MAX_STOP_SNAP_KM:
+                self.stop_nodes.append(None)
+                continue
+            node_id = self.csr.position[self.walking.node_index.nodes[indices[0]]]
+            self.stop_nodes.append((node_id, float(distances[0])))
+            self.node_stops.setdefault(node_id, []).append(s)
+
+    def _stops_within(self, sources, cutoff):
+        """Stops reachable on foot: dict stop -> walking distance (km)"""
+        dist = self.csr.distances(sources, cutoff=cutoff)
+        reached = {}
+        for node_id, d in dist.items():
+            for s in self.node_stops.get(node_id, ()):
+                total = d + self.stop_nodes[s][1]
+                if total <= cutoff and total < reached.get(s, float("inf")):
+                    reached[s] = total
+        return reached, dist
+
+    def _build_transfers(self):
+        self.transfers = [[] for _ in self.stops]
+        served = {stop for pattern in self.patterns for stop in pattern.stops}
+        for s in served:
+            if self.stop_nodes[s] is None:
+                continue
+            node_id, offset = self.stop_nodes[s]
+            reached, _ = self._stops_within({node_id: offset}, MAX_TRANSFER_KM)
+            self.transfers[s] = [(t, d) for t, d in reached.items() if t != s and t in served]
+
+    def _point_sources(self, lat, lng, k=5):
+        indices, distances = self.walking.node_index.nearest_indices(lat, lng, k)
+        return {self.csr.position[self.walking.node_index.nodes[i]]: float(d)
+                for i, d in zip(indices.tolist(), distances.tolist())}
+
+    @staticmethod
+    def _walk_seconds(km):
+        return km / SPEEDS_KMH["walking"] * 3600
+
+    def _raptor(self, access, egress, departure):
+        """
+        Earliest arrival search
+
+        Returns:
+            (arrival time, round, last stop, labels) of the best journey or None
+        """
+        INF = float("inf")
+        best = {}
+        labels = [{s: (departure + self._walk_seconds(d), ("access", d)) for s, d in access.items()}]
+        for s, (time, _) in labels[0].items():
+            best[s] = time
+        marked = set(access)
+        best_arrival, best_journey = INF, None
+
+        for k in range(1, MAX_ROUNDS + 1):
+            previous = labels[-1]
+            current = {}
+            # Pour chaque motif, le premier arrêt marqué où l'on peut monter
+            queue = {}
+            for s in marked:
+                for p, index in self.stop_patterns[s]:
+                    if index < queue.get(p, INF):
+                        queue[p] = index
+
+            for p, start in queue.items():
+                pattern = self.patterns[p]
+                trip, board = None, None
+                for index in range(start, len(pattern.stops)):
+                    s = pattern.stops[index]
+                    if trip is not None:
+                        arrival = trip + pattern.arrival[index]
+                        if arrival < min(best.get(s, INF), best_arrival):
+                            best[s] = arrival
+                            current[s] = (arrival, ("ride", p, board, index, trip))
+                    label = previous.get(s)
+                    if label is not None and index < len(pattern.stops) - 1:
+                        ready = label[0] + BOARDING_SLACK
+                        if trip is None or ready <= trip + pattern.departure[index]:
+                            candidate = pattern.next_trip(index, ready)
+                            if candidate is not None and (trip is None or candidate < trip):
+                                trip, board = candidate, index
+
+            # Correspondances à pied depuis les arrêts atteints en véhicule pendant ce tour
+            # (un arrêt atteint en véhicule garde ce label, dont dépendent les correspondances)
+            rides = dict(current)
+            for s, (time, _) in rides.items():
+                for t, d in self.transfers[s]:
+                    arrival = time + self._walk_seconds(d)
+                    if t not in rides and arrival < min(best.get(t, INF), best_arrival):
+                        best[t] = arrival
+                        current[t] = (arrival, ("walk", s, d))
+
+            labels.append(current)
+            for s, (time, _) in current.items():
+                if s in egress and time + self._walk_seconds(egress[s]) < best_arrival:
+                    best_arrival = time + self._walk_seconds(egress[s])
+                    best_journey = (k, s)
+            marked = set(current)
+            if not marked:
+                break
+
+        if best_journey is None:
+            return None
+        return best_arrival, best_journey[0], best_journey[1], labels
+
+    def _walk_leg(self, from_place, to_place, start_time, source_ids, target_ids):
+        """WALK leg along the walking graph between two places ({"name", "lat", "lon"})"""
+        path, cost = self.csr.shortest_path(source_ids, target_ids)
+        nodes = [self.csr.nodes[node_id] for node_id in path] if path else []
+        distance = cost if path else float(distances_from([(from_place["lon"], from_place["lat"])],
+                                                           to_place["lat"], to_place["lon"])[0])
+        duration = self._walk_seconds(distance)
+        steps = []
+        for node in nodes:
+            step = {"lat": node[1], "lon": node[0]}
+            street = self.walking.street_at(node)
+            if street["name"]:
+                step["streetName"] = street["name"]
+            steps.append(step)
+        return {
+            "mode": "WALK",
+            "from": from_place,
+            "to": to_place,
+            "startTime": start_time,
+            "endTime": start_time + duration,
+            "duration": duration,
+            "distance": distance * 1000,
+            "steps": steps
+        }
+
+    def _stop_place(self, s):
+        stop = self.stops[s]
+        return {"name": stop["name"], "stopId": stop["id"], "lat": stop["lat"], "lon": stop["lng"]}
+
+    def _stop_ids(self, s):
+        node_id, offset = self.stop_nodes[s]
+        return {node_id: offset}
+
+    def _ride_leg(self, p, board, alight, trip):
+        pattern = self.patterns[p]
+        route = pattern.route
+        geometry = substring(pattern.line, pattern.positions_deg[board], pattern.positions_deg[alight])
+        points = np.asarray(geometry.coords)[:, ::-1]
+        start_time = trip + pattern.departure[board]
+        end_time = trip + pattern.arrival[alight]
+        return {
+            "mode": route["mode"],
+            "from": self._stop_place(pattern.stops[board]),
+            "to": self._stop_place(pattern.stops[alight]),
+            "startTime": start_time,
+            "endTime": end_time,
+            "duration": end_time - start_time,
+            "distance": abs(pattern.positions_km[alight] - pattern.positions_km[board]) * 1000,
+            "routeShortName": route["short_name"],
+            "routeId": route["route_id"],
+            "headsign": self.stops[pattern.stops[-1]]["name"],
+            "legGeometry": {"points": polyline.encode(points), "length": len(points)}
+        }
+
+    def plan(self, start_coords, end_coords, departure=None):
+        """
+        Best public transport itinerary between two (lat, lng) points
+
+        Args:
+            departure: departure time in seconds since midnight (default: now)
+
+        Returns:
+            itinerary dict in the OpenTripPlanner format (legs, duration, walkDistance),
+            or None if no itinerary uses public transport or walking all the way is faster
+        """
+        if departure is None:
+            now = datetime.now()
+            departure = now.hour * 3600 + now.minute * 60 + now.second
+        start_sources = self._point_sources(*start_coords)
+        end_sources = self._point_sources(*end_coords)
+        access, start_dist = self._stops_within(start_sources, MAX_ACCESS_KM)
+        egress, _ = self._stops_within(end_sources, MAX_ACCESS_KM)
+
+        result = self._raptor(access, egress, departure)
+        if result is None:
+            return None
+        arrival, k, last_stop, labels = result
+
+        # Marcher directement est-il plus rapide ?
+        direct = min((start_dist[n] + d for n, d in end_sources.items() if n in start_dist), default=None)
+        if direct is not None and departure + self._walk_seconds(direct) <= arrival:
+            return None
+
+        # Reconstruire le trajet en remontant les tours
+        rides = []
+        s = last_stop
+        while k > 0:
+            _, parent = labels[k][s]
+            if parent[0] == "walk":
+                rides.append(("walk", parent[1], s))
+                s = parent[1]
+                _, parent = labels[k][s]
+            _, p, board, alight, trip = parent
+            rides.append(("ride", p, board, alight, trip))
+            s = self.patterns[p].stops[board]
+            k -= 1
+        rides.reverse()
+
+        origin = {"name": "Départ", "lat": start_coords[0], "lon": start_coords[1]}
+        destination = {"name": "Arrivée", "lat": end_coords[0], "lon": end_coords[1]}
+        legs = []
+        first_stop = self.patterns[rides[0][1]].stops[rides[0][2]]
+        legs.append(self._walk_leg(origin, self._stop_place(first_stop), departure,
+                                   start_sources, self._stop_ids(first_stop)))
+        for ride in rides:
+            if ride[0] == "walk":
+                _, from_stop, to_stop = ride
+                legs.append(self._walk_leg(self._stop_place(from_stop), self._stop_place(to_stop),
+                                           legs[-1]["endTime"], self._stop_ids(from_stop),
+                                           self._stop_ids(to_stop)))
+            else:
+                legs.append(self._ride_leg(*ride[1:]))
+        legs.append(self._walk_leg(self._stop_place(last_stop), destination, legs[-1]["endTime"],
+                                   self._stop_ids(last_stop), end_sources))
+
+        # Temps d'attente aux arrêts compris
+        return {
+            "startTime": departure,
+            "endTime": legs[-1]["endTime"],
+            "duration": legs[-1]["endTime"] - departure,
+            "walkDistance": sum(leg["distance"] for leg in legs if leg["mode"] == "WALK"),
+            "transfers": sum(1 for leg in legs if leg["mode"] != "WALK") - 1,
+            "legs": legs
+        }
+
+    def stats(self):
+        return {
+            "stops": len(self.stops),
+            "patterns": len(self.patterns),
+            "transfers": sum(len(transfers) for transfers in self.transfers)
+        }
+
+
+class TransitRouterRegistry:
+    """Lazily built TransitRouter, dropped when the walking or transit graph is reloaded"""
+
+    def __init__(self):
+        self._router = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._router is None:
+            with self._lock:
+                if self._router is None:
+                    self._router = TransitRouter(graph_registry.transport_file, graph_registry.get("walking"))
+                    print(f"Local transit router ready: {self._router.stats()}")
+        return self._router
+
+    def reset(self):
+        with self._lock:
+            self._router = None
+
+
+transit_router = TransitRouterRegistry()